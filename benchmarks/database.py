@@ -0,0 +1,95 @@
+from pathlib import Path
+from random import randrange, seed
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.databases.dict import Dict
+from kuisti.databases.indexed import Indexed
+from kuisti.databases.sqlite import Sqlite
+from tempfile import TemporaryDirectory
+
+
+
+# Vertailee tietokantatoteutuksia 10 000 käyttäjän ja 100 000 suodatussäännön tilassa.
+# Ajo: python benchmarks/database.py
+
+USERS = 10_000
+FILTERS_PER_USER = 10
+ROOMS = ["aula", "toimisto", "halli"]
+OPS = 500
+
+
+
+def filterName(user: int, idx: int) -> str:
+
+    return f"kuisti_user{user}@demo.internal:toimisto:10.14.{user // 250}.{user % 250}:default:{idx}"
+
+
+def populate(db) -> None:
+
+    for user in range(USERS):
+
+        userId = f"user{user}@demo.internal"
+        deviceIp = f"10.14.{user // 250}.{user % 250}"
+
+        db.addUser(userId, f"CN=user{user},DC=demo,DC=internal", ["default"])
+
+        for roomName in ROOMS[:2]:
+            db.addUserToRoom(userId, roomName, f"CN=KuistiRoom_{roomName},DC=demo,DC=internal", 0)
+
+        for idx in range(FILTERS_PER_USER):
+            db.addFilter(userId, "default", filterName(user, idx), "toimisto", 0, f"ws{user}", deviceIp, filterConf="{}")
+
+
+def timeIt(label: str, func) -> None:
+
+    start = perf_counter()
+
+    for _ in range(OPS):
+
+        user = randrange(USERS)
+        func(user, f"user{user}@demo.internal")
+
+    elapsed = perf_counter() - start
+    print(f"  {label:<28} {elapsed / OPS * 1e6:>12.1f} us/op")
+
+
+def bench(label: str, db) -> None:
+
+    print(label)
+
+    start = perf_counter()
+    populate(db)
+    print(f"  {'populate':<28} {perf_counter() - start:>12.2f} s")
+
+    timeIt("getUserInfo", lambda user, userId: db.getUserInfo(userId))
+    timeIt("getUserAttendance", lambda user, userId: db.getUserAttendance(userId))
+    timeIt("getFilterInfo (name)", lambda user, userId: db.getFilterInfo(userId, filterName(user, 3)))
+    timeIt("searchFilter (room, ip)", lambda user, userId: db.searchFilter(userId, "toimisto", deviceIp=f"10.14.{user // 250}.{user % 250}"))
+    timeIt("updateRoomTs", lambda user, userId: db.updateRoomTs(userId, "aula", 1))
+    timeIt("updateFilterTs", lambda user, userId: db.updateFilterTs(filterName(user, 5), 1))
+    timeIt("removeFilter + addFilter", lambda user, userId: (db.removeFilter(filterName(user, 7)), db.addFilter(userId, "default", filterName(user, 7), "toimisto", 0, f"ws{user}", f"10.14.{user // 250}.{user % 250}")))
+
+
+if (__name__ == "__main__"):
+
+    seed(0)
+    bench("Dict", Dict(database={}))
+    bench("Indexed", Indexed(database={}))
+
+    with TemporaryDirectory() as tmpDir:
+
+        dbPath = str(Path(tmpDir) / "kuisti.db")
+        bench("Sqlite", Sqlite(database=dbPath))
+
+        # Uudelleenkäynnistys: tietokannan avaaminen ja tilan lukeminen levyltä.
+        start = perf_counter()
+        db = Sqlite(database=dbPath)
+        db.getUserInfo("user0@demo.internal")
+        print(f"  {'reopen':<28} {(perf_counter() - start) * 1000:>12.1f} ms")
+
+        start = perf_counter()
+        rooms, filters = db.getUserAttendance("any"), db.getFilterInfo()
+        print(f"  {'read all state':<28} {(perf_counter() - start) * 1000:>12.1f} ms ({len(rooms)} rooms, {len(filters)} filters)")
@@ -0,0 +1,75 @@
+from pathlib import Path
+from random import Random
+from statistics import quantiles
+from threading import Barrier, Thread
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.databases.indexed import Indexed
+
+
+
+# Kilpailutilanne: N säiettä tekee sekaisin luku- (80 %) ja kirjoitusoperaatioita (20 %) samaan tietokantaan.
+# Ajo: python benchmarks/database_contention.py
+
+USERS = 1_000
+OPS_PER_THREAD = 5_000
+THREAD_COUNTS = [1, 2, 4, 8]
+
+
+
+def populate(db) -> None:
+
+    for user in range(USERS):
+
+        userId = f"user{user}"
+        db.addUser(userId, f"CN={userId}", ["default"])
+        db.addUserToRoom(userId, "aula", "CN=KuistiRoom_aula", 0)
+
+
+def client(db, seed: int, barrier: Barrier, latencies: list) -> None:
+
+    rng = Random(seed)
+    barrier.wait()
+
+    for i in range(OPS_PER_THREAD):
+
+        userId = f"user{rng.randrange(USERS)}"
+        start = perf_counter()
+
+        if (rng.random() < 0.8):
+            db.getUserAttendance(userId, "aula")
+
+        else:
+            db.updateRoomTs(userId, "aula", i)
+
+        latencies.append(perf_counter() - start)
+
+
+def bench(threadCount: int) -> None:
+
+    db = Indexed(database={})
+    populate(db)
+
+    barrier = Barrier(threadCount)
+    latencies = [[] for _ in range(threadCount)]
+    threads = [Thread(target=client, args=(db, i, barrier, latencies[i])) for i in range(threadCount)]
+
+    start = perf_counter()
+
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    elapsed = perf_counter() - start
+    allLatencies = [latency for threadLatencies in latencies for latency in threadLatencies]
+    percentiles = quantiles(allLatencies, n=100)
+
+    print(f"{threadCount:>2} threads {len(allLatencies) / elapsed:>10.0f} ops/s   p50 {percentiles[49] * 1e6:>8.1f} us   p99 {percentiles[98] * 1e6:>8.1f} us")
+
+
+if (__name__ == "__main__"):
+
+    for threadCount in THREAD_COUNTS:
+        bench(threadCount)
@@ -0,0 +1,121 @@
+from multiprocessing import Barrier, Process, Queue
+from pathlib import Path
+from random import Random
+from re import compile as reCompile
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+import os, sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.databases.indexed import Indexed
+from kuisti.databases.remote import DatabaseServer, Remote
+
+
+
+# Lokirivien käsittely useassa säikeessä yhden prosessin sisällä (paikallinen Indexed) verrattuna useaan prosessiin,
+# jotka jakavat saman tilan DatabaseServer-palvelimen kautta (Remote). Jokainen operaatio jäsentää lokirivin
+# (CPU-työtä, joka säikeillä kilpailee samasta GIL:stä) ja päivittää käyttäjän aikaleiman.
+# Ajo: python benchmarks/database_remote.py
+
+USERS = 1_000
+LINES_PER_WORKER = 5_000
+WORKER_COUNTS = [1, 2, 4]
+PARSE_ROUNDS = 20
+
+LOG_LINE = "<134>1 2024-05-01T08:00:00Z door01 kuisti - - user={user} door=KuistiRoom_aula direction=in result=ok"
+LOG_PATTERN = reCompile(r"user=(?P<user>\S+) door=KuistiRoom_(?P<room>\S+) direction=(?P<direction>\S+) result=(?P<result>\S+)")
+
+
+
+def populate(db) -> None:
+
+    for user in range(USERS):
+
+        userId = f"user{user}"
+        db.addUser(userId, f"CN={userId}", ["default"])
+        db.addUserToRoom(userId, "aula", "CN=KuistiRoom_aula", 0)
+
+
+def handleLines(db, seed: int) -> None:
+
+    rng = Random(seed)
+
+    for i in range(LINES_PER_WORKER):
+
+        line = LOG_LINE.format(user=f"user{rng.randrange(USERS)}")
+
+        for _ in range(PARSE_ROUNDS):
+            match = LOG_PATTERN.search(line)
+
+        db.updateRoomTs(match["user"], match["room"], i)
+
+
+def processWorker(path: str, seed: int, barrier: Barrier) -> None:
+
+    db = Remote(database=path)
+    barrier.wait()
+    handleLines(db, seed)
+
+
+def serverProcess(path: str, ready: Queue) -> None:
+
+    db = Indexed(database={})
+    populate(db)
+
+    server = DatabaseServer(db, path)
+    server.start()
+    ready.put(True)
+
+    # Palvelin pysyy käynnissä, kunnes pääprosessi lopettaa sen.
+    ready.get()
+
+
+def runThreads(workers: int) -> float:
+
+    db = Indexed(database={})
+    populate(db)
+
+    threads = [Thread(target=handleLines, args=(db, seed)) for seed in range(workers)]
+    start = perf_counter()
+
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    return workers * LINES_PER_WORKER / (perf_counter() - start)
+
+
+def runProcesses(workers: int) -> float:
+
+    with TemporaryDirectory() as tmpDir:
+
+        path = str(Path(tmpDir) / "db.sock")
+        ready = Queue()
+        server = Process(target=serverProcess, args=(path, ready))
+        server.start()
+        ready.get()
+
+        barrier = Barrier(workers + 1)
+        clients = [Process(target=processWorker, args=(path, seed, barrier)) for seed in range(workers)]
+
+        for client in clients: client.start()
+        barrier.wait()
+        start = perf_counter()
+
+        for client in clients: client.join()
+        elapsed = perf_counter() - start
+
+        ready.put(True)
+        server.join()
+
+    return workers * LINES_PER_WORKER / elapsed
+
+
+if (__name__ == "__main__"):
+
+    print(f"CPU-ytimiä: {os.cpu_count()}")
+    print(f"{'työntekijöitä':<16} {'säikeet (rivit/s)':>20} {'prosessit (rivit/s)':>22}")
+
+    for workers in WORKER_COUNTS:
+        print(f"{workers:<16} {runThreads(workers):>20.0f} {runProcesses(workers):>22.0f}")
@@ -0,0 +1,102 @@
+from pathlib import Path
+from random import Random
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from threading import Barrier, Event, Thread
+from time import perf_counter, sleep
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.databases.indexed import Indexed
+from kuisti.databases.sharded import Sharded
+from kuisti.databases.sqlite import Sqlite
+
+
+
+# Kirjoitusten skaalautuminen tietokantojen (shard) määrän mukaan: THREADS säiettä päivittää satunnaisten käyttäjien
+# aikaleimoja ja joka kymmenes operaatio hakee kaikkien käyttäjien läsnäolot (scatter/gather). Lisäksi yksi säie tekee
+# jatkuvasti hitaita transaktioita (SLOW_TRANSACTION sekuntia, esim. levy- tai verkko-odotus) yhden käyttäjän tiedoille.
+# Ajo: python benchmarks/database_sharded.py
+
+USERS = 1_000
+THREADS = 8
+OPS_PER_THREAD = 2_000
+SHARD_COUNTS = [1, 2, 4, 8]
+SLOW_TRANSACTION = 0.002
+
+
+
+def populate(db) -> None:
+
+    for user in range(USERS):
+
+        userId = f"user{user}"
+        db.addUser(userId, f"CN={userId}", ["default"])
+        db.addUserToRoom(userId, "aula", "CN=KuistiRoom_aula", 0)
+
+
+def client(db, seed: int, barrier: Barrier, latencies: list) -> None:
+
+    rng = Random(seed)
+    barrier.wait()
+
+    for i in range(OPS_PER_THREAD):
+
+        start = perf_counter()
+
+        if (i % 10 == 9):
+            db.getUserAttendance("any", "aula")
+
+        else:
+            db.updateRoomTs(f"user{rng.randrange(USERS)}", "aula", i)
+
+        latencies.append(perf_counter() - start)
+
+
+def slowWriter(db, stop: Event) -> None:
+
+    def _(shard) -> None:
+
+        shard.updateRoomTs("user0", "aula", 0)
+        sleep(SLOW_TRANSACTION)
+
+    while (not stop.is_set()):
+        db.transaction(_, userId="user0")
+
+
+def bench(label: str, db) -> None:
+
+    populate(db)
+
+    stop = Event()
+    slowThread = Thread(target=slowWriter, args=(db, stop))
+    slowThread.start()
+
+    barrier = Barrier(THREADS)
+    latencies = [[] for _ in range(THREADS)]
+    threads = [Thread(target=client, args=(db, i, barrier, latencies[i])) for i in range(THREADS)]
+
+    start = perf_counter()
+
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    elapsed = perf_counter() - start
+    stop.set()
+    slowThread.join()
+
+    allLatencies = [latency for threadLatencies in latencies for latency in threadLatencies]
+    percentiles = quantiles(allLatencies, n=100)
+
+    print(f"{label:<18} {len(allLatencies) / elapsed:>10.0f} ops/s   p50 {percentiles[49] * 1e6:>8.1f} us   p99 {percentiles[98] * 1e6:>8.1f} us")
+
+
+if (__name__ == "__main__"):
+
+    for shardCount in SHARD_COUNTS:
+        bench(f"Indexed x{shardCount}", Sharded(database=[Indexed(database={}) for _ in range(shardCount)]))
+
+    for shardCount in SHARD_COUNTS:
+        with TemporaryDirectory() as tmpDir:
+            bench(f"Sqlite x{shardCount}", Sharded(database=[Sqlite(database=str(Path(tmpDir) / f"kuisti-{i}.db")) for i in range(shardCount)]))
@@ -0,0 +1,83 @@
+from pathlib import Path
+from random import Random
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.databases.indexed import Indexed
+from kuisti.databases.sqlite import Sqlite
+
+
+
+# Lukuviive kirjoituskuorman alla: WRITERS säiettä päivittää aikaleimoja jatkuvasti ja yksi säie mittaa lukujen keston.
+# Ajo: python benchmarks/database_snapshot.py
+
+USERS = 1_000
+READS = 20_000
+WRITERS = 4
+
+
+
+def populate(db) -> None:
+
+    for user in range(USERS):
+
+        userId = f"user{user}"
+        db.addUser(userId, f"CN={userId}", ["default"])
+        db.addUserToRoom(userId, "aula", "CN=KuistiRoom_aula", 0)
+
+
+def writer(db, seed: int, stop: Event) -> None:
+
+    rng = Random(seed)
+    i = 0
+
+    while (not stop.is_set()):
+
+        db.updateRoomTs(f"user{rng.randrange(USERS)}", "aula", i)
+        i += 1
+
+
+def measureReads(db) -> list[float]:
+
+    rng = Random(0)
+    latencies = []
+
+    for _ in range(READS):
+
+        userId = f"user{rng.randrange(USERS)}"
+        start = perf_counter()
+        db.getUserAttendance(userId)
+        db.getUserInfo(userId)
+        latencies.append(perf_counter() - start)
+
+    return latencies
+
+
+def bench(label: str, db) -> None:
+
+    populate(db)
+
+    idle = quantiles(measureReads(db), n=100)
+
+    stop = Event()
+    writers = [Thread(target=writer, args=(db, i, stop)) for i in range(WRITERS)]
+
+    for thread in writers: thread.start()
+    loaded = quantiles(measureReads(db), n=100)
+    stop.set()
+    for thread in writers: thread.join()
+
+    print(f"{label:<10} idle p50 {idle[49] * 1e6:>8.1f} us  p99 {idle[98] * 1e6:>8.1f} us   under write load p50 {loaded[49] * 1e6:>8.1f} us  p99 {loaded[98] * 1e6:>8.1f} us")
+
+
+if (__name__ == "__main__"):
+
+    bench("Indexed", Indexed(database={}))
+
+    with TemporaryDirectory() as tmpDir:
+        bench("Sqlite", Sqlite(database=str(Path(tmpDir) / "kuisti.db")))
@@ -0,0 +1,75 @@
+from pathlib import Path
+from statistics import median, quantiles
+from threading import Event, Thread
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.eventbuses.local import LocalEventBus
+from kuisti.eventbuses.manager import ManagerEventBus
+
+
+
+# Mittaa tapahtumakohtaisen viiveen (put -> get) eri väylätoteutuksille.
+# Ajo: python benchmarks/eventbus.py
+
+LATENCY_EVENTS = 5_000
+THROUGHPUT_EVENTS = 20_000
+
+
+
+def benchLatency(label: str, eventBus) -> None:
+
+    # Yksi tapahtuma kerrallaan: mitataan viive put-kutsusta siihen, kun kuluttaja saa tapahtuman.
+    latencies = []
+    received = Event()
+
+    def consumer():
+        for _ in range(LATENCY_EVENTS):
+
+            _, event = eventBus.get()
+            latencies.append(perf_counter() - event["sent"])
+            received.set()
+
+    consumerThread = Thread(target=consumer)
+    consumerThread.start()
+
+    for i in range(LATENCY_EVENTS):
+
+        received.clear()
+        eventBus.put("room", {"userId": f"user{i}", "roomName": "aula", "timestamp": i, "sent": perf_counter()})
+        received.wait()
+
+    consumerThread.join()
+
+    p99 = quantiles(latencies, n=100)[98]
+    print(f"{label:<20} latency    median {median(latencies) * 1e6:>9.1f} us   p99 {p99 * 1e6:>9.1f} us")
+
+
+def benchThroughput(label: str, eventBus) -> None:
+
+    def consumer():
+        for _ in range(THROUGHPUT_EVENTS):
+            eventBus.get()
+
+    consumerThread = Thread(target=consumer)
+    consumerThread.start()
+
+    start = perf_counter()
+
+    for i in range(THROUGHPUT_EVENTS):
+        eventBus.put("room", {"userId": f"user{i}", "roomName": "aula", "timestamp": i})
+
+    consumerThread.join()
+    elapsed = perf_counter() - start
+
+    print(f"{label:<20} throughput {THROUGHPUT_EVENTS / elapsed:>10.0f} events/s")
+
+
+if (__name__ == "__main__"):
+
+    for label, eventBus in (("LocalEventBus", LocalEventBus()), ("ManagerEventBus", ManagerEventBus())):
+
+        benchLatency(label, eventBus)
+        benchThroughput(label, eventBus)
@@ -0,0 +1,75 @@
+from ldap3 import Connection, MOCK_SYNC, Server
+from pathlib import Path
+from time import perf_counter
+from types import SimpleNamespace
+import logging, sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.cache import GroupCache
+from kuisti.ldap import LdapConnection
+
+
+
+# Jäsenyyden tarkastus suurelle huoneryhmälle: koko member-attribuutin nouto jokaisella tarkastuksella
+# (checkGroupMembership) verrattuna GroupCache-välimuistiin. Hakemistopalvelimena on ldap3:n MOCK_SYNC-strategia.
+# Ajo: python benchmarks/group_cache.py
+
+MEMBERS = 5_000
+CHECKS = 200
+
+SEARCH_BASE = "DC=demo,DC=internal"
+GROUP_DN = "CN=KuistiRoom_halli,DC=demo,DC=internal"
+SERVICE_DN = "CN=kuisti,DC=demo,DC=internal"
+SERVER = Server("kuisti-mock")
+
+
+
+class MockLdapConnection(LdapConnection):
+
+    def _useActiveDcFqdn(self, domain: str) -> None:
+
+        self.server = SERVER
+
+
+
+def newConnection() -> MockLdapConnection:
+
+    connection = MockLdapConnection(SimpleNamespace(logger=logging.getLogger("kuisti")), "demo.internal", False, client_strategy=MOCK_SYNC, user=SERVICE_DN, password="kuisti")
+    connection.bind()
+
+    return connection
+
+
+def populate() -> None:
+
+    connection = Connection(SERVER, client_strategy=MOCK_SYNC)
+    connection.strategy.add_entry(SERVICE_DN, {"objectClass": "user", "userPassword": "kuisti"})
+    connection.strategy.add_entry(GROUP_DN, {"objectClass": "group", "distinguishedName": GROUP_DN, "uSNChanged": 1, "member": [f"CN=user{n},{SEARCH_BASE}" for n in range(MEMBERS)]})
+
+
+def measure(label: str, check) -> None:
+
+    start = perf_counter()
+
+    for n in range(CHECKS):
+        assert check(f"CN=user{n * 7 % MEMBERS},{SEARCH_BASE}")
+
+    print(f"{label:<28} {CHECKS / (perf_counter() - start):>10.0f} tarkastusta/s")
+
+
+if (__name__ == "__main__"):
+
+    populate()
+    connection = newConnection()
+
+    measure("checkGroupMembership", lambda userDn: connection.checkGroupMembership(SEARCH_BASE, GROUP_DN, userDn))
+
+    # Ensimmäinen nouto tehdään ennen mittausta, jotta mitataan pelkkä tarkastus.
+    cache = GroupCache(connection, SEARCH_BASE)
+    cache.getMembers(GROUP_DN)
+    measure("GroupCache.isMember", lambda userDn: cache.isMember(GROUP_DN, userDn))
+
+    cache = GroupCache(connection, SEARCH_BASE, revalidateInterval=0)
+    measure("GroupCache (tarkastus aina)", lambda userDn: cache.isMember(GROUP_DN, userDn))
+    print(f"ryhmän noutoja: {cache.stats['fetches']}, uSNChanged-tarkastuksia: {cache.stats['revalidations']}")
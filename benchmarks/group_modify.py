@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import count
+from ldap3 import Connection, MODIFY_ADD, MODIFY_DELETE, MOCK_SYNC, Server
+from pathlib import Path
+from time import perf_counter, sleep
+from types import SimpleNamespace
+import logging, sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.cache import GroupCache
+from kuisti.ldap import GroupModifyQueue, LdapConnection, LdapConnectionPool
+
+
+
+# Ruuhkatilanne (esim. vuoronvaihto): USERS käyttäjää saapuu ROOMS huoneeseen, ja osa poistuu heti perään. Verrataan
+# jokaisen muutoksen erillistä modify-kutsua (jäsenyyden tarkastus + modify tapahtuman käsittelijässä) GroupModifyQueue-
+# jonoon. Hakemistopalvelimena on ldap3:n MOCK_SYNC-strategia, jonka jokaiseen modify-kutsuun lisätään LATENCY
+# sekunnin verkkoviive. Lopuksi varmistetaan, että ryhmien jäsenet ovat molemmilla tavoilla samat.
+# Ajo: python benchmarks/group_modify.py
+
+USERS = 400
+ROOMS = 4
+LEAVE_EVERY = 4
+THREADS = 8
+LATENCY = 0.002
+WINDOW = 0.25
+
+SEARCH_BASE = "DC=demo,DC=internal"
+SERVICE_DN = "CN=kuisti,DC=demo,DC=internal"
+SERVER = None
+
+ROOM_DNS = [f"CN=KuistiRoom_{n},{SEARCH_BASE}" for n in range(ROOMS)]
+MODIFIES = count()
+
+
+
+class MockLdapConnection(LdapConnection):
+
+    def _useActiveDcFqdn(self, domain: str) -> None:
+
+        self.server = SERVER
+
+
+    def modify(self, *args, **kwargs):
+
+        next(MODIFIES)
+        sleep(LATENCY)
+        return super().modify(*args, **kwargs)
+
+
+
+def newConnection() -> MockLdapConnection:
+
+    # MOCK_SYNC ei sido yhteyttä auto_bind-parametrilla, joten sidotaan erikseen.
+    connection = MockLdapConnection(SimpleNamespace(logger=logging.getLogger("kuisti")), "demo.internal", False, client_strategy=MOCK_SYNC, user=SERVICE_DN, password="kuisti")
+    connection.bind()
+
+    return connection
+
+
+def populate() -> None:
+
+    # Jokainen mittaus aloittaa samasta hakemistosta.
+    global SERVER
+    SERVER = Server("kuisti-mock")
+
+    connection = Connection(SERVER, client_strategy=MOCK_SYNC)
+    connection.strategy.add_entry(SERVICE_DN, {"objectClass": "user", "userPassword": "kuisti"})
+
+    # Puolet käyttäjistä on jo valmiiksi ryhmissä (esim. edellisestä vuorosta).
+    for roomDn in ROOM_DNS:
+        connection.strategy.add_entry(roomDn, {"objectClass": "group", "distinguishedName": roomDn, "uSNChanged": 1, "member": [userDn(n) for n in range(0, USERS, 2)]})
+
+
+def userDn(n: int) -> str:
+
+    return f"CN=user{n},{SEARCH_BASE}"
+
+
+def events() -> list[tuple[str, str, bool]]:
+
+    # (huoneryhmä, käyttäjä, saapui): jokainen käyttäjä saapuu huoneeseen, ja joka LEAVE_EVERY:s poistuu heti perään.
+    result = []
+
+    for n in range(USERS):
+
+        roomDn = ROOM_DNS[n % ROOMS]
+        result.append((roomDn, userDn(n), True))
+        if (n % LEAVE_EVERY == 0): result.append((roomDn, userDn(n), False))
+
+    return result
+
+
+def inline(pool: LdapConnectionPool, cache: GroupCache, roomDn: str, memberDn: str, entered: bool) -> None:
+
+    # Sama toteutus kuin User.allowLogon/denyLogon ennen muutosjonoa.
+    if (cache.isMember(roomDn, memberDn) != entered):
+
+        assert pool.modify(roomDn, {"member": [(MODIFY_ADD if (entered) else MODIFY_DELETE, [memberDn])]})
+
+        if (entered): cache.addMember(roomDn, memberDn)
+        else: cache.removeMember(roomDn, memberDn)
+
+
+def queued(queue: GroupModifyQueue, roomDn: str, memberDn: str, entered: bool) -> None:
+
+    if (entered): queue.addMember(roomDn, memberDn)
+    else: queue.removeMember(roomDn, memberDn)
+
+
+def run(label: str, submit) -> dict:
+
+    global MODIFIES
+
+    populate()
+    pool = LdapConnectionPool(newConnection, maxSize=THREADS)
+    cache = GroupCache(pool, SEARCH_BASE)
+    queue = GroupModifyQueue(pool, cache, window=WINDOW)
+
+    # Ryhmät noudetaan välimuistiin ennen mittausta.
+    for roomDn in ROOM_DNS: cache.getMembers(roomDn)
+
+    MODIFIES = count()
+    start = perf_counter()
+
+    # Saman käyttäjän tapahtumat käsitellään järjestyksessä (kuten KeyedWorkerPool), eri käyttäjien rinnakkain.
+    byUser = {}
+    for event in events(): byUser.setdefault(event[1], []).append(event)
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        wait([executor.submit(lambda userEvents: [submit(pool, cache, queue, *e) for e in userEvents], userEvents) for userEvents in byUser.values()])
+
+    queue.flush()
+    elapsed = perf_counter() - start
+    modifies = next(MODIFIES)
+
+    print(f"{label:<24} {len(events()):>10} {modifies:>10} {elapsed:>10.2f}")
+
+    queue.close()
+    members = dict((roomDn, sorted(pool.getGroupMembers(SEARCH_BASE, roomDn)[0])) for roomDn in ROOM_DNS)
+    pool.close()
+
+    return members
+
+
+if (__name__ == "__main__"):
+
+    print(f"{'':<24} {'muutoksia':>10} {'modify':>10} {'aika (s)':>10}")
+
+    expected = run("erilliset modify-kutsut", lambda pool, cache, queue, *e: inline(pool, cache, *e))
+    result = run("GroupModifyQueue", lambda pool, cache, queue, *e: queued(queue, *e))
+
+    assert result == expected, "Ryhmien jäsenet eroavat."
@@ -0,0 +1,49 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.databases.indexed import Indexed
+from kuisti.journal import Journal
+
+
+
+# Kirjoitusnopeus eri fsync-käytännöillä sekä tilan palautuksen kesto. Ajo: python benchmarks/journal.py
+
+USERS = 20_000
+
+
+
+def populate(db: Indexed) -> float:
+
+    start = perf_counter()
+
+    for n in range(USERS):
+
+        userId = f"user{n}"
+        db.addUser(userId, f"CN={userId},DC=demo,DC=internal", ["KuistiRole_default"])
+        db.addUserToRoom(userId, "aula", "CN=KuistiRoom_aula,DC=demo,DC=internal", 1700000000000.0 + n)
+        db.addFilter(userId, "default", f"kuisti_{userId}_0", "aula", 1700000000000.0 + n, f"ws{n}", f"10.1.{n // 256 % 256}.{n % 256}", False, 0, '{"dstAddr": "10.0.0.0/8"}')
+
+    return perf_counter() - start
+
+
+if (__name__ == "__main__"):
+
+    print(f"{'ilman journaalia':<24} {3 * USERS / populate(Indexed(database={})):>10.0f} muutosta/s")
+
+    for fsync in ("periodic", "batch", "always"):
+        with TemporaryDirectory() as tmpDir:
+
+            journal = Journal(str(Path(tmpDir) / "state"), fsync=fsync)
+            db = Indexed(database={})
+            journal.attach(db)
+
+            print(f"{'fsync=' + fsync:<24} {3 * USERS / populate(db):>10.0f} muutosta/s")
+            journal.close()
+
+            start = perf_counter()
+            Journal(str(Path(tmpDir) / "state")).attach(Indexed(database={}))
+            print(f"{'  palautus':<24} {perf_counter() - start:>10.2f} s")
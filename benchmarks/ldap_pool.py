@@ -0,0 +1,95 @@
+from ldap3 import Connection, MOCK_SYNC, Server
+from pathlib import Path
+from threading import Barrier, Thread
+from time import perf_counter, sleep
+from types import SimpleNamespace
+import logging, sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.ldap import LdapConnection, LdapConnectionPool
+
+
+
+# Rinnakkaisten hakemistohakujen läpäisy poolin koon mukaan. Hakemistopalvelimena on ldap3:n MOCK_SYNC-strategia, jonka
+# jokaiseen hakuun lisätään LATENCY sekunnin verkkoviive. Poolin koko 1 vastaa yhtä jaettua yhteyttä.
+# Ajo: python benchmarks/ldap_pool.py
+
+THREADS = 16
+OPS_PER_THREAD = 100
+POOL_SIZES = [1, 2, 4, 8, 16]
+LATENCY = 0.005
+MEMBERS = 20
+
+SEARCH_BASE = "DC=demo,DC=internal"
+GROUP_DN = "CN=KuistiRoom_aula,DC=demo,DC=internal"
+SERVICE_DN = "CN=kuisti,DC=demo,DC=internal"
+SERVER = Server("kuisti-mock")
+
+
+
+class MockLdapConnection(LdapConnection):
+
+    def _useActiveDcFqdn(self, domain: str) -> None:
+
+        self.server = SERVER
+
+
+    def search(self, *args, **kwargs):
+
+        sleep(LATENCY)
+        return super().search(*args, **kwargs)
+
+
+
+def newConnection() -> MockLdapConnection:
+
+    # MOCK_SYNC ei sido yhteyttä auto_bind-parametrilla, joten sidotaan erikseen.
+    connection = MockLdapConnection(SimpleNamespace(logger=logging.getLogger("kuisti")), "demo.internal", False, client_strategy=MOCK_SYNC, user=SERVICE_DN, password="kuisti")
+    connection.bind()
+
+    return connection
+
+
+def populate() -> None:
+
+    # Palvelutunnus lisätään sitomattomalla yhteydellä, koska MOCK_SYNC hyväksyy vain hakemistossa olevan tunnuksen.
+    connection = Connection(SERVER, client_strategy=MOCK_SYNC)
+    connection.strategy.add_entry(SERVICE_DN, {"objectClass": "user", "userPassword": "kuisti"})
+
+    members = [f"CN=user{n},{SEARCH_BASE}" for n in range(MEMBERS)]
+
+    for member in members:
+        connection.strategy.add_entry(member, {"objectClass": "user", "distinguishedName": member, "userPrincipalName": member})
+
+    connection.strategy.add_entry(GROUP_DN, {"objectClass": "group", "distinguishedName": GROUP_DN, "member": members})
+
+
+def client(pool: LdapConnectionPool, seed: int, barrier: Barrier) -> None:
+
+    barrier.wait()
+
+    for n in range(OPS_PER_THREAD):
+        assert pool.checkGroupMembership(SEARCH_BASE, GROUP_DN, f"CN=user{(seed + n) % MEMBERS},{SEARCH_BASE}")
+
+
+if (__name__ == "__main__"):
+
+    populate()
+    print(f"{'poolin koko':<12} {'hakuja/s':>10} {'yhteyksiä':>10} {'odotuksia':>10}")
+
+    for poolSize in POOL_SIZES:
+
+        pool = LdapConnectionPool(newConnection, maxSize=poolSize)
+        barrier = Barrier(THREADS + 1)
+        threads = [Thread(target=client, args=(pool, seed, barrier)) for seed in range(THREADS)]
+
+        for thread in threads: thread.start()
+        barrier.wait()
+        start = perf_counter()
+
+        for thread in threads: thread.join()
+        elapsed = perf_counter() - start
+
+        print(f"{poolSize:<12} {THREADS * OPS_PER_THREAD / elapsed:>10.0f} {pool.stats['created']:>10} {pool.stats['waited']:>10}")
+        pool.close()
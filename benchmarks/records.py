@@ -0,0 +1,62 @@
+from json import dumps
+from pathlib import Path
+import sys, tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.databases.indexed import Indexed
+from kuisti.records import FilterRecord
+
+
+
+# Muistinkulutus 100 000 suodatussäännölle: vapaamuotoiset sanakirjat (jokaisella oma JSON-kopio asetuksista)
+# verrattuna FilterRecord-merkintöihin, jotka viittaavat jaettuun asetukseen. Ajo: python benchmarks/records.py
+
+FILTERS = 100_000
+FILTERSETS = {"default": [{"dstAddr": "10.0.0.0/8", "dstPort": "*", "protocol": "*", "ipVersion": "4", "sequence": idx} for idx in range(4)]}
+
+
+
+def filterArgs(n: int) -> tuple:
+
+    # Merkkijonot muodostetaan ajon aikana kuten lokiriveistä jäsennettäessä, jotta ne eivät ole valmiiksi jaettuja vakioita.
+    role = "".join(["def", "ault"])
+    idx = n % len(FILTERSETS[role])
+
+    return (f"user{n // 4}", role, f"kuisti_user{n // 4}_{n}", "".join(["au", "la"]), f"ws{n}", f"10.1.{n // 256 % 256}.{n % 256}", 1700000000000.0 + n, False, 0, dumps(FILTERSETS[role][idx]))
+
+
+def legacyEntry(userId, role, filterName, roomName, deviceName, deviceIp, timestamp, autoLocked, renewalAmount, filterConf) -> dict:
+
+    return {"userId": userId, "role": role, "filterName": filterName, "roomName": roomName, "deviceName": deviceName, "deviceIp": deviceIp, "timestamp": timestamp, "autoLocked": autoLocked, "renewalAmount": renewalAmount, "filterConf": filterConf}
+
+
+def measure(label: str, build) -> None:
+
+    tracemalloc.start()
+    entries = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<32} {current / 2**20:>8.1f} MiB   {current / FILTERS:>6.0f} B/sääntö")
+
+    del entries
+
+
+if (__name__ == "__main__"):
+
+    measure("dict (vanha)", lambda: [legacyEntry(*filterArgs(n)) for n in range(FILTERS)])
+    measure("FilterRecord", lambda: [FilterRecord(*filterArgs(n)) for n in range(FILTERS)])
+
+    def populateIndexed() -> Indexed:
+
+        db = Indexed(database={})
+
+        for n in range(FILTERS):
+
+            userId, role, filterName, roomName, deviceName, deviceIp, timestamp, autoLocked, renewalAmount, filterConf = filterArgs(n)
+            db.addFilter(userId, role, filterName, roomName, timestamp, deviceName, deviceIp, autoLocked, renewalAmount, filterConf)
+
+        return db
+
+    measure("Indexed (merkinnät + indeksit)", populateIndexed)
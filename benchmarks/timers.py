@@ -0,0 +1,80 @@
+from pathlib import Path
+from random import random, seed
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.timers import TimerHeap
+
+
+
+# Mikrobenchmark Inspectorin ajastinrakenteelle: 100 000 odottavaa ajastinta.
+# Ajo: python benchmarks/timers.py
+
+PENDING = 100_000
+LEGACY_SAMPLE = 50
+
+
+
+def timeIt(label: str, ops: int, func) -> None:
+
+    start = perf_counter()
+    func()
+    elapsed = perf_counter() - start
+
+    print(f"{label:<40} {ops:>8} ops {elapsed * 1000:>10.2f} ms {elapsed / ops * 1e6:>10.3f} us/op")
+
+
+def benchLegacyList(deadlines: list[float]) -> None:
+
+    # Vanha toteutus: lista, joka järjestetään jokaisen lisäyksen jälkeen ja josta poimitaan pop(0):lla.
+    events = [{"expiryTime": deadline} for deadline in deadlines]
+    events.sort(key=lambda event: event["expiryTime"])
+
+    def insert():
+        for i in range(LEGACY_SAMPLE):
+
+            events.append({"expiryTime": deadlines[i]})
+            events.sort(key=lambda event: event["expiryTime"])
+
+    def expire():
+        for _ in range(LEGACY_SAMPLE):
+            events.pop(0)
+
+    timeIt("list: insert + sort", LEGACY_SAMPLE, insert)
+    timeIt("list: pop(0)", LEGACY_SAMPLE, expire)
+
+
+def benchTimerHeap(deadlines: list[float]) -> None:
+
+    timers = TimerHeap()
+
+    def insert():
+        for i, deadline in enumerate(deadlines):
+            timers.schedule(i, deadline)
+
+    def reschedule():
+        for i, deadline in enumerate(deadlines):
+            timers.schedule(i, deadline + 1.0)
+
+    def cancel():
+        for i in range(0, PENDING, 2):
+            timers.cancel(i)
+
+    def popDue():
+        timers.popDue(float("inf"))
+
+    timeIt("TimerHeap: schedule", PENDING, insert)
+    timeIt("TimerHeap: reschedule", PENDING, reschedule)
+    timeIt("TimerHeap: cancel (every other)", PENDING // 2, cancel)
+    timeIt("TimerHeap: popDue (batch, all due)", len(timers), popDue)
+
+
+if (__name__ == "__main__"):
+
+    seed(0)
+    deadlines = [random() * 1e6 for _ in range(PENDING)]
+
+    benchLegacyList(deadlines)
+    benchTimerHeap(deadlines)
@@ -0,0 +1,294 @@
+from __future__ import annotations
+from collections import OrderedDict
+from ldap3.utils.conv import escape_filter_chars
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import TYPE_CHECKING
+import logging
+
+
+
+if (TYPE_CHECKING):
+    from .ldap import LdapConnection, LdapConnectionPool
+
+
+
+class GroupCache():
+
+    """
+    Ryhmien jäsenyyksien välimuisti. Jokaisesta ryhmästä (DN) pidetään muistissa jäsenten DN:t, joten jäsenyyden
+    tarkastus on paikallinen O(1)-haku koko member-attribuutin noutamisen ja lineaarisen haun sijaan. DN:t
+    vertaillaan kirjainkoosta riippumatta.
+
+    Omat muutokset (addMember/removeMember) päivitetään välimuistiin heti onnistuneen modify-kutsun jälkeen. Kun ryhmä
+    on ollut välimuistissa revalidateInterval sekuntia, sen uSNChanged-arvo tarkastetaan kevyellä haulla ja jäsenet
+    noudetaan uudelleen vain, jos ryhmää on muutettu. Omat muutokset kasvattavat myös uSNChanged-arvoa, joten ne
+    aiheuttavat enintään yhden uudelleennoudon tarkastusväliä kohden. Kutsuja voi vaatia tuoreemman tiedon parametrilla
+    maxAge (ks. GroupModifyQueue).
+    """
+
+    def __init__(self, ldapConnection: LdapConnection | LdapConnectionPool, searchBase: str, revalidateInterval: float = 60) -> None:
+
+        self.ldapConnection = ldapConnection
+        self.searchBase = searchBase
+        self.revalidateInterval = revalidateInterval
+        self.logger = logging.getLogger("kuisti")
+        self.stats = {"hits": 0, "fetches": 0, "revalidations": 0}
+
+        # Ryhmän DN (pienillä kirjaimilla) -> [jäsenet {dn pienillä kirjaimilla: dn}, uSNChanged, tarkastusaika].
+        self._groups = {}
+        self._lock = Lock()
+
+
+    def _search(self, groupDn: str, attributes: list[str]) -> dict | None:
+
+        return self.ldapConnection.getObjectAttr(
+
+            self.searchBase,
+            f"(&(objectClass=group)(distinguishedName={escape_filter_chars(groupDn)}))",
+            attributes=attributes
+
+        )
+
+
+    @staticmethod
+    def _usn(attributes: dict | None) -> int | None:
+
+        usn = (attributes or {}).get("uSNChanged")
+        return usn[0] if (usn) else None
+
+
+    def _fetch(self, groupDn: str) -> dict:
+
+        # Suuren ryhmän jäsenet haetaan osissa (ks. LdapConnection.getGroupMembers).
+        group = self.ldapConnection.getGroupMembers(self.searchBase, groupDn)
+        memberList, usn = group if (group is not None) else ([], None)
+        members = dict((member.lower(), member) for member in memberList)
+
+        with self._lock:
+
+            self.stats["fetches"] += 1
+            self._groups[groupDn.lower()] = [members, usn, monotonic()]
+
+        return members
+
+
+    def _members(self, groupDn: str, maxAge: float | None = None) -> dict:
+
+        group = self._groups.get(groupDn.lower())
+
+        if (group is None):
+            return self._fetch(groupDn)
+
+        # maxAge voi vain lyhentää tarkastusväliä.
+        maxAge = self.revalidateInterval if (maxAge is None) else min(maxAge, self.revalidateInterval)
+
+        if (monotonic() - group[2] >= maxAge):
+
+            self.stats["revalidations"] += 1
+
+            # Ryhmä noudetaan uudelleen vain, jos se on muuttunut (tai sitä ei aiemmin löytynyt).
+            usn = self._usn(self._search(groupDn, ["uSNChanged"]))
+            if ((usn is None) or (usn != group[1])): return self._fetch(groupDn)
+
+            group[2] = monotonic()
+
+        self.stats["hits"] += 1
+
+        return group[0]
+
+
+    def isMember(self, groupDn: str, userDn: str, maxAge: float | None = None) -> bool:
+
+        return userDn.lower() in self._members(groupDn, maxAge)
+
+
+    def getMembers(self, groupDn: str) -> list[str]:
+
+        return list(self._members(groupDn).values())
+
+
+    def addMember(self, groupDn: str, userDn: str) -> None:
+
+        # Kutsutaan onnistuneen MODIFY_ADD-muutoksen jälkeen. Välimuistissa olematonta ryhmää ei noudeta tässä.
+        with self._lock:
+
+            group = self._groups.get(groupDn.lower())
+            if (group is not None): group[0][userDn.lower()] = userDn
+
+
+    def removeMember(self, groupDn: str, userDn: str) -> None:
+
+        with self._lock:
+
+            group = self._groups.get(groupDn.lower())
+            if (group is not None): group[0].pop(userDn.lower(), None)
+
+
+    def invalidate(self, groupDn: str | None = None) -> None:
+
+        with self._lock:
+
+            if (groupDn is None): self._groups.clear()
+            else: self._groups.pop(groupDn.lower(), None)
+
+
+
+class RoleIndex():
+
+    """
+    Käyttäjien roolit yhdellä paikallisella haulla. Indeksi kääntää roolien ryhmät (roolin DN -> jäsenet, ks. GroupCache)
+    käyttäjäkohtaiseksi kartaksi (käyttäjän DN -> roolit), joten käyttäjän roolien selvittäminen ei vaadi yhtä
+    hakemistohakua roolia kohden. Taustasäie (ks. start) rakentaa indeksin uudelleen refreshInterval sekunnin välein;
+    ryhmät noudetaan silloin uudelleen vain, jos niiden uSNChanged-arvo on muuttunut. Epäonnistunut päivitys kirjataan
+    lokiin, ja edellinen indeksi pysyy käytössä seuraavaan päivitykseen asti.
+    """
+
+    def __init__(self, groupCache: GroupCache, roles: dict[str, str], refreshInterval: float | None = None) -> None:
+
+        # roles: roolin ryhmän DN -> roolin nimi. Roolit palautetaan tämän kartan järjestyksessä.
+        self.groupCache = groupCache
+        self.roles = dict(roles)
+        self.refreshInterval = groupCache.revalidateInterval if (refreshInterval is None) else refreshInterval
+        self.logger = logging.getLogger("kuisti")
+        self.stats = {"refreshes": 0, "failures": 0}
+
+        self._index = {}
+        self._builtAt = None
+        self._closed = Event()
+        self._thread = None
+
+        # Ensimmäinen indeksi rakennetaan kutsujan säikeessä, jotta hakemiston virheet huomataan käynnistyksessä.
+        self.refresh()
+
+
+    def start(self) -> None:
+
+        self._thread = Thread(target=self._worker, name="role-index", daemon=True)
+        self._thread.start()
+
+
+    def refresh(self) -> None:
+
+        index = {}
+
+        for roleDn, roleName in self.roles.items():
+            for member in self.groupCache.getMembers(roleDn):
+
+                index.setdefault(member.lower(), []).append(roleName)
+
+        # Uusi indeksi otetaan käyttöön kokonaisena, joten lukijat eivät näe puolivalmista indeksiä.
+        self._index = index
+        self._builtAt = monotonic()
+        self.stats["refreshes"] += 1
+
+
+    def _worker(self) -> None:
+
+        while (not self._closed.wait(self.refreshInterval)):
+
+            try:
+                self.refresh()
+
+            except Exception:
+
+                self.stats["failures"] += 1
+                self.logger.exception("Roolien indeksin päivitys epäonnistui, käytetään edellistä indeksiä.")
+
+
+    def close(self) -> None:
+
+        self._closed.set()
+        if (self._thread is not None): self._thread.join()
+
+
+    def getRoles(self, userDn: str) -> list[str]:
+
+        return list(self._index.get(userDn.lower(), ()))
+
+
+    def getStats(self) -> dict:
+
+        age = None if (self._builtAt is None) else monotonic() - self._builtAt
+
+        return {**self.stats, "age": age}
+
+
+
+class IdentityCache():
+
+    """
+    Käyttäjien DN:ien välimuisti. Käyttäjä, joka ei ole tietokannassa (ei paikalla), haetaan hakemistosta vain kerran ttl
+    sekunnin aikana, vaikka User-olio luodaan jokaisesta tapahtumasta uudelleen. Rooleja ei tallenneta, koska ne luetaan
+    aina RoleIndex-indeksistä, joka seuraa roolien ryhmien muutoksia. Välimuistissa on enintään maxSize käyttäjää;
+    täynnä olevasta välimuistista poistetaan pisimpään käyttämättä ollut käyttäjä. Yksittäisen käyttäjän tai koko
+    välimuistin voi mitätöidä invalidate-metodilla.
+    """
+
+    def __init__(self, maxSize: int = 10000, ttl: float = 900) -> None:
+
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+        # userId -> (dn, vanhenemisaika). Järjestys on käyttöjärjestys (viimeksi käytetty viimeisenä).
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+
+    def __len__(self) -> int:
+
+        return len(self._entries)
+
+
+    def get(self, userId: str) -> str | None:
+
+        with self._lock:
+
+            entry = self._entries.get(userId)
+
+            if (entry is None):
+
+                self.stats["misses"] += 1
+                return None
+
+            if (monotonic() >= entry[1]):
+
+                del self._entries[userId]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(userId)
+            self.stats["hits"] += 1
+
+        return entry[0]
+
+
+    def put(self, userId: str, dn: str) -> None:
+
+        if (self.maxSize <= 0): return
+
+        with self._lock:
+
+            self._entries[userId] = (dn, monotonic() + self.ttl)
+            self._entries.move_to_end(userId)
+
+            while (len(self._entries) > self.maxSize):
+
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+
+    def invalidate(self, userId: str | None = None) -> None:
+
+        with self._lock:
+
+            if (userId is None): self._entries.clear()
+            else: self._entries.pop(userId, None)
+
+
+    def getStats(self) -> dict:
+
+        with self._lock:
+            return {**self.stats, "size": len(self._entries)}
@@ -0,0 +1,142 @@
+from __future__ import annotations
+from . import error
+from gssapi import Credentials, Name, NameType
+from gssapi.raw.misc import GSSError
+from itertools import count
+from threading import Event, Lock, Thread
+from time import monotonic
+import logging, os
+
+
+
+# Reaktiivinen uusinta (ks. renew) tehdään enintään näin usein (s), vaikka usea säie huomaisi vanhentuneen lipun yhtä aikaa.
+RENEW_MIN_INTERVAL = 10
+
+# Jos lipulla ei ole voimassaoloaikaa (ei vanhene), se uusitaan silti näin usein (s).
+DEFAULT_LIFETIME = 36000
+
+
+
+class CredentialManager():
+
+    """
+    Palvelukäyttäjän Kerberos-tunnisteiden (TGT) hallinta. Tunnisteet haetaan keytab-tiedostolla gssapi-kirjaston kautta
+    samassa prosessissa (ei kinit-aliprosessia) muistinvaraiseen lippuvälimuistiin (ccache), joka asetetaan prosessin
+    oletukseksi KRB5CCNAME-muuttujalla. LDAP-yhteyksien SASL/GSSAPI-tunnistautuminen käyttää siten aina tämän välimuistin
+    lippua.
+
+    Taustasäie uusii lipun ennen sen vanhenemista: renewBefore sekuntia ennen vanhenemista, kuitenkin viimeistään, kun
+    puolet voimassaoloajasta on kulunut. Epäonnistunut uusinta yritetään uudelleen retryInterval sekunnin välein, joten
+    hetkellinen KDC-katko ei johda vanhentuneeseen lippuun, jos se päättyy ennen lipun vanhenemista.
+    """
+
+    def __init__(self, principal: str, keytab: str, ccache: str = "MEMORY:kuisti", renewBefore: float = 3600, retryInterval: float = 30) -> None:
+
+        self.principal = principal
+        self.keytab = keytab
+        self.ccache = ccache
+        self.renewBefore = renewBefore
+        self.retryInterval = retryInterval
+        self.logger = logging.getLogger("kuisti")
+        self.stats = {"renewals": 0, "failures": 0}
+
+        self.expiresAt = None
+        self._renewedAt = None
+        self._lock = Lock()
+        self._closed = Event()
+        self._staging = count()
+        self._thread = None
+
+
+    def start(self) -> None:
+
+        # Ensimmäinen lippu haetaan kutsujan säikeessä, jotta virheellinen keytab tai asetukset huomataan käynnistyksessä.
+        os.environ["KRB5CCNAME"] = self.ccache
+
+        try:
+            self.renew()
+
+        except GSSError as err:
+            raise error.KuistiKerberosError(f'TGT:n hakeminen keytab-tiedostolla "{self.keytab}" epäonnistui: {err}') from err
+
+        self._thread = Thread(target=self._worker, name="krb5-credentials", daemon=True)
+        self._thread.start()
+
+
+    def _acquire(self) -> float:
+
+        # Uusi lippu haetaan aina tyhjään välimuistiin, jotta gssapi ei palauta vanhaa lippua, ja siirretään sitten
+        # kerralla käytössä olevaan välimuistiin. Näin LDAP-yhteydet eivät koskaan näe tyhjää tai puolivalmista välimuistia.
+        # Väliaikainen välimuisti jää muistiin (gssapi ei tarjoa sen poistoa), mutta sitä kertyy vain yksi uusintaa kohden.
+        staging = f"MEMORY:kuisti-renew-{next(self._staging)}"
+        name = Name(self.principal, name_type=NameType.kerberos_principal)
+
+        credentials = Credentials(name=name, usage="initiate", store={"client_keytab": self.keytab, "ccache": staging})
+        lifetime = credentials.lifetime
+        credentials.store(store={"ccache": self.ccache}, usage="initiate", overwrite=True)
+
+        return DEFAULT_LIFETIME if (lifetime is None) else lifetime
+
+
+    def renew(self, maxAge: float | None = None) -> None:
+
+        # maxAge: lippua ei uusita, jos se on uusittu viimeisen maxAge sekunnin aikana (esim. toinen säie juuri uusi sen).
+        with self._lock:
+
+            if ((maxAge is not None) and (self._renewedAt is not None) and (monotonic() - self._renewedAt < maxAge)): return
+
+            try:
+                lifetime = self._acquire()
+
+            except GSSError:
+
+                self.stats["failures"] += 1
+                raise
+
+            self._renewedAt = monotonic()
+            self.expiresAt = self._renewedAt + lifetime
+            self.stats["renewals"] += 1
+
+        self.logger.info(f'TGT uusittu käyttäjälle "{self.principal}", voimassa {lifetime / 3600:.1f} h.')
+
+
+    def _nextRenewal(self) -> float:
+
+        lifetime = self.expiresAt - self._renewedAt
+
+        return self._renewedAt + max(lifetime - self.renewBefore, lifetime / 2)
+
+
+    def _worker(self) -> None:
+
+        delay = max(0, self._nextRenewal() - monotonic())
+
+        while (not self._closed.wait(delay)):
+
+            try:
+                self.renew()
+                delay = max(0, self._nextRenewal() - monotonic())
+
+            except GSSError as err:
+
+                remaining = self.expiresAt - monotonic()
+                self.logger.error(f'TGT:n uusiminen epäonnistui (nykyinen lippu voimassa {max(0, remaining) / 60:.0f} min): {err}')
+                delay = self.retryInterval
+
+            except Exception:
+
+                self.logger.exception("TGT:n uusiminen epäonnistui.")
+                delay = self.retryInterval
+
+
+    def close(self) -> None:
+
+        self._closed.set()
+        if (self._thread is not None): self._thread.join()
+
+
+    def getStats(self) -> dict:
+
+        remaining = None if (self.expiresAt is None) else max(0, self.expiresAt - monotonic())
+
+        return {**self.stats, "remaining": remaining}
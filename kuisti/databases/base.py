@@ -1,41 +1,367 @@
+from ..eventbuses.base import EventBus
+from ..timers import TimerHeap
 from abc import ABC, abstractmethod
 #from multiprocessing import Manager
+from functools import wraps
+from itertools import count
 from queue import Queue
-from threading import Thread
-from typing import Callable
+from threading import Lock, Thread, current_thread
+from typing import Any, Callable
+
+
+
+class PendingCall():
+
+    # Yksittäisen tietokantakutsun tulos. Kevyempi kuin concurrent.futures.Future: odotus on yksi lukon varaus.
+
+    __slots__ = ("_done", "_value", "_error")
+
+    def __init__(self) -> None:
+
+        self._done = Lock()
+        self._done.acquire()
+        self._value = None
+        self._error = None
+
+
+    def setResult(self, value: Any) -> None:
+
+        self._value = value
+        self._done.release()
+
+
+    def setException(self, error: BaseException) -> None:
+
+        self._error = error
+        self._done.release()
+
+
+    def result(self) -> Any:
+
+        # Lukko vapautetaan heti uudelleen, jotta tuloksen voi lukea useammin kuin kerran.
+        with self._done:
+            pass
+
+        if (self._error is not None): raise self._error
+        return self._value
 
 
 
 class Database(ABC):
 
+    # Toteutukset, jotka ohjaavat kaikki kutsut toisille tietokannoille (Sharded) tai palvelimelle (Remote), eivät tarvitse
+    # omaa työsäiettä eivätkä eräpäiväindeksejä.
+    _delegating = False
+
     def __init__(self, database = None):
         
         self.database = database
+
+        # Aikakatkaisut millisekunteina huoneen (roomName) ja roolin (role) mukaan sekä muistinvaraisten toteutusten eräpäiväindeksit.
+        self._roomTimeouts = {}
+        self._filterTimeouts = {}
+        self._roomDeadlines = None if (self._delegating) else TimerHeap()
+        self._filterDeadlines = None if (self._delegating) else TimerHeap()
+
+        # Kuinka monta kertaa odottava eräpäivä on korvattu uudella (esim. aikaleiman päivitys ennen erääntymistä).
+        self._coalesced = {"room": 0, "filter": 0}
+
+        # Muutossyötteen tilaajat (väylä, aiheet) ja työsäikeen käsittelemän tehtävän vielä julkaisemattomat muutokset.
+        self._subscribers = []
+        self._pendingChanges = []
+        self._changeSeq = count(1)
+
+        # Käynnissä olevan transaktion palautuspiste (ks. _beginTransaction).
+        self._savepoint = None
+
         self._queue = Queue()
-        self._workerThread = Thread(target=self._worker)
-        self._workerThread.start()
+        self._workerThread = None
+
+        if (not self._delegating):
+
+            self._workerThread = Thread(target=self._worker, daemon=True)
+            self._workerThread.start()
 
 
     def queue(func: Callable):
+
+        @wraps(func)
         def inner(self, *args, **kwargs):
 
-            retVal = []
-        
-            self._queue.put((func, self, args, kwargs, retVal))
-            self._queue.join()
+            # Tietokantakutsu toisen tietokantakutsun sisältä suoritetaan suoraan, koska työsäie ei voi odottaa itseään.
+            if (current_thread() is self._workerThread):
+                return func(self, *args, **kwargs)
 
-            return retVal[0]
+            # Jokainen kutsuja odottaa vain oman tehtävänsä valmistumista, ei koko jonon tyhjenemistä.
+            return self._submit(func, *args, **kwargs).result()
 
         return inner
 
+
+    def snapshot(func: Callable):
+
+        # Lukuoperaatio, jonka toteutus palvelee kutsujan omassa säikeessä ohi työsäikeen (esim. muuttumattomista
+        # merkinnöistä tai erillisellä lukuyhteydellä). Kirjoitukset kulkevat edelleen työsäikeen kautta järjestyksessä.
+        # Kutsuja muille tietokannoille välittävät toteutukset (Sharded, DatabaseServer) suorittavat merkityt metodit
+        # suoraan ja lähettävät muut (@queue) tietokannan työsäikeeseen.
+        func.snapshotRead = True
+
+        return func
+
+
+    def transaction(self, func: Callable, *args, userId: str | None = None, **kwargs) -> Any:
+
+        """
+        Suorittaa funktion func(db, *args, **kwargs) yhtenä tehtävänä tietokannan työsäikeessä. Funktion sisällä tehdyt
+        luku- ja kirjoituskutsut suoritetaan suoraan, joten koko ryhmä vaatii vain yhden kierroksen työsäikeen kautta,
+        eikä muiden säikeiden kirjoituksia suoriteta ryhmän välissä. Jos funktio päättyy poikkeukseen, sen muutokset
+        perutaan, eikä niitä julkaista muutossyötteeseen. Oletustoteutus perii muutokset muistinvaraisissa tietokannoissa
+        (ks. _beginTransaction); toteutus voi ylikirjoittaa _beginTransaction-, _commitTransaction- ja
+        _rollbackTransaction-metodit (esim. SQLite-transaktio).
+
+        Parametri userId kertoo, kenen käyttäjän tietoja transaktio käsittelee, eikä transaktio saa muuttaa muiden
+        käyttäjien merkintöjä. Jaettu tietokanta (Sharded) suorittaa transaktion kyseisen käyttäjän tietokannassa ja
+        etätietokanta (Remote) käyttäjäkohtaisen lukon alla; ne eivät hyväksy transaktiota ilman käyttäjätunnusta.
+        """
+
+        if (current_thread() is self._workerThread):
+            return func(self, *args, **kwargs)
+
+        return self._submit(Database._runTransaction, userId, func, *args, **kwargs).result()
+
+
+    def _runTransaction(self, userId: str | None, func: Callable, *args, **kwargs) -> Any:
+
+        self._beginTransaction(userId)
+
+        try:
+            result = func(self, *args, **kwargs)
+
+        except Exception:
+
+            self._rollbackTransaction()
+            raise
+
+        self._commitTransaction()
+
+        return result
+
+
+    def _beginTransaction(self, userId: str | None) -> None:
+
+        # Oletustoteutus ottaa talteen käyttäjän merkinnät (ilman käyttäjätunnusta koko tilan) ja palauttaa ne perutussa
+        # transaktiossa tietokannan omilla kirjoitusmetodeilla (muistinvaraiset tietokannat).
+        self._savepoint = (userId, self._userEntries(userId), dict(self._coalesced))
+
+
+    def _commitTransaction(self) -> None:
+
+        self._savepoint = None
+
+
+    def _rollbackTransaction(self) -> None:
+
+        userId, (users, rooms, filters), coalesced = self._savepoint
+        self._savepoint = None
+        currentUsers, currentRooms, currentFilters = self._userEntries(userId)
+
+        for e in currentFilters: self.removeFilter(e["filterName"])
+        for e in currentRooms: self.removeUserFromRoom(e["userId"], e["roomName"])
+        for e in currentUsers: self.removeUser(e["userId"])
+
+        for e in users: self.addUser(e["userId"], e["dn"], e["roles"])
+        for e in rooms: self.addUserToRoom(e["userId"], e["roomName"], e["roomDn"], e["timestamp"], e["logonAllowed"])
+        for e in filters: self.addFilter(**e)
+
+        # Perutun transaktion ja palautuksen muutoksia ei julkaista, eikä niitä lasketa korvatuiksi eräpäiviksi.
+        self._coalesced = coalesced
+        self._pendingChanges.clear()
+
+
+    def _userEntries(self, userId: str | None) -> tuple[list[dict], list[dict], list[dict]]:
+
+        # Kopiot tehdään, koska osa toteutuksista muokkaa merkintöjä paikallaan.
+        scope = "any" if (userId is None) else userId
+        users = self.getActiveUsers() if (userId is None) else [e for e in (self.getUserInfo(userId),) if (e is not None)]
+
+        return (
+
+            [{**e, "roles": list(e["roles"])} for e in users],
+            [dict(e) for e in self.getUserAttendance(scope)],
+            [dict(e) for e in self.getFilterInfo(userId=scope)]
+
+        )
+
+
+    def _submit(self, func: Callable, *args, **kwargs) -> PendingCall:
+
+        pendingCall = PendingCall()
+        self._queue.put((func, self, args, kwargs, pendingCall))
+
+        return pendingCall
+
     
     def _worker(self) -> None:
 
         while True:
 
-            task, dbInstance, args, kwargs, retVal = self._queue.get()
-            retVal.append(task(dbInstance, *args, **kwargs))
-            self._queue.task_done()
+            task, dbInstance, args, kwargs, pendingCall = self._queue.get()
+
+            # Tehtävän poikkeus välitetään kutsujalle, jolloin työsäie jatkaa toimintaansa. Tehtävän muutokset julkaistaan
+            # ennen kuin kutsuja saa tuloksen, joten tilaajat näkevät muutoksen viimeistään kutsun palattua.
+            try:
+                result = task(dbInstance, *args, **kwargs)
+
+            except Exception as err:
+
+                self._flushChanges()
+                pendingCall.setException(err)
+                continue
+
+            self._flushChanges()
+            pendingCall.setResult(result)
+
+
+    # Muutossyöte. Jokainen käyttäjiin ("user"), huoneisiin ("room") ja suodatussääntöihin ("filter") kohdistuva lisäys,
+    # päivitys ja poisto julkaistaan tilaajien väylille tapahtumana (topic, {"seq": n, "op": "insert" | "update" | "delete",
+    # "entry": {...}}). Järjestysnumero seq kasvaa muutosten kirjoitusjärjestyksessä. Yhden työsäietehtävän (esim.
+    # transaktion) muutokset toimitetaan yhtenä eränä; väylän koon rajaaminen on väylän tehtävä (ks. EventBus).
+
+    @queue
+    def subscribe(self, eventBus: EventBus, topics: tuple[str, ...] | None = None) -> None:
+
+        self._subscribers.append((eventBus, frozenset(topics) if (topics) else None))
+
+
+    @queue
+    def unsubscribe(self, eventBus: EventBus) -> None:
+
+        self._subscribers = [(bus, topics) for bus, topics in self._subscribers if (bus is not eventBus)]
+
+
+    def _publish(self, topic: str, op: str, entry: dict) -> None:
+
+        # Merkinnästä tallennetaan kopio, koska osa toteutuksista muokkaa merkintöjä paikallaan.
+        if (self._subscribers): self._pendingChanges.append((topic, {"seq": next(self._changeSeq), "op": op, "entry": dict(entry)}))
+
+
+    def _flushChanges(self) -> None:
+
+        if (not self._pendingChanges): return
+
+        changes = self._pendingChanges
+        self._pendingChanges = []
+
+        for eventBus, topics in self._subscribers:
+
+            batch = changes if (topics is None) else [change for change in changes if (change[0] in topics)]
+            if (batch): eventBus.putBatch(batch)
+
+
+    # Eräpäiväindeksi. Tietokanta laskee jokaiselle huone- ja suodatussääntömerkinnälle eräpäivän (aikaleima + aikakatkaisu)
+    # aina, kun merkintä lisätään tai sen aikaleima muuttuu. Pysäytetyllä ("paused") merkinnällä ja merkinnällä, jolle
+    # ei ole määritetty aikakatkaisua, ei ole eräpäivää. Oletustoteutus pitää indeksiä muistissa TimerHeap-rakenteissa;
+    # pysyvä toteutus voi ylikirjoittaa metodit ja tallentaa eräpäivät levylle.
+
+    @staticmethod
+    def _deadline(timestamp: str | float | None, timeout: int | None) -> float | None:
+
+        if ((not timeout) or (timestamp is None) or (timestamp == "paused")): return None
+        return int(timestamp) + timeout
+
+
+    def _setRoomDeadline(self, roomEntry: dict) -> None:
+
+        key = (roomEntry["userId"], roomEntry["roomName"])
+        deadline = self._deadline(roomEntry["timestamp"], self._roomTimeouts.get(roomEntry["roomName"]))
+
+        if (deadline is None): self._roomDeadlines.cancel(key)
+        elif (self._roomDeadlines.schedule(key, deadline)): self._coalesced["room"] += 1
+
+
+    def _setFilterDeadline(self, filterEntry: dict) -> None:
+
+        deadline = self._deadline(filterEntry["timestamp"], self._filterTimeouts.get(filterEntry["role"]))
+
+        if (deadline is None): self._filterDeadlines.cancel(filterEntry["filterName"])
+        elif (self._filterDeadlines.schedule(filterEntry["filterName"], deadline)): self._coalesced["filter"] += 1
+
+
+    @queue
+    def setTimeouts(self, roomTimeouts: dict[str, int], filterTimeouts: dict[str, int]) -> None:
+
+        # Asettaa aikakatkaisut (ms) ja laskee kaikkien merkintöjen eräpäivät uudelleen yhdellä kertaa.
+        self._roomTimeouts = dict(roomTimeouts)
+        self._filterTimeouts = dict(filterTimeouts)
+
+        roomDeadlines = (((e["userId"], e["roomName"]), self._deadline(e["timestamp"], self._roomTimeouts.get(e["roomName"])), None) for e in self.getUserAttendance("any"))
+        filterDeadlines = ((e["filterName"], self._deadline(e["timestamp"], self._filterTimeouts.get(e["role"])), None) for e in self.getFilterInfo())
+
+        self._roomDeadlines.rebuild(timer for timer in roomDeadlines if (timer[1] is not None))
+        self._filterDeadlines.rebuild(timer for timer in filterDeadlines if (timer[1] is not None))
+
+
+    @queue
+    def popExpiredRooms(self, now: float, limit: int | None = None) -> list[dict]:
+
+        # Palauttaa huonemerkinnät, joiden eräpäivä on viimeistään now, ja poistaa niiden eräpäivät indeksistä. Merkintä
+        # palaa indeksiin vasta, kun sen aikaleima päivitetään (tai aikakatkaisut asetetaan uudelleen).
+        rooms = []
+
+        for (userId, roomName), _ in self._roomDeadlines.popDue(now, limit):
+            rooms.extend(self.getUserAttendance(userId, roomName))
+
+        return rooms
+
+
+    @queue
+    def popExpiredFilters(self, now: float, limit: int | None = None) -> list[dict]:
+
+        filters = []
+
+        for filterName, _ in self._filterDeadlines.popDue(now, limit):
+            filters.extend(self.getFilterInfo(filterName=filterName))
+
+        return filters
+
+
+    @queue
+    def rescheduleRoom(self, userId: str, roomName: str, deadline: float | None) -> None:
+
+        # Siirtää huonemerkinnän eräpäivää. None poistaa eräpäivän.
+        if (deadline is None): self._roomDeadlines.cancel((userId, roomName))
+
+        elif (self.getUserAttendance(userId, roomName)):
+            if (self._roomDeadlines.schedule((userId, roomName), deadline)): self._coalesced["room"] += 1
+
+
+    @queue
+    def rescheduleFilter(self, filterName: str, deadline: float | None) -> None:
+
+        if (deadline is None): self._filterDeadlines.cancel(filterName)
+
+        elif (self.getFilterInfo(filterName=filterName)):
+            if (self._filterDeadlines.schedule(filterName, deadline)): self._coalesced["filter"] += 1
+
+
+    @queue
+    def nextDeadline(self) -> float | None:
+
+        deadlines = [deadline for deadline in (self._roomDeadlines.nextDeadline(), self._filterDeadlines.nextDeadline()) if (deadline is not None)]
+
+        return min(deadlines) if (deadlines) else None
+
+
+    @queue
+    def countDeadlines(self) -> dict:
+
+        # Odottavien eräpäivien määrä (pending) ja korvattujen eräpäivien määrä (coalesced) tyypeittäin.
+        return {
+
+            "room": {"pending": len(self._roomDeadlines), "coalesced": self._coalesced["room"]},
+            "filter": {"pending": len(self._filterDeadlines), "coalesced": self._coalesced["filter"]}
+
+        }
 
 
     @abstractmethod
@@ -68,6 +394,11 @@ class Database(ABC):
         pass
     
 
+    @abstractmethod
+    def getActiveUsers(self) -> list[dict]:
+        pass
+
+
     @abstractmethod
     def getUserAttendance(self, userId: str, room: str = "any") -> list[dict]:
         pass
@@ -1,4 +1,5 @@
 from .base import Database
+from ..records import FilterRecord, RoomRecord, UserRecord
 
 
 
@@ -16,14 +17,17 @@ class Dict(Database):
     @Database.queue
     def addUser(self, userId: str, dn: str, roles: list[str]) -> None:
         
-        self.database["activeUsers"].append({"userId": userId, "dn": dn, "roles": roles})
+        self.database["activeUsers"].append(UserRecord(userId, dn, roles))
+        self._publish("user", "insert", self.database["activeUsers"][-1])
 
     
     @Database.queue
     def addFilter(self, userId: str, role: str, filterName: str, roomName: str, timestamp: str, deviceName: str, deviceIp: str, autoLocked: bool = False, renewalAmount: int = 0, filterConf: str = "") -> dict:
 
-        newFilter = {"userId": userId, "role": role, "filterName": filterName, "roomName": roomName, "deviceName": deviceName, "deviceIp": deviceIp, "timestamp": timestamp, "autoLocked": autoLocked, "renewalAmount": renewalAmount, "filterConf": filterConf}
+        newFilter = FilterRecord(userId, role, filterName, roomName, deviceName, deviceIp, timestamp, autoLocked, renewalAmount, filterConf)
         self.database["filters"].append(newFilter)
+        self._setFilterDeadline(newFilter)
+        self._publish("filter", "insert", newFilter)
 
         return newFilter
     
@@ -31,8 +35,10 @@ class Dict(Database):
     @Database.queue
     def addUserToRoom(self, userId: str, roomName: str, roomDn: str, timestamp: str, logonAllowed: bool = False) -> dict:
 
-        newRoomEntry = {"userId": userId, "roomName": roomName, "roomDn": roomDn, "timestamp": timestamp, "logonAllowed": logonAllowed}
+        newRoomEntry = RoomRecord(userId, roomName, roomDn, timestamp, logonAllowed)
         self.database["rooms"].append(newRoomEntry)
+        self._setRoomDeadline(newRoomEntry)
+        self._publish("room", "insert", newRoomEntry)
 
         return newRoomEntry
     
@@ -47,6 +53,12 @@ class Dict(Database):
         return None
 
 
+    @Database.queue
+    def getActiveUsers(self) -> list[dict]:
+
+        return list(self.database["activeUsers"])
+
+
     @Database.queue
     def getFilterInfo(self, userId: str = "any", filterName: str = "any") -> list[dict]:
 
@@ -81,7 +93,7 @@ class Dict(Database):
         rooms = []
 
         for e in self.database["rooms"]:
-            if (userId == e["userId"]):
+            if ((userId == "any") or (userId == e["userId"])):
                 if ((room == "any") or (room == e["roomName"])):
                     rooms.append(e)
 
@@ -95,6 +107,8 @@ class Dict(Database):
             if (filterName == e[1]["filterName"]):
 
                 self.database["filters"].pop(e[0])
+                self._filterDeadlines.cancel(filterName)
+                self._publish("filter", "delete", e[1])
                 return
 
 
@@ -105,6 +119,7 @@ class Dict(Database):
             if (userId == e[1]["userId"]):
 
                 self.database["activeUsers"].pop(e[0])
+                self._publish("user", "delete", e[1])
                 return
             
 
@@ -115,6 +130,8 @@ class Dict(Database):
             if (userId == e[1]["userId"] and roomName == e[1]["roomName"]):
 
                 self.database["rooms"].pop(e[0])
+                self._roomDeadlines.cancel((userId, roomName))
+                self._publish("room", "delete", e[1])
                 return
             
 
@@ -125,6 +142,7 @@ class Dict(Database):
             if (filterName == e[1]["filterName"]):
 
                 self.database["filters"][e[0]]["autoLocked"] = autoLocked
+                self._publish("filter", "update", self.database["filters"][e[0]])
                 return
     
 
@@ -135,6 +153,8 @@ class Dict(Database):
             if (filterName == e[1]["filterName"]):
 
                 self.database["filters"][e[0]]["timestamp"] = timestamp
+                self._setFilterDeadline(self.database["filters"][e[0]])
+                self._publish("filter", "update", self.database["filters"][e[0]])
                 return self.database["filters"][e[0]]
             
 
@@ -144,8 +164,23 @@ class Dict(Database):
         for e in enumerate(self.database["filters"]):
             if (filterName == e[1]["filterName"]):
 
+                previousEntry = dict(e[1])
+
                 for k, v in updatedInfo.items():
                     self.database["filters"][e[0]][k] = v
+
+                if (any(k in updatedInfo for k in ("filterName", "role", "timestamp"))):
+
+                    self._filterDeadlines.cancel(filterName)
+                    self._setFilterDeadline(self.database["filters"][e[0]])
+
+                if (self.database["filters"][e[0]]["filterName"] != filterName):
+
+                    self._publish("filter", "delete", previousEntry)
+                    self._publish("filter", "insert", self.database["filters"][e[0]])
+
+                else:
+                    self._publish("filter", "update", self.database["filters"][e[0]])
                 
                 return self.database["filters"][e[0]]
             
@@ -157,6 +192,8 @@ class Dict(Database):
             if ((userId == e[1]["userId"]) and (roomName == e[1]["roomName"])):
 
                 self.database["rooms"][e[0]]["timestamp"] = timestamp
+                self._setRoomDeadline(self.database["rooms"][e[0]])
+                self._publish("room", "update", self.database["rooms"][e[0]])
                 return self.database["rooms"][e[0]]
             
 
@@ -167,4 +204,5 @@ class Dict(Database):
             if ((userId == e[1]["userId"]) and (roomName == e[1]["roomName"])):
 
                 self.database["rooms"][e[0]]["logonAllowed"] = logonAllowed
+                self._publish("room", "update", self.database["rooms"][e[0]])
                 return self.database["rooms"][e[0]]
\ No newline at end of file
@@ -0,0 +1,271 @@
+from .base import Database
+from ..records import FilterRecord, RoomRecord, UserRecord
+
+
+
+class Indexed(Database):
+
+    # Muistinvarainen tietokanta, jonka merkinnät on indeksoitu hajautustauluihin. Toisin kuin Dict-toteutuksessa,
+    # haut, päivitykset ja poistot eivät käy läpi koko listaa, vaan kohdistuvat suoraan oikeisiin merkintöihin.
+    #
+    # Kirjoitukset tehdään copy-on-write-periaatteella: julkaistua merkintää tai käyttäjä-/laitekohtaista indeksiä
+    # ei koskaan muokata, vaan työsäie korvaa sen uudella kopiolla. Lukuoperaatiot voivat siksi lukea rakenteita
+    # suoraan kutsujan säikeessä ilman lukkoja tai työsäiettä.
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.database["activeUsers"] = {}                   # userId -> käyttäjä
+        self.database["rooms"] = {}                         # (userId, roomName) -> läsnäolo
+        self.database["filters"] = {}                       # filterName -> suodatussääntö
+
+        self.database["roomsByUser"] = {}                   # userId -> {roomName -> läsnäolo}
+        self.database["filtersByUser"] = {}                 # userId -> {filterName -> suodatussääntö}
+        self.database["filtersByDevice"] = {}               # deviceIp -> {filterName -> suodatussääntö}
+
+
+    @staticmethod
+    def _cowSet(index: dict, key, subKey, value) -> None:
+
+        entries = dict(index.get(key, {}))
+        entries[subKey] = value
+        index[key] = entries
+
+
+    @staticmethod
+    def _cowDelete(index: dict, key, subKey) -> None:
+
+        entries = index.get(key)
+        if ((entries is None) or (subKey not in entries)): return
+
+        entries = dict(entries)
+        del entries[subKey]
+
+        if (entries): index[key] = entries
+        else: del index[key]
+
+
+    def _indexFilter(self, filterEntry: dict) -> None:
+
+        filterName = filterEntry["filterName"]
+
+        self._cowSet(self.database["filtersByUser"], filterEntry["userId"], filterName, filterEntry)
+        self._cowSet(self.database["filtersByDevice"], filterEntry["deviceIp"], filterName, filterEntry)
+        self.database["filters"][filterName] = filterEntry
+
+
+    def _unindexFilter(self, filterName: str) -> dict | None:
+
+        filterEntry = self.database["filters"].pop(filterName, None)
+
+        if (filterEntry is None): return None
+
+        self._cowDelete(self.database["filtersByUser"], filterEntry["userId"], filterName)
+        self._cowDelete(self.database["filtersByDevice"], filterEntry["deviceIp"], filterName)
+        self._filterDeadlines.cancel(filterName)
+
+        return filterEntry
+
+
+    def _indexRoom(self, roomEntry: dict) -> None:
+
+        self._cowSet(self.database["roomsByUser"], roomEntry["userId"], roomEntry["roomName"], roomEntry)
+        self.database["rooms"][(roomEntry["userId"], roomEntry["roomName"])] = roomEntry
+
+
+    def _updateFilter(self, filterName: str, updatedInfo: dict) -> FilterRecord | None:
+
+        filterEntry = self.database["filters"].get(filterName)
+        if (filterEntry is None): return None
+
+        previousEntry = filterEntry
+        filterEntry = filterEntry.replace(**updatedInfo)
+
+        # Indeksoitujen kenttien muuttuessa merkintä poistetaan vanhoista indekseistä ennen uudelleenindeksointia.
+        if (any(k in updatedInfo for k in ("filterName", "userId", "deviceIp"))): self._unindexFilter(filterName)
+        self._indexFilter(filterEntry)
+
+        # Eräpäivä lasketaan uudelleen vain, jos siihen vaikuttava kenttä muuttui. Muutoin jo erääntynyt (käsittelyssä oleva)
+        # merkintä palaisi indeksiin.
+        if (any(k in updatedInfo for k in ("filterName", "role", "timestamp"))): self._setFilterDeadline(filterEntry)
+
+        # Nimen muuttuminen julkaistaan vanhan merkinnän poistona ja uuden lisäyksenä, jotta nimellä avaimensa
+        # muodostavat tilaajat pysyvät ajan tasalla.
+        if (filterEntry["filterName"] != filterName):
+
+            self._publish("filter", "delete", previousEntry)
+            self._publish("filter", "insert", filterEntry)
+
+        else:
+            self._publish("filter", "update", filterEntry)
+
+        return filterEntry
+
+
+    def _updateRoom(self, userId: str, roomName: str, updatedInfo: dict) -> RoomRecord | None:
+
+        roomEntry = self.database["rooms"].get((userId, roomName))
+        if (roomEntry is None): return None
+
+        roomEntry = roomEntry.replace(**updatedInfo)
+        self._indexRoom(roomEntry)
+
+        if ("timestamp" in updatedInfo): self._setRoomDeadline(roomEntry)
+        self._publish("room", "update", roomEntry)
+
+        return roomEntry
+
+
+    @Database.queue
+    def addUser(self, userId: str, dn: str, roles: list[str]) -> None:
+
+        op = "update" if (userId in self.database["activeUsers"]) else "insert"
+
+        self.database["activeUsers"][userId] = UserRecord(userId, dn, roles)
+        self._publish("user", op, self.database["activeUsers"][userId])
+
+
+    @Database.queue
+    def addFilter(self, userId: str, role: str, filterName: str, roomName: str, timestamp: str, deviceName: str, deviceIp: str, autoLocked: bool = False, renewalAmount: int = 0, filterConf: str = "") -> dict:
+
+        newFilter = FilterRecord(userId, role, filterName, roomName, deviceName, deviceIp, timestamp, autoLocked, renewalAmount, filterConf)
+
+        # Samanniminen sääntö korvataan, jotta indeksit pysyvät yksiselitteisinä.
+        previousEntry = self._unindexFilter(filterName)
+        self._indexFilter(newFilter)
+        self._setFilterDeadline(newFilter)
+        self._publish("filter", "insert" if (previousEntry is None) else "update", newFilter)
+
+        return newFilter
+
+
+    @Database.queue
+    def addUserToRoom(self, userId: str, roomName: str, roomDn: str, timestamp: str, logonAllowed: bool = False) -> dict:
+
+        op = "update" if ((userId, roomName) in self.database["rooms"]) else "insert"
+
+        newRoomEntry = RoomRecord(userId, roomName, roomDn, timestamp, logonAllowed)
+        self._indexRoom(newRoomEntry)
+        self._setRoomDeadline(newRoomEntry)
+        self._publish("room", op, newRoomEntry)
+
+        return newRoomEntry
+
+
+    @Database.snapshot
+    def getUserInfo(self, userId: str) -> dict | None:
+
+        return self.database["activeUsers"].get(userId)
+
+
+    @Database.snapshot
+    def getActiveUsers(self) -> list[dict]:
+
+        return list(self.database["activeUsers"].values())
+
+
+    @Database.snapshot
+    def getFilterInfo(self, userId: str = "any", filterName: str = "any") -> list[dict]:
+
+        if (filterName != "any"):
+
+            filterEntry = self.database["filters"].get(filterName)
+
+            if ((filterEntry is None) or ((userId != "any") and (userId != filterEntry["userId"]))): return []
+            return [filterEntry]
+
+        # list() kopioi arvot yhdellä atomisella operaatiolla, joten samanaikainen kirjoitus ei riko iterointia.
+        if (userId == "any"):
+            return list(self.database["filters"].values())
+
+        return list(self.database["filtersByUser"].get(userId, {}).values())
+
+
+    @Database.snapshot
+    def searchFilter(self, userId: str, roomName: str = "any", deviceName: str = "any", deviceIp: str = "any") -> list[dict]:
+
+        if (deviceIp != "any"):
+            candidates = self.database["filtersByDevice"].get(deviceIp, {}).values()
+
+        else:
+            candidates = self.database["filtersByUser"].get(userId, {}).values()
+
+        filters = []
+
+        for e in candidates:
+            if (userId == e["userId"]):
+                if ((roomName == e["roomName"]) or (roomName == "any")):
+                    if ((deviceName == e["deviceName"]) or (deviceName == "any")):
+                        filters.append(e)
+
+        return filters
+
+
+    @Database.snapshot
+    def getUserAttendance(self, userId: str, room: str = "any") -> list[dict]:
+
+        if (userId == "any"):
+            return [e for e in list(self.database["rooms"].values()) if ((room == "any") or (room == e["roomName"]))]
+
+        if (room == "any"):
+            return list(self.database["roomsByUser"].get(userId, {}).values())
+
+        roomEntry = self.database["rooms"].get((userId, room))
+
+        return [roomEntry] if (roomEntry is not None) else []
+
+
+    @Database.queue
+    def removeFilter(self, filterName: str) -> None:
+
+        filterEntry = self._unindexFilter(filterName)
+        if (filterEntry is not None): self._publish("filter", "delete", filterEntry)
+
+
+    @Database.queue
+    def removeUser(self, userId: str) -> None:
+
+        userEntry = self.database["activeUsers"].pop(userId, None)
+        if (userEntry is not None): self._publish("user", "delete", userEntry)
+
+
+    @Database.queue
+    def removeUserFromRoom(self, userId: str, roomName: str) -> None:
+
+        roomEntry = self.database["rooms"].pop((userId, roomName), None)
+        if (roomEntry is None): return
+
+        self._cowDelete(self.database["roomsByUser"], userId, roomName)
+        self._roomDeadlines.cancel((userId, roomName))
+        self._publish("room", "delete", roomEntry)
+
+
+    @Database.queue
+    def updateFilterAutolock(self, filterName: str, autoLocked: bool = True) -> None:
+
+        self._updateFilter(filterName, {"autoLocked": autoLocked})
+
+
+    @Database.queue
+    def updateFilterTs(self, filterName: str, timestamp: str) -> dict:
+
+        return self._updateFilter(filterName, {"timestamp": timestamp})
+
+
+    @Database.queue
+    def updateFilterInfo(self, filterName: str, updatedInfo: dict) -> dict:
+
+        return self._updateFilter(filterName, updatedInfo)
+
+
+    @Database.queue
+    def updateRoomTs(self, userId: str, roomName: str, timestamp: str) -> dict:
+
+        return self._updateRoom(userId, roomName, {"timestamp": timestamp})
+
+
+    @Database.queue
+    def updateRoomLogon(self, userId: str, roomName: str, logonAllowed: bool = False) -> dict:
+
+        return self._updateRoom(userId, roomName, {"logonAllowed": logonAllowed})
@@ -0,0 +1,591 @@
+from .base import Database, PendingCall
+from ..error import KuistiRemoteDatabaseError
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from queue import Empty, Queue
+from socket import socket, AF_UNIX, SHUT_RDWR, SOCK_STREAM
+from struct import Struct
+from threading import Lock, Thread
+from typing import Any, Callable
+import logging, marshal, os
+
+
+
+# Kehys: otsake (hyötykuorman pituus, pyynnön tunniste) ja marshal-muotoinen hyötykuorma. Pyyntö on (metodi, args, kwargs)
+# ja vastaus (ok, arvo). Tunniste 0 on varattu palvelimen lähettämille muutossyötteen erille (tilaus, muutokset).
+HEADER = Struct("!II")
+CHANGE_FEED = 0
+
+# Palvelimella kutsuttavissa olevat tietokannan metodit.
+REMOTE_METHODS = frozenset(name for name in dir(Database) if (not name.startswith("_"))) - {"queue", "snapshot", "transaction", "subscribe", "unsubscribe"}
+
+# Poikkeukset, jotka nostetaan asiakkaalla samantyyppisinä. Muut palvelimen poikkeukset nostetaan KuistiRemoteDatabaseError-poikkeuksena.
+_EXCEPTIONS = {e.__name__: e for e in (KeyError, ValueError, TypeError, IndexError, LookupError)}
+
+
+
+def _frame(requestId: int, value: Any) -> bytes:
+
+    payload = marshal.dumps(value)
+    return HEADER.pack(len(payload), requestId) + payload
+
+
+def _readFrame(reader) -> tuple[int, Any]:
+
+    header = reader.read(HEADER.size)
+    if (len(header) < HEADER.size): raise ConnectionError("Yhteys suljettiin.")
+
+    size, requestId = HEADER.unpack(header)
+    payload = reader.read(size)
+    if (len(payload) < size): raise ConnectionError("Yhteys suljettiin kesken kehyksen.")
+
+    return requestId, marshal.loads(payload)
+
+
+def _plain(value: Any) -> Any:
+
+    # Merkinnät (Record) muutetaan sanakirjoiksi, jotka marshal osaa serialisoida. Kopio tehdään samalla kertaa, joten
+    # paikallaan muokattavat merkinnät (Dict) eivät muutu ennen kuin vastaus on kirjoitettu.
+    if (isinstance(value, Mapping)): return dict(value)
+    if (isinstance(value, list)): return [dict(v) if (isinstance(v, Mapping)) else v for v in value]
+
+    return value
+
+
+def _error(err: Exception) -> tuple[bool, tuple[str, list[str]]]:
+
+    return (False, (type(err).__name__, [str(arg) for arg in err.args]))
+
+
+
+class _Connection():
+
+    # Palvelimen puoli yhdestä asiakasyhteydestä. Vastaukset kirjoitetaan valmistumisjärjestyksessä omassa säikeessään,
+    # joten hidas kutsu (tai käyttäjälukon odotus) ei pidätä saman yhteyden muita vastauksia. Jonossa odottavat kehykset
+    # kirjoitetaan yhdellä kertaa.
+
+    def __init__(self, sock: socket) -> None:
+
+        self.sock = sock
+        self.closed = False
+        self.subscriptions = {}
+        self._outbox = Queue()
+        self._writerThread = Thread(target=self._writer, daemon=True)
+        self._writerThread.start()
+
+
+    def send(self, requestId: int, value: Any) -> None:
+
+        if (not self.closed): self._outbox.put((requestId, value))
+
+
+    def _writer(self) -> None:
+
+        try:
+            while True:
+
+                frames = [self._outbox.get()]
+
+                while (len(frames) < 256):
+                    try:
+                        frames.append(self._outbox.get_nowait())
+
+                    except Empty:
+                        break
+
+                if (None in frames): break
+                self.sock.sendall(b"".join(_frame(requestId, value) for requestId, value in frames))
+
+        except OSError:
+            pass
+
+
+    def close(self) -> None:
+
+        self.closed = True
+        self._outbox.put(None)
+
+
+
+class _Subscription():
+
+    # Etäasiakkaan muutossyötteen tilaus. Tietokanta kutsuu tätä kuten paikallista tapahtumaväylää.
+
+    def __init__(self, connection: _Connection, subscriptionId: int) -> None:
+
+        self.connection = connection
+        self.subscriptionId = subscriptionId
+
+
+    def put(self, topic: str, change: dict) -> None:
+
+        self.putBatch([(topic, change)])
+
+
+    def putBatch(self, changes: list[tuple[str, dict]]) -> None:
+
+        self.connection.send(CHANGE_FEED, (self.subscriptionId, changes))
+
+
+
+class DatabaseServer():
+
+    """
+    Jakaa tietokannan Unix-soketin kautta useammalle Kuisti-prosessille (ks. Remote). Jonotetut (@queue) kutsut välitetään
+    suoraan tietokannan työsäikeelle, joten saman yhteyden pyynnöt voivat olla käsittelyssä yhtä aikaa (pipelining).
+    Muut kutsut suoritetaan palvelimen säiejoukossa (workers).
+
+    Transaktioita ei voi lähettää soketin yli, joten palvelin tarjoaa niiden tilalle käyttäjäkohtaiset lukot: saman
+    käyttäjän transaktiot suoritetaan kaikissa prosesseissa vuorotellen, mutta kutsut eivät ole atomisia.
+    """
+
+    def __init__(self, database: Database, path: str, workers: int = 4) -> None:
+
+        self.database = database
+        self.path = path
+        self.logger = logging.getLogger("kuisti")
+
+        self._sock = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-server")
+        self._lock = Lock()
+        self._userLocks = {}
+        self._connections = []
+
+
+    def start(self) -> None:
+
+        # Edellisen ajon jättämä soketti poistetaan. Oikeudet rajataan omistajaan ja ryhmään, koska marshal-muotoisia
+        # kehyksiä ei tule vastaanottaa luottamattomilta prosesseilta.
+        if (os.path.exists(self.path)): os.unlink(self.path)
+
+        self._sock = socket(AF_UNIX, SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o660)
+        self._sock.listen()
+
+        Thread(target=self._acceptWorker, daemon=True).start()
+        self.logger.info(f'Tietokantapalvelin kuuntelee soketissa "{self.path}".')
+
+
+    def close(self) -> None:
+
+        if (self._sock is not None): self._sock.close()
+
+        # shutdown herättää yhteyksien lukusäikeet, jotka vapauttavat lukot ja peruvat tilaukset.
+        for connection in list(self._connections):
+            try:
+                connection.sock.shutdown(SHUT_RDWR)
+
+            except OSError:
+                pass
+
+        self._executor.shutdown(wait=False)
+
+
+    def _acceptWorker(self) -> None:
+
+        while True:
+
+            try:
+                sock, _ = self._sock.accept()
+
+            except OSError:
+                break
+
+            connection = _Connection(sock)
+            self._connections.append(connection)
+            Thread(target=self._readWorker, args=(connection,), daemon=True).start()
+
+
+    def _readWorker(self, connection: _Connection) -> None:
+
+        reader = connection.sock.makefile("rb")
+
+        try:
+            while True:
+
+                requestId, (name, args, kwargs) = _readFrame(reader)
+                self._dispatch(connection, requestId, name, args, kwargs)
+
+        # RuntimeError: palvelin suljettiin (säiejoukko ei enää ota tehtäviä).
+        except (OSError, ValueError, EOFError, RuntimeError):
+            pass
+
+        finally:
+
+            self._dropConnection(connection)
+            reader.close()
+            connection.sock.close()
+
+
+    def _dispatch(self, connection: _Connection, requestId: int, name: str, args: tuple, kwargs: dict) -> None:
+
+        if (name == "_acquire"):
+            self._acquire(args[0], connection, requestId)
+
+        elif (name == "_release"):
+
+            self._release(args[0], connection)
+            connection.send(requestId, (True, None))
+
+        elif (name == "subscribe"):
+
+            subscription = _Subscription(connection, args[0])
+            connection.subscriptions[args[0]] = subscription
+            self._executor.submit(self._call, connection, requestId, type(self.database).subscribe, (subscription, args[1]), {})
+
+        elif (name == "unsubscribe"):
+
+            subscription = connection.subscriptions.pop(args[0], None)
+            if (subscription is None): connection.send(requestId, (True, None))
+            else: self._executor.submit(self._call, connection, requestId, type(self.database).unsubscribe, (subscription,), {})
+
+        elif (name not in REMOTE_METHODS):
+            connection.send(requestId, (False, ("AttributeError", [f"Tuntematon tietokantametodi {name}."])))
+
+        else:
+
+            func = getattr(type(self.database), name)
+
+            # Tilannekuvasta palvelevat lukuoperaatiot ja kutsuja edelleen välittävän tietokannan (Sharded) metodit
+            # suoritetaan säiejoukossa, muut tietokannan työsäikeessä.
+            if (self.database._delegating or getattr(func, "snapshotRead", False)):
+                self._executor.submit(self._call, connection, requestId, func, args, kwargs)
+
+            else:
+                self.database._submit(DatabaseServer._runQueued, connection, requestId, func.__wrapped__, args, kwargs)
+
+
+    @staticmethod
+    def _runQueued(db: Database, connection: _Connection, requestId: int, func: Callable, args: tuple, kwargs: dict) -> None:
+
+        # Suoritetaan tietokannan työsäikeessä. Tehtävän muutokset julkaistaan ennen vastausta, jotta tilaajat näkevät
+        # muutoksen viimeistään kutsun palattua kuten paikallisesti.
+        try:
+            result = (True, _plain(func(db, *args, **kwargs)))
+
+        except Exception as err:
+            result = _error(err)
+
+        db._flushChanges()
+        connection.send(requestId, result)
+
+
+    def _call(self, connection: _Connection, requestId: int, func: Callable, args: tuple, kwargs: dict) -> None:
+
+        try:
+            result = (True, _plain(func(self.database, *args, **kwargs)))
+
+        except Exception as err:
+            result = _error(err)
+
+        connection.send(requestId, result)
+
+
+    def _acquire(self, userId: str, connection: _Connection, requestId: int) -> None:
+
+        # Lukko myönnetään vastaamalla pyyntöön. Odottajat palvellaan saapumisjärjestyksessä.
+        with self._lock:
+
+            entry = self._userLocks.get(userId)
+
+            if (entry is None):
+                self._userLocks[userId] = [connection, deque()]
+
+            else:
+
+                entry[1].append((connection, requestId))
+                return
+
+        connection.send(requestId, (True, None))
+
+
+    def _release(self, userId: str, connection: _Connection) -> None:
+
+        with self._lock:
+
+            entry = self._userLocks.get(userId)
+            if ((entry is None) or (entry[0] is not connection)): return
+
+            if (not entry[1]):
+
+                del self._userLocks[userId]
+                return
+
+            entry[0], requestId = entry[1].popleft()
+            nextConnection = entry[0]
+
+        nextConnection.send(requestId, (True, None))
+
+
+    def _dropConnection(self, connection: _Connection) -> None:
+
+        # Katkenneen yhteyden lukot vapautetaan ja tilaukset perutaan.
+        connection.close()
+
+        with self._lock:
+
+            owned = [userId for userId, entry in self._userLocks.items() if (entry[0] is connection)]
+
+            for entry in self._userLocks.values():
+                entry[1] = deque(waiter for waiter in entry[1] if (waiter[0] is not connection))
+
+        for userId in owned:
+            self._release(userId, connection)
+
+        for subscription in connection.subscriptions.values():
+            self.database.unsubscribe(subscription)
+
+        if (connection in self._connections): self._connections.remove(connection)
+
+
+
+class Remote(Database):
+
+    # Asiakas DatabaseServer-palvelimen tietokantaan. Parametri database on palvelimen Unix-soketin polku, esim.
+    # Remote(database="/run/kuisti/db.sock"). Kaikki prosessin säikeet jakavat yhden yhteyden: pyynnöt kirjoitetaan
+    # sokettiin odottamatta aiempien vastauksia, ja vastaukset ohjataan odottajille pyynnön tunnisteen perusteella.
+    #
+    # Kyselyt palauttavat merkinnät tavallisina sanakirjoina. Transaktion funktio suoritetaan kutsujan säikeessä
+    # käyttäjäkohtaisen lukon alla (ks. DatabaseServer), joten transaktio vaatii käyttäjätunnuksen.
+
+    _delegating = True
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.logger = logging.getLogger("kuisti")
+
+        self._sock = socket(AF_UNIX, SOCK_STREAM)
+        self._sock.connect(self.database)
+        self._sendLock = Lock()
+        self._pending = {}
+        self._requestIds = count(1)
+        self._subscriptions = {}
+        self._subscriptionIds = count(1)
+        self._closed = False
+
+        self._receiverThread = Thread(target=self._receiver, daemon=True)
+        self._receiverThread.start()
+
+
+    def _send(self, name: str, *args, **kwargs) -> PendingCall:
+
+        requestId = next(self._requestIds)
+        pendingCall = PendingCall()
+        self._pending[requestId] = pendingCall
+
+        try:
+            if (self._closed): raise ConnectionError("Yhteys on suljettu.")
+
+            frame = _frame(requestId, (name, args, kwargs))
+
+            with self._sendLock:
+                self._sock.sendall(frame)
+
+        except (OSError, ValueError) as err:
+
+            self._pending.pop(requestId, None)
+            raise KuistiRemoteDatabaseError(f'Kutsu {name} tietokantapalvelimelle "{self.database}" epäonnistui: {err}') from err
+
+        return pendingCall
+
+
+    def _call(self, name: str, *args, **kwargs) -> Any:
+
+        return self._send(name, *args, **kwargs).result()
+
+
+    def _receiver(self) -> None:
+
+        reader = self._sock.makefile("rb")
+
+        try:
+            while True:
+
+                requestId, payload = _readFrame(reader)
+
+                if (requestId == CHANGE_FEED):
+
+                    subscriptionId, changes = payload
+                    eventBus = self._subscriptions.get(subscriptionId)
+                    if (eventBus is not None): eventBus.putBatch(changes)
+
+                    continue
+
+                pendingCall = self._pending.pop(requestId, None)
+                if (pendingCall is None): continue
+
+                ok, value = payload
+
+                if (ok):
+                    pendingCall.setResult(value)
+
+                else:
+
+                    errorName, errorArgs = value
+                    errorType = _EXCEPTIONS.get(errorName)
+                    pendingCall.setException(errorType(*errorArgs) if (errorType) else KuistiRemoteDatabaseError(f"{errorName}: {', '.join(errorArgs)}"))
+
+        except (OSError, ValueError, EOFError) as err:
+
+            # Oma close() katkaisee yhteyden normaalisti, joten virhe kirjataan vain odottamattomasta katkeamisesta.
+            if (not self._closed): self.logger.error(f'Yhteys tietokantapalvelimeen "{self.database}" katkesi: {err}')
+            self._closed = True
+
+            for requestId in list(self._pending):
+
+                pendingCall = self._pending.pop(requestId, None)
+                if (pendingCall is not None): pendingCall.setException(KuistiRemoteDatabaseError("Yhteys tietokantapalvelimeen katkesi."))
+
+
+    def close(self) -> None:
+
+        self._closed = True
+        self._sock.close()
+
+
+    def transaction(self, func: Callable, *args, userId: str | None = None, **kwargs) -> Any:
+
+        if (userId is None): raise ValueError("Remote-tietokannan transaktio vaatii käyttäjätunnuksen (userId).")
+
+        self._call("_acquire", userId)
+
+        try:
+            return func(self, *args, **kwargs)
+
+        finally:
+            self._call("_release", userId)
+
+
+    def subscribe(self, eventBus, topics: tuple[str, ...] | None = None) -> None:
+
+        subscriptionId = next(self._subscriptionIds)
+        self._subscriptions[subscriptionId] = eventBus
+        self._call("subscribe", subscriptionId, tuple(topics) if (topics) else None)
+
+
+    def unsubscribe(self, eventBus) -> None:
+
+        for subscriptionId in [k for k, v in self._subscriptions.items() if (v is eventBus)]:
+
+            self._call("unsubscribe", subscriptionId)
+            del self._subscriptions[subscriptionId]
+
+
+    def setTimeouts(self, roomTimeouts: dict[str, int], filterTimeouts: dict[str, int]) -> None:
+
+        self._call("setTimeouts", roomTimeouts, filterTimeouts)
+
+
+    def popExpiredRooms(self, now: float, limit: int | None = None) -> list[dict]:
+
+        return self._call("popExpiredRooms", now, limit)
+
+
+    def popExpiredFilters(self, now: float, limit: int | None = None) -> list[dict]:
+
+        return self._call("popExpiredFilters", now, limit)
+
+
+    def rescheduleRoom(self, userId: str, roomName: str, deadline: float | None) -> None:
+
+        self._call("rescheduleRoom", userId, roomName, deadline)
+
+
+    def rescheduleFilter(self, filterName: str, deadline: float | None) -> None:
+
+        self._call("rescheduleFilter", filterName, deadline)
+
+
+    def nextDeadline(self) -> float | None:
+
+        return self._call("nextDeadline")
+
+
+    def countDeadlines(self) -> dict:
+
+        return self._call("countDeadlines")
+
+
+    def addUser(self, userId: str, dn: str, roles: list[str]) -> None:
+
+        self._call("addUser", userId, dn, roles)
+
+
+    def addFilter(self, userId: str, role: str, filterName: str, roomName: str, timestamp: str, deviceName: str, deviceIp: str, autoLocked: bool = False, renewalAmount: int = 0, filterConf: str = "") -> dict:
+
+        return self._call("addFilter", userId, role, filterName, roomName, timestamp, deviceName, deviceIp, autoLocked, renewalAmount, filterConf)
+
+
+    def addUserToRoom(self, userId: str, roomName: str, roomDn: str, timestamp: str, logonAllowed: bool = False) -> dict:
+
+        return self._call("addUserToRoom", userId, roomName, roomDn, timestamp, logonAllowed)
+
+
+    def getUserInfo(self, userId: str) -> dict | None:
+
+        return self._call("getUserInfo", userId)
+
+
+    def getActiveUsers(self) -> list[dict]:
+
+        return self._call("getActiveUsers")
+
+
+    def getFilterInfo(self, userId: str = "any", filterName: str = "any") -> list[dict]:
+
+        return self._call("getFilterInfo", userId, filterName)
+
+
+    def searchFilter(self, userId: str, roomName: str = "any", deviceName: str = "any", deviceIp: str = "any") -> list[dict]:
+
+        return self._call("searchFilter", userId, roomName, deviceName, deviceIp)
+
+
+    def getUserAttendance(self, userId: str, room: str = "any") -> list[dict]:
+
+        return self._call("getUserAttendance", userId, room)
+
+
+    def removeFilter(self, filterName: str) -> None:
+
+        self._call("removeFilter", filterName)
+
+
+    def removeUser(self, userId: str) -> None:
+
+        self._call("removeUser", userId)
+
+
+    def removeUserFromRoom(self, userId: str, roomName: str) -> None:
+
+        self._call("removeUserFromRoom", userId, roomName)
+
+
+    def updateFilterAutolock(self, filterName: str, autoLocked: bool = True) -> None:
+
+        self._call("updateFilterAutolock", filterName, autoLocked)
+
+
+    def updateFilterTs(self, filterName: str, timestamp: str) -> dict:
+
+        return self._call("updateFilterTs", filterName, timestamp)
+
+
+    def updateFilterInfo(self, filterName: str, updatedInfo: dict) -> dict:
+
+        return self._call("updateFilterInfo", filterName, updatedInfo)
+
+
+    def updateRoomTs(self, userId: str, roomName: str, timestamp: str) -> dict:
+
+        return self._call("updateRoomTs", userId, roomName, timestamp)
+
+
+    def updateRoomLogon(self, userId: str, roomName: str, logonAllowed: bool = False) -> dict:
+
+        return self._call("updateRoomLogon", userId, roomName, logonAllowed)
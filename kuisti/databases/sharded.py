@@ -0,0 +1,277 @@
+from .base import Database, PendingCall
+from threading import current_thread
+from typing import Any, Callable
+from zlib import crc32
+
+
+
+class Sharded(Database):
+
+    # Jakaa tilan käyttäjätunnuksen (userId) hajautusarvon perusteella useaan tietokantaan (shard), joilla kullakin on oma
+    # työsäikeensä. Eri käyttäjien kirjoitukset eivät siten jonota saman työsäikeen takana. Parametri database on lista
+    # tietokantoja, esim. Sharded(database=[Indexed(database={}) for _ in range(4)]). Hajautus on prosessista riippumaton
+    # (crc32), joten pysyvät tietokannat voidaan avata uudelleen samassa järjestyksessä.
+    #
+    # Yhden käyttäjän kyselyt ohjataan suoraan oikeaan tietokantaan. Kaikkia käyttäjiä koskevat kyselyt (userId="any")
+    # lähetetään kaikille tietokannoille rinnakkain ja tulokset yhdistetään. Suodatussäännön nimestä tietokantaan
+    # johtava kartta pidetään muistissa; jos nimeä ei löydy kartasta, sääntöä etsitään kaikista tietokannoista.
+    #
+    # Muutossyötteen järjestysnumerot ovat yhteisiä kaikille tietokannoille, mutta järjestys on taattu vain saman
+    # käyttäjän muutoksille.
+
+    _delegating = True
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        if (not self.database): raise ValueError("Sharded tarvitsee vähintään yhden tietokannan.")
+
+        self.shards = list(self.database)
+        self._filterShards = {}
+        self._rotation = 0
+
+        for shard in self.shards:
+            shard._changeSeq = self._changeSeq
+
+        # Palautetaan kartta olemassa olevista säännöistä (esim. pysyvät tietokannat).
+        for idx, shard in enumerate(self.shards):
+            for filterEntry in shard.getFilterInfo():
+                self._filterShards[filterEntry["filterName"]] = idx
+
+
+    def _shardIdx(self, userId: str) -> int:
+
+        return crc32(userId.encode()) % len(self.shards)
+
+
+    def _shard(self, userId: str) -> Database:
+
+        return self.shards[self._shardIdx(userId)]
+
+
+    def _findFilter(self, filterName: str) -> Database | None:
+
+        idx = self._filterShards.get(filterName)
+        if (idx is not None): return self.shards[idx]
+
+        for idx, result in enumerate(self._scatter("getFilterInfo", filterName=filterName)):
+            if (result):
+
+                self._filterShards[filterName] = idx
+                return self.shards[idx]
+
+        return None
+
+
+    def _scatter(self, name: str, *args, shards: list[Database] | None = None, shardArgs: list[tuple] | None = None, **kwargs) -> list:
+
+        # Lähetä kutsu kaikille (tai annetuille) tietokannoille ennen kuin yhdenkään tulosta odotetaan. Tilannekuvasta
+        # palvelevat lukuoperaatiot suoritetaan suoraan kutsujan säikeessä. shardArgs antaa tietokantakohtaiset argumentit.
+        shards = self.shards if (shards is None) else shards
+        pending = []
+
+        for idx, shard in enumerate(shards):
+
+            func = getattr(type(shard), name)
+            callArgs = args if (shardArgs is None) else shardArgs[idx]
+
+            if (getattr(func, "snapshotRead", False) or (current_thread() is shard._workerThread)):
+                pending.append(func(shard, *callArgs, **kwargs))
+
+            else:
+                pending.append(shard._submit(func.__wrapped__, *callArgs, **kwargs))
+
+        return [result.result() if (isinstance(result, PendingCall)) else result for result in pending]
+
+
+    def _popExpired(self, name: str, now: float, limit: int | None) -> list[dict]:
+
+        if (limit is None):
+            return [e for entries in self._scatter(name, now, None) for e in entries]
+
+        # Erän koko jaetaan tietokantojen kesken. Jakojäännös kiertää tietokannalta toiselle, jotta pienilläkään
+        # erillä mikään tietokanta ei jää jatkuvasti ilman vuoroa.
+        base, extra = divmod(limit, len(self.shards))
+        start = self._rotation
+        self._rotation = (start + 1) % len(self.shards)
+
+        limits = [base + (1 if ((idx - start) % len(self.shards) < extra) else 0) for idx in range(len(self.shards))]
+        shards = [shard for shard, shardLimit in zip(self.shards, limits) if (shardLimit)]
+        shardArgs = [(now, shardLimit) for shardLimit in limits if (shardLimit)]
+
+        return [e for entries in self._scatter(name, shards=shards, shardArgs=shardArgs) for e in entries]
+
+
+    def transaction(self, func: Callable, *args, userId: str | None = None, **kwargs) -> Any:
+
+        # Transaktio suoritetaan käyttäjän tietokannassa, ja funktio saa parametrina kyseisen tietokannan. Koko tietokannan
+        # kattavaa transaktiota ei tueta, koska eri tietokantojen työsäikeitä ei voi varata yhtä aikaa.
+        if (userId is None): raise ValueError("Sharded-tietokannan transaktio vaatii käyttäjätunnuksen (userId).")
+
+        return self._shard(userId).transaction(func, *args, userId=userId, **kwargs)
+
+
+    def subscribe(self, eventBus, topics: tuple[str, ...] | None = None) -> None:
+
+        for shard in self.shards:
+            shard.subscribe(eventBus, topics)
+
+
+    def unsubscribe(self, eventBus) -> None:
+
+        for shard in self.shards:
+            shard.unsubscribe(eventBus)
+
+
+    def setTimeouts(self, roomTimeouts: dict[str, int], filterTimeouts: dict[str, int]) -> None:
+
+        self._scatter("setTimeouts", roomTimeouts, filterTimeouts)
+
+
+    def popExpiredRooms(self, now: float, limit: int | None = None) -> list[dict]:
+
+        return self._popExpired("popExpiredRooms", now, limit)
+
+
+    def popExpiredFilters(self, now: float, limit: int | None = None) -> list[dict]:
+
+        return self._popExpired("popExpiredFilters", now, limit)
+
+
+    def rescheduleRoom(self, userId: str, roomName: str, deadline: float | None) -> None:
+
+        self._shard(userId).rescheduleRoom(userId, roomName, deadline)
+
+
+    def rescheduleFilter(self, filterName: str, deadline: float | None) -> None:
+
+        shard = self._findFilter(filterName)
+        if (shard is not None): shard.rescheduleFilter(filterName, deadline)
+
+
+    def nextDeadline(self) -> float | None:
+
+        deadlines = [deadline for deadline in self._scatter("nextDeadline") if (deadline is not None)]
+
+        return min(deadlines) if (deadlines) else None
+
+
+    def countDeadlines(self) -> dict:
+
+        counts = {"room": {"pending": 0, "coalesced": 0}, "filter": {"pending": 0, "coalesced": 0}}
+
+        for shardCounts in self._scatter("countDeadlines"):
+            for timerType, typeCounts in shardCounts.items():
+                for k, v in typeCounts.items(): counts[timerType][k] += v
+
+        return counts
+
+
+    def addUser(self, userId: str, dn: str, roles: list[str]) -> None:
+
+        self._shard(userId).addUser(userId, dn, roles)
+
+
+    def addFilter(self, userId: str, role: str, filterName: str, roomName: str, timestamp: str, deviceName: str, deviceIp: str, autoLocked: bool = False, renewalAmount: int = 0, filterConf: str = "") -> dict:
+
+        idx = self._shardIdx(userId)
+        self._filterShards[filterName] = idx
+
+        return self.shards[idx].addFilter(userId, role, filterName, roomName, timestamp, deviceName, deviceIp, autoLocked, renewalAmount, filterConf)
+
+
+    def addUserToRoom(self, userId: str, roomName: str, roomDn: str, timestamp: str, logonAllowed: bool = False) -> dict:
+
+        return self._shard(userId).addUserToRoom(userId, roomName, roomDn, timestamp, logonAllowed)
+
+
+    def getUserInfo(self, userId: str) -> dict | None:
+
+        return self._shard(userId).getUserInfo(userId)
+
+
+    def getActiveUsers(self) -> list[dict]:
+
+        return [e for users in self._scatter("getActiveUsers") for e in users]
+
+
+    def getFilterInfo(self, userId: str = "any", filterName: str = "any") -> list[dict]:
+
+        if (userId != "any"):
+            return self._shard(userId).getFilterInfo(userId, filterName)
+
+        if (filterName != "any"):
+
+            shard = self._findFilter(filterName)
+            return shard.getFilterInfo(filterName=filterName) if (shard is not None) else []
+
+        return [e for filters in self._scatter("getFilterInfo") for e in filters]
+
+
+    def searchFilter(self, userId: str, roomName: str = "any", deviceName: str = "any", deviceIp: str = "any") -> list[dict]:
+
+        return self._shard(userId).searchFilter(userId, roomName, deviceName, deviceIp)
+
+
+    def getUserAttendance(self, userId: str, room: str = "any") -> list[dict]:
+
+        if (userId != "any"):
+            return self._shard(userId).getUserAttendance(userId, room)
+
+        return [e for rooms in self._scatter("getUserAttendance", userId, room) for e in rooms]
+
+
+    def removeFilter(self, filterName: str) -> None:
+
+        shard = self._findFilter(filterName)
+        if (shard is None): return
+
+        shard.removeFilter(filterName)
+        self._filterShards.pop(filterName, None)
+
+
+    def removeUser(self, userId: str) -> None:
+
+        self._shard(userId).removeUser(userId)
+
+
+    def removeUserFromRoom(self, userId: str, roomName: str) -> None:
+
+        self._shard(userId).removeUserFromRoom(userId, roomName)
+
+
+    def updateFilterAutolock(self, filterName: str, autoLocked: bool = True) -> None:
+
+        shard = self._findFilter(filterName)
+        if (shard is not None): shard.updateFilterAutolock(filterName, autoLocked)
+
+
+    def updateFilterTs(self, filterName: str, timestamp: str) -> dict:
+
+        shard = self._findFilter(filterName)
+        return shard.updateFilterTs(filterName, timestamp) if (shard is not None) else None
+
+
+    def updateFilterInfo(self, filterName: str, updatedInfo: dict) -> dict:
+
+        shard = self._findFilter(filterName)
+        if (shard is None): return None
+
+        # Uudelleennimetty sääntö pysyy samassa tietokannassa (sama käyttäjä), joten vain kartan avain vaihtuu.
+        filterEntry = shard.updateFilterInfo(filterName, updatedInfo)
+
+        if ((filterEntry is not None) and (filterEntry["filterName"] != filterName)):
+            self._filterShards[filterEntry["filterName"]] = self._filterShards.pop(filterName, self.shards.index(shard))
+
+        return filterEntry
+
+
+    def updateRoomTs(self, userId: str, roomName: str, timestamp: str) -> dict:
+
+        return self._shard(userId).updateRoomTs(userId, roomName, timestamp)
+
+
+    def updateRoomLogon(self, userId: str, roomName: str, logonAllowed: bool = False) -> dict:
+
+        return self._shard(userId).updateRoomLogon(userId, roomName, logonAllowed)
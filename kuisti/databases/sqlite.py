@@ -0,0 +1,529 @@
+from .base import Database
+from ..records import FilterRecord, RoomRecord, UserRecord
+from json import dumps, loads
+from threading import current_thread, local
+import sqlite3
+
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activeUsers (
+
+    userId TEXT NOT NULL PRIMARY KEY,
+    dn TEXT,
+    roles TEXT
+
+);
+
+CREATE TABLE IF NOT EXISTS rooms (
+
+    userId TEXT NOT NULL,
+    roomName TEXT NOT NULL,
+    roomDn TEXT,
+    timestamp,
+    logonAllowed INTEGER NOT NULL DEFAULT 0,
+    deadline REAL
+
+);
+
+CREATE TABLE IF NOT EXISTS filters (
+
+    filterName TEXT NOT NULL,
+    userId TEXT NOT NULL,
+    role TEXT,
+    roomName TEXT,
+    deviceName TEXT,
+    deviceIp TEXT,
+    timestamp,
+    autoLocked INTEGER NOT NULL DEFAULT 0,
+    renewalAmount INTEGER NOT NULL DEFAULT 0,
+    filterConf TEXT,
+    deadline REAL
+
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS roomsByUser ON rooms (userId, roomName);
+CREATE UNIQUE INDEX IF NOT EXISTS filtersByName ON filters (filterName);
+CREATE INDEX IF NOT EXISTS filtersByUser ON filters (userId, roomName);
+CREATE INDEX IF NOT EXISTS filtersByDevice ON filters (deviceIp);
+"""
+
+# Eräpäiväindeksit luodaan vasta, kun vanhan version tietokantaan on lisätty deadline-sarake.
+DEADLINE_SCHEMA = """
+CREATE INDEX IF NOT EXISTS roomsByDeadline ON rooms (deadline);
+CREATE INDEX IF NOT EXISTS filtersByDeadline ON filters (deadline);
+
+CREATE TEMP TABLE IF NOT EXISTS roomTimeouts (roomName TEXT NOT NULL PRIMARY KEY, timeout INTEGER NOT NULL);
+CREATE TEMP TABLE IF NOT EXISTS filterTimeouts (role TEXT NOT NULL PRIMARY KEY, timeout INTEGER NOT NULL);
+"""
+
+# Eräpäivä lasketaan merkinnän nykyisestä aikaleimasta ja väliaikaiseen tauluun tallennetusta aikakatkaisusta.
+# Ilman aikakatkaisua tai pysäytetyllä ("paused") merkinnällä eräpäivä on NULL.
+ROOM_DEADLINE = "CASE WHEN timestamp = 'paused' THEN NULL ELSE CAST(timestamp AS INTEGER) + (SELECT timeout FROM temp.roomTimeouts t WHERE t.roomName = rooms.roomName AND t.timeout > 0) END"
+FILTER_DEADLINE = "CASE WHEN timestamp = 'paused' THEN NULL ELSE CAST(timestamp AS INTEGER) + (SELECT timeout FROM temp.filterTimeouts t WHERE t.role = filters.role AND t.timeout > 0) END"
+
+ROOM_COLUMNS = "userId, roomName, roomDn, timestamp, logonAllowed"
+FILTER_COLUMNS = "userId, role, filterName, roomName, deviceName, deviceIp, timestamp, autoLocked, renewalAmount, filterConf"
+
+
+
+class Sqlite(Database):
+
+    # Pysyvä tietokanta. Tila säilyy levyllä (WAL-tilassa) ohjelman uudelleenkäynnistysten yli. Kyselyt on kirjoitettu
+    # vakiomuotoisiksi parametrisoiduiksi lauseiksi, jolloin sqlite3 käyttää valmiiksi käännettyjä lauseita välimuistista.
+    # Parametri database on tietokantatiedoston polku.
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        if (self.database is None): self.database = "kuisti.db"
+
+        # Lukuyhteydet avataan samaan tiedostoon (ks. _reader). Muistinvarainen tai väliaikainen tietokanta olisi jokaiselle
+        # yhteydelle eri ja tyhjä, joten niitä ei tueta; muistinvarainen tila saadaan Indexed-tietokannalla.
+        if ((self.database in (":memory:", "")) or ("mode=memory" in str(self.database))):
+            raise ValueError(f'Sqlite-tietokanta vaatii tietokantatiedoston polun, ei "{self.database}".')
+
+        # Kirjoitukset suoritetaan tietokannan työsäikeessä, joten kirjoitusyhteyttä voidaan käyttää muustakin kuin luovasta säikeestä.
+        self._connection = self._connect()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._migrate()
+        self._connection.executescript(DEADLINE_SCHEMA)
+
+        # Lukuoperaatiot käyttävät säiekohtaisia lukuyhteyksiä. WAL-tilassa jokainen luku näkee yhtenäisen tilannekuvan
+        # viimeksi vahvistetusta tilasta, eikä lukijoiden tarvitse odottaa kirjoittajaa.
+        self._readers = local()
+
+
+    def _connect(self) -> sqlite3.Connection:
+
+        connection = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None, cached_statements=256)
+        connection.row_factory = sqlite3.Row
+
+        return connection
+
+
+    def _migrate(self) -> None:
+
+        for table in ("rooms", "filters"):
+
+            columns = [row["name"] for row in self._connection.execute(f"PRAGMA table_info({table})")]
+            if ("deadline" not in columns): self._connection.execute(f"ALTER TABLE {table} ADD COLUMN deadline REAL")
+
+
+    def _reader(self) -> sqlite3.Connection:
+
+        # Työsäie lukee kirjoitusyhteydellä, jotta se näkee myös omat, vielä vahvistamattomat muutoksensa.
+        if (current_thread() is self._workerThread): return self._connection
+
+        connection = getattr(self._readers, "connection", None)
+
+        if (connection is None):
+
+            connection = self._connect()
+            connection.execute("PRAGMA query_only=ON")
+            self._readers.connection = connection
+
+        return connection
+
+
+    def _beginTransaction(self, userId: str | None) -> None:
+
+        self._connection.execute("BEGIN IMMEDIATE")
+        self._savepoint = dict(self._coalesced)
+
+
+    def _commitTransaction(self) -> None:
+
+        self._connection.execute("COMMIT")
+
+
+    def _rollbackTransaction(self) -> None:
+
+        # Perutun transaktion muutoksia ei julkaista muutossyötteeseen eikä lasketa korvatuiksi eräpäiviksi.
+        self._connection.execute("ROLLBACK")
+        self._coalesced = self._savepoint
+        self._pendingChanges.clear()
+
+
+    def _hasDeadline(self, table: str, where: str, params: tuple) -> bool:
+
+        row = self._connection.execute(f"SELECT deadline FROM {table} WHERE {where}", params).fetchone()
+        return (row is not None) and (row[0] is not None)
+
+
+    def _setDeadline(self, timerType: str, pending: bool, deadline: str, where: str, params: tuple) -> None:
+
+        # Asettaa eräpäivän (SQL-lauseke) ja laskee korvatut eräpäivät kuten muistinvarainen indeksi (ks. TimerHeap.schedule).
+        table = "rooms" if (timerType == "room") else "filters"
+        row = self._connection.execute(f"UPDATE {table} SET deadline = {deadline} WHERE {where} RETURNING deadline", params).fetchone()
+
+        if (pending and (row is not None) and (row[0] is not None)): self._coalesced[timerType] += 1
+
+
+    @staticmethod
+    def _userRow(row: sqlite3.Row | None) -> UserRecord | None:
+
+        if (row is None): return None
+        return UserRecord(row["userId"], row["dn"], loads(row["roles"]))
+
+
+    @staticmethod
+    def _roomRow(row: sqlite3.Row | None) -> RoomRecord | None:
+
+        if (row is None): return None
+
+        userId, roomName, roomDn, timestamp, logonAllowed = row
+        return RoomRecord(userId, roomName, roomDn, timestamp, bool(logonAllowed))
+
+
+    @staticmethod
+    def _filterRow(row: sqlite3.Row | None) -> FilterRecord | None:
+
+        if (row is None): return None
+
+        userId, role, filterName, roomName, deviceName, deviceIp, timestamp, autoLocked, renewalAmount, filterConf = row
+        return FilterRecord(userId, role, filterName, roomName, deviceName, deviceIp, timestamp, bool(autoLocked), renewalAmount, filterConf)
+
+
+    def _getRoom(self, connection: sqlite3.Connection, userId: str, roomName: str) -> dict | None:
+
+        return self._roomRow(connection.execute(f"SELECT {ROOM_COLUMNS} FROM rooms WHERE userId = ? AND roomName = ?", (userId, roomName)).fetchone())
+
+
+    def _getFilter(self, connection: sqlite3.Connection, filterName: str) -> dict | None:
+
+        return self._filterRow(connection.execute(f"SELECT {FILTER_COLUMNS} FROM filters WHERE filterName = ?", (filterName,)).fetchone())
+
+
+    @Database.queue
+    def addUser(self, userId: str, dn: str, roles: list[str]) -> None:
+
+        exists = self._connection.execute("SELECT 1 FROM activeUsers WHERE userId = ?", (userId,)).fetchone()
+
+        self._connection.execute("INSERT OR REPLACE INTO activeUsers (userId, dn, roles) VALUES (?, ?, ?)", (userId, dn, dumps(roles)))
+        self._publish("user", "update" if (exists) else "insert", UserRecord(userId, dn, roles))
+
+
+    @Database.queue
+    def addFilter(self, userId: str, role: str, filterName: str, roomName: str, timestamp: str, deviceName: str, deviceIp: str, autoLocked: bool = False, renewalAmount: int = 0, filterConf: str = "") -> dict:
+
+        exists = self._connection.execute("SELECT 1 FROM filters WHERE filterName = ?", (filterName,)).fetchone()
+        pending = self._hasDeadline("filters", "filterName = ?", (filterName,))
+
+        self._connection.execute(
+
+            f"INSERT OR REPLACE INTO filters ({FILTER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (userId, role, filterName, roomName, deviceName, deviceIp, timestamp, int(autoLocked), renewalAmount, filterConf)
+
+        )
+
+        self._setDeadline("filter", pending, FILTER_DEADLINE, "filterName = ?", (filterName,))
+
+        newFilter = FilterRecord(userId, role, filterName, roomName, deviceName, deviceIp, timestamp, autoLocked, renewalAmount, filterConf)
+        self._publish("filter", "update" if (exists) else "insert", newFilter)
+
+        return newFilter
+
+
+    @Database.queue
+    def addUserToRoom(self, userId: str, roomName: str, roomDn: str, timestamp: str, logonAllowed: bool = False) -> dict:
+
+        exists = self._connection.execute("SELECT 1 FROM rooms WHERE userId = ? AND roomName = ?", (userId, roomName)).fetchone()
+        pending = self._hasDeadline("rooms", "userId = ? AND roomName = ?", (userId, roomName))
+
+        self._connection.execute(
+
+            f"INSERT OR REPLACE INTO rooms ({ROOM_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+            (userId, roomName, roomDn, timestamp, int(logonAllowed))
+
+        )
+
+        self._setDeadline("room", pending, ROOM_DEADLINE, "userId = ? AND roomName = ?", (userId, roomName))
+
+        newRoomEntry = RoomRecord(userId, roomName, roomDn, timestamp, logonAllowed)
+        self._publish("room", "update" if (exists) else "insert", newRoomEntry)
+
+        return newRoomEntry
+
+
+    @Database.snapshot
+    def getUserInfo(self, userId: str) -> dict | None:
+
+        connection = self._reader()
+
+        return self._userRow(connection.execute("SELECT userId, dn, roles FROM activeUsers WHERE userId = ?", (userId,)).fetchone())
+
+
+    @Database.snapshot
+    def getActiveUsers(self) -> list[dict]:
+
+        connection = self._reader()
+
+        return [self._userRow(row) for row in connection.execute("SELECT userId, dn, roles FROM activeUsers ORDER BY rowid")]
+
+
+    @Database.snapshot
+    def getFilterInfo(self, userId: str = "any", filterName: str = "any") -> list[dict]:
+
+        connection = self._reader()
+
+        if (filterName != "any"):
+
+            filterEntry = self._getFilter(connection, filterName)
+
+            if ((filterEntry is None) or ((userId != "any") and (userId != filterEntry["userId"]))): return []
+            return [filterEntry]
+
+        if (userId == "any"):
+            rows = connection.execute(f"SELECT {FILTER_COLUMNS} FROM filters ORDER BY rowid")
+
+        else:
+            rows = connection.execute(f"SELECT {FILTER_COLUMNS} FROM filters WHERE userId = ? ORDER BY rowid", (userId,))
+
+        return [self._filterRow(row) for row in rows]
+
+
+    @Database.snapshot
+    def searchFilter(self, userId: str, roomName: str = "any", deviceName: str = "any", deviceIp: str = "any") -> list[dict]:
+
+        connection = self._reader()
+
+        # "any" ohittaa ehdon, joten sama valmisteltu lause kattaa kaikki hakuyhdistelmät.
+        rows = connection.execute(
+
+            f"""SELECT {FILTER_COLUMNS} FROM filters WHERE userId = :userId
+                AND (:roomName = 'any' OR roomName = :roomName)
+                AND (:deviceName = 'any' OR deviceName = :deviceName)
+                AND (:deviceIp = 'any' OR deviceIp = :deviceIp)
+                ORDER BY rowid""",
+            {"userId": userId, "roomName": roomName, "deviceName": deviceName, "deviceIp": deviceIp}
+
+        )
+
+        return [self._filterRow(row) for row in rows]
+
+
+    @Database.snapshot
+    def getUserAttendance(self, userId: str, room: str = "any") -> list[dict]:
+
+        connection = self._reader()
+
+        if ((userId != "any") and (room != "any")):
+
+            roomEntry = self._getRoom(connection, userId, room)
+            return [roomEntry] if (roomEntry is not None) else []
+
+        if (userId != "any"):
+            rows = connection.execute(f"SELECT {ROOM_COLUMNS} FROM rooms WHERE userId = ? ORDER BY rowid", (userId,))
+
+        else:
+            rows = connection.execute(f"SELECT {ROOM_COLUMNS} FROM rooms WHERE (:roomName = 'any' OR roomName = :roomName) ORDER BY rowid", {"roomName": room})
+
+        return [self._roomRow(row) for row in rows]
+
+
+    @Database.queue
+    def removeFilter(self, filterName: str) -> None:
+
+        for row in self._connection.execute(f"DELETE FROM filters WHERE filterName = ? RETURNING {FILTER_COLUMNS}", (filterName,)).fetchall():
+            self._publish("filter", "delete", self._filterRow(row))
+
+
+    @Database.queue
+    def removeUser(self, userId: str) -> None:
+
+        for row in self._connection.execute("DELETE FROM activeUsers WHERE userId = ? RETURNING userId, dn, roles", (userId,)).fetchall():
+            self._publish("user", "delete", self._userRow(row))
+
+
+    @Database.queue
+    def removeUserFromRoom(self, userId: str, roomName: str) -> None:
+
+        for row in self._connection.execute(f"DELETE FROM rooms WHERE userId = ? AND roomName = ? RETURNING {ROOM_COLUMNS}", (userId, roomName)).fetchall():
+            self._publish("room", "delete", self._roomRow(row))
+
+
+    @Database.queue
+    def updateFilterAutolock(self, filterName: str, autoLocked: bool = True) -> None:
+
+        for row in self._connection.execute(f"UPDATE filters SET autoLocked = ? WHERE filterName = ? RETURNING {FILTER_COLUMNS}", (int(autoLocked), filterName)).fetchall():
+            self._publish("filter", "update", self._filterRow(row))
+
+
+    @Database.queue
+    def updateFilterTs(self, filterName: str, timestamp: str) -> dict:
+
+        pending = self._hasDeadline("filters", "filterName = ?", (filterName,))
+
+        self._connection.execute("UPDATE filters SET timestamp = ? WHERE filterName = ?", (timestamp, filterName))
+        self._setDeadline("filter", pending, FILTER_DEADLINE, "filterName = ?", (filterName,))
+
+        filterEntry = self._getFilter(self._connection, filterName)
+        if (filterEntry is not None): self._publish("filter", "update", filterEntry)
+
+        return filterEntry
+
+
+    @Database.queue
+    def updateFilterInfo(self, filterName: str, updatedInfo: dict) -> dict:
+
+        # Sarakkeiden nimet tarkastetaan ennen kuin ne liitetään SQL-lauseeseen.
+        unknownKeys = set(updatedInfo) - set(FILTER_COLUMNS.split(", "))
+        if (unknownKeys): raise KeyError(f"Tuntemattomat kentät: {', '.join(sorted(unknownKeys))}")
+
+        previousEntry = self._getFilter(self._connection, filterName)
+        if (previousEntry is None): return None
+
+        # Uudelleennimetty sääntö saa uuden eräpäivän (uusi avain), joten sen eräpäivää ei lasketa korvatuksi.
+        pending = (updatedInfo.get("filterName", filterName) == filterName) and self._hasDeadline("filters", "filterName = ?", (filterName,))
+
+        if (updatedInfo):
+
+            assignments = ", ".join(f"{k} = ?" for k in updatedInfo)
+            values = [int(v) if (k == "autoLocked") else v for k, v in updatedInfo.items()]
+
+            self._connection.execute(f"UPDATE filters SET {assignments} WHERE filterName = ?", (*values, filterName))
+
+        # Eräpäivä lasketaan uudelleen vain, jos siihen vaikuttava kenttä muuttui. Muutoin jo erääntynyt (käsittelyssä oleva)
+        # merkintä palaisi indeksiin.
+        if (any(k in updatedInfo for k in ("filterName", "role", "timestamp"))):
+            self._setDeadline("filter", pending, FILTER_DEADLINE, "filterName = ?", (updatedInfo.get("filterName", filterName),))
+
+        filterEntry = self._getFilter(self._connection, updatedInfo.get("filterName", filterName))
+
+        if (filterEntry["filterName"] != filterName):
+
+            self._publish("filter", "delete", previousEntry)
+            self._publish("filter", "insert", filterEntry)
+
+        else:
+            self._publish("filter", "update", filterEntry)
+
+        return filterEntry
+
+
+    @Database.queue
+    def updateRoomTs(self, userId: str, roomName: str, timestamp: str) -> dict:
+
+        pending = self._hasDeadline("rooms", "userId = ? AND roomName = ?", (userId, roomName))
+
+        self._connection.execute("UPDATE rooms SET timestamp = ? WHERE userId = ? AND roomName = ?", (timestamp, userId, roomName))
+        self._setDeadline("room", pending, ROOM_DEADLINE, "userId = ? AND roomName = ?", (userId, roomName))
+
+        roomEntry = self._getRoom(self._connection, userId, roomName)
+        if (roomEntry is not None): self._publish("room", "update", roomEntry)
+
+        return roomEntry
+
+
+    @Database.queue
+    def updateRoomLogon(self, userId: str, roomName: str, logonAllowed: bool = False) -> dict:
+
+        self._connection.execute("UPDATE rooms SET logonAllowed = ? WHERE userId = ? AND roomName = ?", (int(logonAllowed), userId, roomName))
+
+        roomEntry = self._getRoom(self._connection, userId, roomName)
+        if (roomEntry is not None): self._publish("room", "update", roomEntry)
+
+        return roomEntry
+
+
+    @Database.queue
+    def setTimeouts(self, roomTimeouts: dict[str, int], filterTimeouts: dict[str, int]) -> None:
+
+        # Aikakatkaisut tallennetaan kirjoitusyhteyden väliaikaisiin tauluihin, ja kaikkien merkintöjen eräpäivät lasketaan
+        # uudelleen kahdella UPDATE-lauseella. Levylle tallennetut eräpäivät ovat käytettävissä jo ennen tätä kutsua.
+        self._roomTimeouts = dict(roomTimeouts)
+        self._filterTimeouts = dict(filterTimeouts)
+
+        startTransaction = not self._connection.in_transaction
+        if (startTransaction): self._connection.execute("BEGIN IMMEDIATE")
+
+        try:
+
+            self._connection.execute("DELETE FROM temp.roomTimeouts")
+            self._connection.execute("DELETE FROM temp.filterTimeouts")
+            self._connection.executemany("INSERT INTO temp.roomTimeouts (roomName, timeout) VALUES (?, ?)", self._roomTimeouts.items())
+            self._connection.executemany("INSERT INTO temp.filterTimeouts (role, timeout) VALUES (?, ?)", self._filterTimeouts.items())
+
+            self._connection.execute(f"UPDATE rooms SET deadline = {ROOM_DEADLINE}")
+            self._connection.execute(f"UPDATE filters SET deadline = {FILTER_DEADLINE}")
+
+        except Exception:
+
+            if (startTransaction): self._connection.execute("ROLLBACK")
+            raise
+
+        if (startTransaction): self._connection.execute("COMMIT")
+
+
+    @Database.queue
+    def popExpiredRooms(self, now: float, limit: int | None = None) -> list[dict]:
+
+        # Erääntyneet merkinnät haetaan ja niiden eräpäivät poistetaan samalla lauseella.
+        rows = self._connection.execute(
+
+            f"""UPDATE rooms SET deadline = NULL WHERE rowid IN
+                (SELECT rowid FROM rooms WHERE deadline <= ? ORDER BY deadline LIMIT ?)
+                RETURNING {ROOM_COLUMNS}""",
+            (now, -1 if (limit is None) else limit)
+
+        ).fetchall()
+
+        return [self._roomRow(row) for row in rows]
+
+
+    @Database.queue
+    def popExpiredFilters(self, now: float, limit: int | None = None) -> list[dict]:
+
+        rows = self._connection.execute(
+
+            f"""UPDATE filters SET deadline = NULL WHERE rowid IN
+                (SELECT rowid FROM filters WHERE deadline <= ? ORDER BY deadline LIMIT ?)
+                RETURNING {FILTER_COLUMNS}""",
+            (now, -1 if (limit is None) else limit)
+
+        ).fetchall()
+
+        return [self._filterRow(row) for row in rows]
+
+
+    @Database.queue
+    def rescheduleRoom(self, userId: str, roomName: str, deadline: float | None) -> None:
+
+        pending = self._hasDeadline("rooms", "userId = ? AND roomName = ?", (userId, roomName))
+        self._setDeadline("room", pending, "?", "userId = ? AND roomName = ?", (deadline, userId, roomName))
+
+
+    @Database.queue
+    def rescheduleFilter(self, filterName: str, deadline: float | None) -> None:
+
+        pending = self._hasDeadline("filters", "filterName = ?", (filterName,))
+        self._setDeadline("filter", pending, "?", "filterName = ?", (deadline, filterName))
+
+
+    @Database.snapshot
+    def nextDeadline(self) -> float | None:
+
+        connection = self._reader()
+
+        roomDeadline = connection.execute("SELECT MIN(deadline) FROM rooms WHERE deadline IS NOT NULL").fetchone()[0]
+        filterDeadline = connection.execute("SELECT MIN(deadline) FROM filters WHERE deadline IS NOT NULL").fetchone()[0]
+        deadlines = [deadline for deadline in (roomDeadline, filterDeadline) if (deadline is not None)]
+
+        return min(deadlines) if (deadlines) else None
+
+
+    @Database.snapshot
+    def countDeadlines(self) -> dict:
+
+        connection = self._reader()
+
+        return {
+
+            "room": {"pending": connection.execute("SELECT COUNT(*) FROM rooms WHERE deadline IS NOT NULL").fetchone()[0], "coalesced": self._coalesced["room"]},
+            "filter": {"pending": connection.execute("SELECT COUNT(*) FROM filters WHERE deadline IS NOT NULL").fetchone()[0], "coalesced": self._coalesced["filter"]}
+
+        }
@@ -37,6 +37,27 @@ class KuistiNetworkNotFound(Exception):
 
 
 
+class KuistiLdapPoolTimeout(Exception):
+    
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+
+class KuistiRemoteDatabaseError(Exception):
+    
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+
+class KuistiKerberosError(Exception):
+    
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+
 # https://blog.miguelgrinberg.com/post/the-ultimate-guide-to-python-decorators-part-iii-decorators-with-arguments
 
 def handler(errors: tuple | Exception, logger: Logger, exceptFunc: Callable = (lambda: None), defaultErrorAction: Callable = (lambda: None), exceptFuncArgs: list = [], exceptFuncKwargs: dict = {}, defaulErrFuncArgs: list = [], defaultErrFuncKwargs: dict = {}, loopUntilSuccessDefinedErr=False, loopUntilSuccessDefaultErr=False, printErros=True, raiseDefinedErr=True, raiseDefaultErr=True, retryCount: int = 1):
@@ -0,0 +1,60 @@
+from abc import ABC, abstractmethod
+from queue import Empty
+
+
+
+# Aihe, jolla väylä ilmoittaa hylänneensä tapahtumia.
+RESYNC = "resync"
+
+
+class EventBus(ABC):
+
+    """
+    Väylä, jota pitkin tietokannan muutossyöte (ks. Database.subscribe) välittää muutostapahtumia tilaajalle, esim.
+    Inspector-säikeelle. Jokainen tapahtuma kulkee aiheen (topic) kanssa, esim. ("room", {...}).
+
+    Rajatun kokoisen väylän täyttyessä jonossa olevat tapahtumat hylätään ja niiden tilalle jää yksi RESYNC-tapahtuma
+    ({"dropped": n}). Vastaanottajan on tällöin luettava tarvitsemansa tila uudelleen suoraan tietokannasta.
+    """
+
+    @abstractmethod
+    def put(self, topic: str, event: dict) -> None:
+        pass
+
+
+    def putBatch(self, events: list[tuple[str, dict]]) -> None:
+
+        # Lisää useamman tapahtuman kerralla. Toteutus voi ylikirjoittaa metodin, jos erän voi lisätä yhdellä operaatiolla.
+        for topic, event in events:
+            self.put(topic, event)
+
+
+    @abstractmethod
+    def get(self, timeout: float | None = None) -> tuple[str, dict]:
+
+        """
+        Palauttaa seuraavan tapahtuman (topic, event). Jos timeout on None, odotetaan kunnes tapahtuma saapuu.
+        Jos timeout on 0, ei odoteta lainkaan. Nostaa queue.Empty-poikkeuksen, jos tapahtumaa ei saatu.
+        """
+
+        pass
+
+
+    def getBatch(self, timeout: float | None = None, maxItems: int | None = None) -> list[tuple[str, dict]]:
+
+        # Odota ensimmäistä tapahtumaa ja poimi sen jälkeen kaikki jo jonossa olevat tapahtumat odottamatta.
+        try:
+            batch = [self.get(timeout)]
+
+        except Empty:
+            return []
+
+        while ((maxItems is None) or (len(batch) < maxItems)):
+
+            try:
+                batch.append(self.get(0))
+
+            except Empty:
+                break
+
+        return batch
@@ -0,0 +1,74 @@
+from .base import EventBus, RESYNC
+from collections import deque
+from queue import Empty
+from threading import Condition
+
+
+
+class LocalEventBus(EventBus):
+
+    # Prosessinsisäinen väylä. Tapahtumat välitetään säikeiden välillä ilman serialisointia.
+    # Parametri maxSize rajaa jonon pituuden (None = rajaton).
+
+    def __init__(self, maxSize: int | None = None):
+
+        self.maxSize = maxSize
+        self._events = deque()
+        self._condition = Condition()
+
+
+    def _append(self, events: list[tuple[str, dict]]) -> None:
+
+        if ((self.maxSize is not None) and (len(self._events) + len(events) > self.maxSize)):
+
+            # Jono on täynnä: korvaa kaikki odottavat ja uudet tapahtumat yhdellä RESYNC-tapahtumalla.
+            dropped = sum(event["dropped"] if (topic == RESYNC) else 1 for topic, event in self._events) + len(events)
+
+            self._events.clear()
+            self._events.append((RESYNC, {"dropped": dropped}))
+
+        else:
+            self._events.extend(events)
+
+
+    def put(self, topic: str, event: dict) -> None:
+
+        # Tapahtumasta tallennetaan kopio, jotta tietokannan myöhemmät muutokset samaan merkintään eivät näy
+        # jo jonossa olevissa tapahtumissa (vrt. Manager-jono, joka serialisoi tapahtuman).
+        with self._condition:
+
+            self._append([(topic, dict(event))])
+            self._condition.notify()
+
+
+    def putBatch(self, events: list[tuple[str, dict]]) -> None:
+
+        # Erän tapahtumia ei kopioida: tietokannan muutossyöte luo jokaiselle muutokselle oman tapahtuman.
+        with self._condition:
+
+            self._append(events)
+            self._condition.notify()
+
+
+    def get(self, timeout: float | None = None) -> tuple[str, dict]:
+
+        with self._condition:
+
+            if ((not self._events) and (timeout != 0)):
+                self._condition.wait_for(lambda: self._events, timeout)
+
+            if (not self._events): raise Empty
+
+            return self._events.popleft()
+
+
+    def getBatch(self, timeout: float | None = None, maxItems: int | None = None) -> list[tuple[str, dict]]:
+
+        with self._condition:
+
+            if ((not self._events) and (timeout != 0)):
+                self._condition.wait_for(lambda: self._events, timeout)
+
+            count = len(self._events) if (maxItems is None) else min(maxItems, len(self._events))
+
+            return [self._events.popleft() for _ in range(count)]
@@ -0,0 +1,42 @@
+from .base import EventBus, RESYNC
+from multiprocessing import Manager
+from queue import Full
+
+
+
+class ManagerEventBus(EventBus):
+
+    # Prosessien välinen väylä multiprocessing.Managerin jonon avulla. Jokainen put/get on IPC-kutsu
+    # erilliseen Manager-prosessiin, joten väylää kannattaa käyttää vain, jos tapahtumia pitää välittää prosessista toiseen.
+
+    # Parametri maxSize rajaa jonon pituuden (None = rajaton). Täydestä jonosta ei voi poistaa toisen prosessin puolesta,
+    # joten uudet tapahtumat hylätään ja RESYNC-tapahtuma lähetetään heti, kun jonoon mahtuu.
+
+    def __init__(self, maxSize: int | None = None):
+
+        self._manager = Manager()
+        self._queue = self._manager.Queue(maxSize or 0)
+        self._dropped = 0
+
+
+    def put(self, topic: str, event: dict) -> None:
+
+        try:
+
+            if (self._dropped):
+
+                self._queue.put_nowait((RESYNC, {"dropped": self._dropped}))
+                self._dropped = 0
+
+            self._queue.put_nowait((topic, event))
+
+        except Full:
+            self._dropped += 1
+
+
+    def get(self, timeout: float | None = None) -> tuple[str, dict]:
+
+        if (timeout == 0):
+            return self._queue.get_nowait()
+
+        return self._queue.get(timeout=timeout)
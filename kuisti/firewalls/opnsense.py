@@ -1,5 +1,6 @@
 from __future__ import annotations
 from .. import error
+from ..records import loadFilterConf
 from .base import Firewall
 from json import loads
 from re import match as reMatch
@@ -149,7 +150,7 @@ class Opnsense(Firewall):
                     filterName = row["description"]
                     filterInfo = self.getInfoFromName(filterName)
                     ret.append(filterName)
-                    filterConf = loads(self.kuistiInstance.db.getFilterInfo(filterName=filterName)[0]["filterConf"])
+                    filterConf = loadFilterConf(self.kuistiInstance.db.getFilterInfo(filterName=filterName)[0]["filterConf"])
                     self.kuistiInstance.firewall.toggleFilter(filterUuid, enabled=False)
                     self.kuistiInstance.firewall.applyChanges()
                     #self.logger.info(f'Deaktivoitu sääntö {filterDesc}.')
@@ -0,0 +1,263 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+from json import dumps, loads
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING
+import logging, os
+
+
+
+if (TYPE_CHECKING):
+    from .databases.base import Database
+
+# always = fsync jokaisen tietokantatehtävän muutosten jälkeen, batch = fsync aina fsyncBatch muutoksen välein,
+# periodic = fsync taustasäikeessä fsyncInterval sekunnin välein. Kaikissa tiloissa muutokset kirjoitetaan
+# käyttöjärjestelmälle ennen kuin tietokantakutsu palaa, joten pelkkä ohjelman kaatuminen ei hävitä niitä.
+FSYNC_POLICIES = ("always", "batch", "periodic")
+
+
+
+class Journal():
+
+    """
+    Muistinvaraisen tietokannan muutosjournaali. Journaali tilaa tietokannan muutossyötteen (ks. Database.subscribe)
+    ja kirjoittaa jokaisen tietokantatehtävän muutokset yhtenä JSON-rivinä tiedostoon <path>.journal. Kun muutoksia on
+    kertynyt snapshotEvery kappaletta, journaali tiivistetään: nykyinen tiedosto siirretään sivuun (<path>.journal.old),
+    koko tila kirjoitetaan taustasäikeessä tilannevedokseksi (<path>.snapshot) ja sivuun siirretty tiedosto poistetaan.
+
+    Käynnistyksessä attach-metodi lataa tilannevedoksen ja toistaa journaalit tietokantaan. Muutokset sisältävät koko
+    merkinnän, joten toisto on idempotentti ja päätyy samaan tilaan, vaikka tilannevedos olisi otettu kesken kirjoitusten.
+    """
+
+    def __init__(self, path: str, fsync: str = "batch", fsyncBatch: int = 100, fsyncInterval: float = 1.0, snapshotEvery: int = 10000) -> None:
+
+        if (fsync not in FSYNC_POLICIES): raise ValueError(f'Tuntematon fsync-käytäntö "{fsync}" (sallitut: {", ".join(FSYNC_POLICIES)}).')
+
+        self.path = Path(path)
+        self.journalPath = self.path.with_name(f"{self.path.name}.journal")
+        self.oldJournalPath = self.path.with_name(f"{self.path.name}.journal.old")
+        self.snapshotPath = self.path.with_name(f"{self.path.name}.snapshot")
+
+        self.fsync = fsync
+        self.fsyncBatch = fsyncBatch
+        self.fsyncInterval = fsyncInterval
+        self.snapshotEvery = snapshotEvery
+
+        self.logger = logging.getLogger("kuisti")
+        self.lastWrite = None
+
+        self._db = None
+        self._file = None
+        self._lock = Lock()
+        self._closed = Event()
+        self._unsynced = 0
+        self._sinceSnapshot = 0
+        self._compaction = None
+
+
+    @staticmethod
+    def _now() -> float:
+
+        return datetime.now(timezone.utc).timestamp() * 1000
+
+
+    def attach(self, db: Database, maxAge: float | None = None) -> bool:
+
+        # Palauttaa tilan journaalista ja alkaa kirjoittaa tietokannan muutoksia. Palauttaa True, jos tila palautettiin
+        # ja viimeisin muutos on enintään maxAge sekuntia vanha (None = ei ikärajaa).
+        self._db = db
+        restored = self._replay(db)
+
+        # Toistetut journaalit tiivistetään heti tilannevedokseksi, jolloin seuraava käynnistys on nopeampi.
+        if (restored and (self.journalPath.exists() or self.oldJournalPath.exists())):
+            self._writeSnapshot()
+
+        self._file = open(self.journalPath, "a", encoding="utf-8")
+        db.subscribe(self)
+
+        if (self.fsync == "periodic"): Thread(target=self._syncWorker, name="journal", daemon=True).start()
+
+        if (not restored): return False
+        return (maxAge is None) or ((self._now() - self.lastWrite) <= maxAge * 1000)
+
+
+    def _readChanges(self) -> list[tuple[str, str, dict]]:
+
+        changes = []
+
+        if (self.snapshotPath.exists()):
+
+            snapshot = loads(self.snapshotPath.read_text(encoding="utf-8"))
+            self.lastWrite = snapshot["time"]
+
+            for topic in ("user", "room", "filter"):
+                changes.extend((topic, "insert", entry) for entry in snapshot[topic])
+
+        for journalPath in (self.oldJournalPath, self.journalPath):
+
+            if (not journalPath.exists()): continue
+
+            with open(journalPath, "r", encoding="utf-8") as file:
+                for line in file:
+
+                    # Kaatumisen takia kesken jäänyt viimeinen rivi ohitetaan.
+                    try:
+                        record = loads(line)
+
+                    except ValueError:
+
+                        self.logger.warning(f'Journaalin "{journalPath}" viimeinen rivi on vaillinainen, ja se ohitetaan.')
+                        break
+
+                    self.lastWrite = record["time"]
+                    changes.extend((topic, change["op"], change["entry"]) for topic, change in record["changes"])
+
+        return changes
+
+
+    def _replay(self, db: Database) -> bool:
+
+        changes = self._readChanges()
+        if (not changes): return False
+
+        # Jokainen muutos korvaa merkinnän kokonaan (poisto + lisäys), jolloin toisto toimii kaikilla tietokantatoteutuksilla.
+        # Muutokset toistetaan käyttäjäkohtaisina transaktioina (kaikki merkinnät kuuluvat käyttäjälle), jotta jaettu ja
+        # etätietokanta voivat ohjata ne oikeaan paikkaan. Saman käyttäjän muutosten järjestys säilyy.
+        changesByUser = {}
+
+        for change in changes:
+            changesByUser.setdefault(change[2]["userId"], []).append(change)
+
+        def _(db, userChanges: list[tuple[str, str, dict]]) -> None:
+
+            for topic, op, entry in userChanges:
+
+                if (topic == "user"):
+
+                    db.removeUser(entry["userId"])
+                    if (op != "delete"): db.addUser(entry["userId"], entry["dn"], entry["roles"])
+
+                elif (topic == "room"):
+
+                    db.removeUserFromRoom(entry["userId"], entry["roomName"])
+                    if (op != "delete"): db.addUserToRoom(entry["userId"], entry["roomName"], entry["roomDn"], entry["timestamp"], entry["logonAllowed"])
+
+                elif (topic == "filter"):
+
+                    db.removeFilter(entry["filterName"])
+                    if (op != "delete"): db.addFilter(**entry)
+
+        for userId, userChanges in changesByUser.items():
+            db.transaction(_, userChanges, userId=userId)
+
+        self.logger.info(f'Palautettu {len(changes)} muutosta journaalista "{self.path}".')
+
+        return True
+
+
+    def put(self, topic: str, change: dict) -> None:
+
+        self.putBatch([(topic, change)])
+
+
+    def putBatch(self, changes: list[tuple[str, dict]]) -> None:
+
+        # Kutsutaan tietokannan työsäikeessä (jaetulla tietokannalla usean työsäikeen toimesta) ennen kuin tietokantakutsu palaa.
+        line = dumps({"time": self._now(), "changes": changes}, separators=(",", ":")) + "\n"
+
+        with self._lock:
+
+            self._file.write(line)
+            self._file.flush()
+
+            self._unsynced += len(changes)
+            self._sinceSnapshot += len(changes)
+            self.lastWrite = self._now()
+
+            if ((self.fsync == "always") or ((self.fsync == "batch") and (self._unsynced >= self.fsyncBatch))):
+                self._sync()
+
+            if (self.snapshotEvery and (self._sinceSnapshot >= self.snapshotEvery) and (self._compaction is None)):
+                self._rotate()
+
+
+    def _sync(self) -> None:
+
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+
+    def _syncWorker(self) -> None:
+
+        while (not self._closed.wait(self.fsyncInterval)):
+            with self._lock:
+
+                if (self._unsynced and not self._file.closed): self._sync()
+
+
+    def _rotate(self) -> None:
+
+        # Siirrä nykyinen journaali sivuun ja aloita uusi. Tilannevedos kirjoitetaan taustalla, jotta tietokannan
+        # työsäie ei odota koko tilan serialisointia.
+        self._sync()
+        self._file.close()
+
+        os.replace(self.journalPath, self.oldJournalPath)
+
+        self._file = open(self.journalPath, "a", encoding="utf-8")
+        self._sinceSnapshot = 0
+
+        self._compaction = Thread(target=self._compact, name="journal-snapshot", daemon=True)
+        self._compaction.start()
+
+
+    def _compact(self) -> None:
+
+        try:
+            self._writeSnapshot()
+
+        except Exception:
+            self.logger.exception(f'Journaalin "{self.path}" tiivistäminen epäonnistui.')
+
+        finally:
+            self._compaction = None
+
+
+    def _writeSnapshot(self) -> None:
+
+        snapshot = {
+
+            "time": self._now(),
+            "user": [dict(e) for e in self._db.getActiveUsers()],
+            "room": [dict(e) for e in self._db.getUserAttendance("any")],
+            "filter": [dict(e) for e in self._db.getFilterInfo()]
+
+        }
+
+        tmpPath = self.path.with_name(f"{self.path.name}.snapshot.tmp")
+
+        with open(tmpPath, "w", encoding="utf-8") as file:
+
+            file.write(dumps(snapshot, separators=(",", ":")))
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmpPath, self.snapshotPath)
+
+        # Sivuun siirretty journaali on nyt tilannevedoksessa. Jos ohjelma on käynnistymässä (ei vielä kirjoittajia),
+        # myös nykyinen journaali on tilannevedoksessa.
+        self.oldJournalPath.unlink(missing_ok=True)
+        if (self._file is None): self.journalPath.unlink(missing_ok=True)
+
+
+    def close(self) -> None:
+
+        self._closed.set()
+
+        with self._lock:
+
+            if (self._file and not self._file.closed):
+
+                self._sync()
+                self._file.close()
@@ -1,17 +1,24 @@
 from __future__ import annotations
-from .ldap import LdapConnection
+from .cache import GroupCache, IdentityCache, RoleIndex
+from .credentials import CredentialManager
+from .ldap import GroupModifyQueue, LdapConnection, LdapConnectionPool
 from .listeners.eventlistener import EventListener
 from .listeners.extsystemlistener import ExtSystemListener
 from .databases.base import Database
-from .databases.dict import Dict
+from .databases.indexed import Indexed
+from .eventbuses.base import EventBus, RESYNC
+from .eventbuses.local import LocalEventBus
 from .loghandlers.base import LogHandler
 from .user import User
 from .firewalls.base import Firewall
+from .journal import Journal
+from .records import loadFilterConf
+from .workerpool import KeyedWorkerPool
 from . import error, krb, log
 from socket import gethostbyname, gethostbyaddr, herror
-from multiprocessing import Manager
-from threading import Thread
-from typing import Generator
+from threading import Lock, Thread
+from time import monotonic
+from typing import Callable, Generator
 from ldap3 import RESTARTABLE, KERBEROS, SASL
 from datetime import datetime, timezone
 from re import sub as reSub
@@ -30,11 +37,14 @@ logging.config.dictConfig(log.LOGGING_BASE_CONF)
 KRB5_CONFIG_PATH = str(Path(Path.cwd() / Path("kuisti_krb5.conf")))
 KRB5_KEYTAB_PATH = str(Path(Path.cwd() / Path("kuisti_krb5.keytab")))
 
+# Tuntemattoman huoneen takia huoneryhmät haetaan hakemistosta uudelleen enintään näin usein (s).
+ROOM_DN_MISS_INTERVAL = 10
+
 
 
 class Kuisti():
 
-    def __init__(self, logConfPath: str, environmentConfPath: str, db: type[Database] = Dict(database={})):
+    def __init__(self, logConfPath: str, environmentConfPath: str, db: type[Database] = Indexed(database={}), eventBus: type[EventBus] = LocalEventBus(maxSize=10000)):
 
         # Lataa konfiguraatiot muistiin.
         self.logConf, self.environmentConf = self.loadConfig([logConfPath, environmentConfPath])
@@ -54,6 +64,44 @@ class Kuisti():
         # Alusta DB.
         self.db = db
 
+        # Valinnainen muutosjournaali: tila palautetaan journaalista ennen kuin väylä tilaa muutokset, jotta palautettuja
+        # merkintöjä ei välitetä Inspectorille uusina muutoksina.
+        self.journal = None
+        self.journalFresh = False
+        journalConf = self.environmentConf.get("journal")
+
+        if (journalConf):
+
+            self.journal = Journal(
+
+                journalConf["path"],
+                fsync=journalConf.get("fsync", "batch"),
+                fsyncBatch=journalConf.get("fsyncBatch", 100),
+                fsyncInterval=journalConf.get("fsyncInterval", 1.0),
+                snapshotEvery=journalConf.get("snapshotEvery", 10000)
+
+            )
+
+            self.journalFresh = self.journal.attach(self.db, maxAge=journalConf.get("maxAge", 300))
+
+        # Väylä, jota pitkin tietokannan huone- ja suodatussääntömuutokset välitetään Inspector-säikeelle.
+        self.eventBus = eventBus
+        self.db.subscribe(self.eventBus, topics=("room", "filter"))
+
+        # Poissa olevien käyttäjien DN:t (ks. IdentityCache).
+        self.identityCache = IdentityCache(
+
+            maxSize=self.environmentConf["ldap"].get("identityCacheSize", 10000),
+            ttl=self.environmentConf["ldap"].get("identityCacheTtl", 900)
+
+        )
+
+        # Huoneen nimi -> huoneryhmän DN (ks. getRoomDn).
+        self.roomDnRefreshInterval = self.environmentConf["ldap"].get("roomDnRefreshInterval", 3600)
+        self._roomDns = {}
+        self._roomDnsLoadedAt = None
+        self._roomDnLock = Lock()
+
         self.serviceUser = self.environmentConf["ldap"]["serviceUser"]
         self.domain = self.environmentConf["ldap"]["domain"]
 
@@ -89,13 +137,39 @@ class Kuisti():
         if (not Path(KRB5_KEYTAB_PATH).exists()):
             self.generateKrbKeytab(KRB5_KEYTAB_PATH)
 
-        # Luo LDAP-yhteys hakemistopalvelimelle.
+        # Palvelukäyttäjän TGT haetaan keytab-tiedostolla ja uusitaan taustalla ennen vanhenemista.
+        self.credentialManager = CredentialManager(
+
+            f'{self.serviceUser}@{self.domain.upper()}',
+            KRB5_KEYTAB_PATH,
+            renewBefore=self.environmentConf["ldap"].get("ticketRenewBefore", 3600)
+
+        )
+
+        self.credentialManager.start()
+
+        # Luo LDAP-yhteydet hakemistopalvelimelle.
         self.ldapConnection = self._connectLdap()
 
-        # Luodaan tarkastusjonot Inspector-säiettä varten.
-        self._manager = Manager()
-        self.roomEventQueue = self._manager.Queue()
-        self.filterEventQueue = self._manager.Queue()
+        # Ryhmien jäsenyydet tarkastetaan välimuistista (ks. GroupCache).
+        self.groupCache = GroupCache(
+
+            self.ldapConnection,
+            self.environmentConf["ldap"]["ditSearchBase"],
+            revalidateInterval=self.environmentConf["ldap"].get("groupCacheInterval", 60)
+
+        )
+
+        # Huoneryhmien jäsenyydet muokataan taustalla kootusti (ks. GroupModifyQueue).
+        self.groupModifyQueue = GroupModifyQueue(
+
+            self.ldapConnection,
+            self.groupCache,
+            window=self.environmentConf["ldap"].get("modifyWindow", 0.25),
+            batchSize=self.environmentConf["ldap"].get("modifyBatchSize", 500),
+            maxCacheAge=self.environmentConf["ldap"].get("modifyMaxCacheAge", 5)
+
+        )
 
         # Luodaan tarvittavat komponentit.
         self.inspector = Inspector(self, self.firewall)
@@ -111,8 +185,30 @@ class Kuisti():
         # Tarkasta paikan päällä olevat käyttäjät ohjelman käynnistyessä.
         self.logger.info("Aloitetaan ohjelman alustus...")
         self.roleDnList = self._getRoleDn()
-        self._checkActiveUsers()
-        if (self.firewall): self.inspector.checkFilters()
+
+        # Käyttäjien roolit selvitetään roolien ryhmistä rakennetusta indeksistä (käyttäjän DN -> roolit).
+        self.roleIndex = RoleIndex(
+
+            self.groupCache,
+            dict((roleDn, reSub(fr'^CN={self.rolePrefix}(.+?),.+$', r'\1', roleDn).lower()) for roleDn in self.roleDnList)
+
+        )
+
+        self.roleIndex.start()
+
+        self._refreshRoomDns(None)
+
+        # Tuoreesta journaalista palautettu tila on jo ajan tasalla, joten hakemiston ja palomuurin täyttä läpikäyntiä ei tarvita.
+        if (self.journalFresh):
+            self.logger.info(f'Tila palautettu journaalista "{self.journal.path}", käyttäjien ja suodatussääntöjen tarkastus ohitetaan.')
+
+        else:
+            self._checkActiveUsers()
+            if (self.firewall): self.inspector.checkFilters()
+
+            # Käynnistyksessä sallitut kirjautumiset lähetetään hakemistoon ennen kuin alustus on valmis.
+            self.groupModifyQueue.flush()
+
         self.logger.info("Alustus valmis.")
 
         self._threadEventListener.start()
@@ -149,27 +245,60 @@ class Kuisti():
 
     def _getRoleDn(self) -> list[str]:
 
-        return self.ldapConnection.getObjectDn(
+        return list(self.ldapConnection.iterObjectDn(
 
             self.environmentConf["ldap"]["ditSearchBase"],
-            f"(&(objectClass=group)({self.roleDitAttr}={self.rolePrefix}*))",
-            returnAll=True
+            f"(&(objectClass=group)({self.roleDitAttr}={self.rolePrefix}*))"
 
-        )
+        ))
 
 
-    def _checkActiveUsers(self):
+    def _refreshRoomDns(self, loadedAt: float | None) -> None:
 
-        roomDnList = self.ldapConnection.getObjectDn(
+        with self._roomDnLock:
 
-                    self.environmentConf["ldap"]["ditSearchBase"],
-                    f"(&(objectClass=group)({self.roomDitAttr}={self.roomPrefix}*))",
-                    returnAll=True
+            # Toinen säie ehti jo ladata kartan.
+            if (self._roomDnsLoadedAt != loadedAt): return
 
-        )
+            roomDnList = self.ldapConnection.iterObjectDn(
+
+                        self.environmentConf["ldap"]["ditSearchBase"],
+                        f"(&(objectClass=group)({self.roomDitAttr}={self.roomPrefix}*))"
+
+            )
+
+            roomDns = dict((reSub(fr'^CN={self.roomPrefix}(.+?),.+$', r'\1', roomDn).lower(), roomDn) for roomDn in roomDnList)
+
+            # Tyhjä tulos on todennäköisemmin hakemiston tai haun häiriö kuin kaikkien huoneryhmien poisto, joten edellinen
+            # kartta säilytetään, ja haku yritetään uudelleen ROOM_DN_MISS_INTERVAL sekunnin kuluttua.
+            if ((not roomDns) and (self._roomDns)):
+
+                self.logger.warning(f'Huoneryhmiä ei löytynyt hakemistopalvelimelta. Käytetään edellistä huoneryhmien karttaa (huoneita: {len(self._roomDns)}).')
+                self._roomDnsLoadedAt = monotonic() - max(0, self.roomDnRefreshInterval - ROOM_DN_MISS_INTERVAL)
+                return
+
+            self._roomDns = roomDns
+            self._roomDnsLoadedAt = monotonic()
+
+
+    def getRoomDn(self, roomName: str) -> str | None:
+
+        # Huoneryhmät muuttuvat harvoin, joten huoneen DN haetaan muistissa olevasta kartasta. Kartta ladataan uudelleen
+        # roomDnRefreshInterval sekunnin välein sekä silloin, kun huonetta ei löydy kartasta.
+        roomName = roomName.lower()
+        loadedAt = self._roomDnsLoadedAt
+        age = monotonic() - loadedAt
+
+        if ((age >= self.roomDnRefreshInterval) or ((roomName not in self._roomDns) and (age >= ROOM_DN_MISS_INTERVAL))):
+            self._refreshRoomDns(loadedAt)
+
+        return self._roomDns.get(roomName)
+
+
+    def _checkActiveUsers(self):
 
         # Sulje ohjelma, jos yhtäkään huoneryhmää ei löydetä.
-        if (roomDnList is None):
+        if (not self._roomDns):
 
             errorMsg = "Huoneryhmiä ei löytynyt hakemistopalvelimelta. Tarkasta, että huoneryhmät ovat konfiguroitu oikein."
 
@@ -177,46 +306,42 @@ class Kuisti():
             raise error.KuistiNoRoomsFound(errorMsg)
             
 
-        for roomDn in roomDnList:
-
-            roomName = reSub(fr'^CN={self.roomPrefix}(.+?),.+$', r'\1', roomDn).lower()
+        # Kaikkien huoneiden jäsenet haetaan yhdellä sivutetulla haulla (memberOf), joka palauttaa suoraan käyttäjän
+        # tunnisteen ja ryhmät. Käyttäjien DN:t ja roolit viedään käyttäjävälimuistiin, joten User-olioiden luonti ei tee
+        # hakemistohakuja. Jäsenet käsitellään sivu kerrallaan sitä mukaa kuin niitä saadaan.
+        roomNames = dict((roomDn.lower(), roomName) for roomName, roomDn in self._roomDns.items())
 
-            members = self.ldapConnection.checkGroupMembership(
+        members = self.ldapConnection.searchMembersOf(
 
-                self.environmentConf["ldap"]["ditSearchBase"],
-                roomDn,
-                getAllMembers=True
+            self.environmentConf["ldap"]["ditSearchBase"],
+            list(self._roomDns.values()),
+            [self.userDitAttr, "memberOf"]
 
-            )
-            
-            if (not(members)): continue
-        
-            #members = [reSub(r'^CN=(.+?),.+$', r'\1', member) for member in members]
-            #members = [reSub(r'^((?:.+?)\s*(?:.+?)?)$', r'\1', member) for member in members]
+        )
 
-            for member in members:
+        for memberDn, attributes in members:
 
-                userId = self.ldapConnection.getObjectAttr(
+            if (not attributes.get(self.userDitAttr)): continue
+            userId = attributes[self.userDitAttr][0]
 
-                    self.environmentConf["ldap"]["ditSearchBase"],
-                    f"(&(objectClass=user)(distinguishedName={member}))",
-                    attributes=[f'{self.userDitAttr}']
+            self.identityCache.put(userId, memberDn)
 
-                )[self.userDitAttr][0]
+            for roomName in [roomNames[groupDn.lower()] for groupDn in attributes.get("memberOf", []) if (groupDn.lower() in roomNames)]:
 
                 newUser = User(self, userId)
-                newUser.activate()
-                newUser.addRoom(roomName)
                 routeToRoom = self.getRoute(roomName)
-                self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{roomName}".')
+
+                # Pysyvästä tietokannasta palautettua tilaa ei luoda uudelleen, vaan lisätään vain puuttuvat merkinnät.
+                state = newUser.enterRoom(roomName)
+                if (state["added"]): self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{roomName}".')
 
                 if (routeToRoom):
-                    if (self.implicitTrustAtBoot or newUser.pathTaken(roomName)):
+                    if (self.implicitTrustAtBoot or state["pathTaken"]):
 
                         for name in routeToRoom[:-1]:
 
-                            newUser.addRoom(name)
-                            self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{name}".')
+                            if (newUser.enterRoom(name)["added"]):
+                                self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{name}".')
 
                         newUser.allowLogon([roomName])
                         self.logger.info(f'Sallittu käyttäjän "{newUser.identifier}" kirjautuminen huoneen "{roomName}" työasemille.')
@@ -289,7 +414,22 @@ kdc_timesync = 1
             raise error.KuistiNetworkNotFound(f'Huoneen {forRoom} verkkoa ei ole määritetty.')
         
     
-    def _connectLdap(self) -> LdapConnection:
+    def _connectLdap(self) -> LdapConnectionPool:
+
+        # Säikeet (lokien käsittelijät, Inspector, kuuntelijat) lainaavat yhteyden poolista operaation ajaksi. Yhteyksiä
+        # on vähintään kaksi, koska sivutettua hakua käsittelevä säie tarvitsee toisen yhteyden muihin operaatioihin.
+        ldapConf = self.environmentConf["ldap"]
+
+        return LdapConnectionPool(
+
+                self._newLdapConnection,
+                maxSize=max(2, ldapConf.get("poolSize", 4)),
+                healthCheckInterval=ldapConf.get("healthCheckInterval", 60)
+
+        )
+
+
+    def _newLdapConnection(self) -> LdapConnection:
 
         ldapConnection = LdapConnection(
 
@@ -300,7 +440,8 @@ kdc_timesync = 1
                 sasl_mechanism=KERBEROS,
                 user=self.environmentConf["ldap"]["serviceUser"],
                 auto_bind=True,
-                receive_timeout=5
+                receive_timeout=5,
+                pageSize=self.environmentConf["ldap"].get("pageSize", 500)
 
         )
 
@@ -318,13 +459,39 @@ class Inspector():
         self.logger = logging.getLogger("inspector")
         self.firewall = firewall
 
+        # Huoneiden ja suodatussääntöjen eräpäivät ovat tietokannan eräpäiväindeksissä, joka lasketaan tässä kerralla uudelleen
+        # nykyisillä aikakatkaisuilla. Pysyvästä tietokannasta palautetut merkinnät erääntyvät siten ilman erillistä palautusta.
+        roomTimeouts = {roomName: int(timeout*60*1000) for roomName, timeout in self.kuistiInstance.roomTimeouts.items()}
+        filterTimeouts = {role: int(filterset["timeout"]*60*1000) for role, filterset in self.firewall.filtersets.items() if ("timeout" in filterset)} if (self.firewall) else {}
+
+        self.kuistiInstance.db.setTimeouts(roomTimeouts, filterTimeouts)
+        self.timerStats = {timerType: {"fired": 0} for timerType in ("room", "filter")}
+        self.changeStats = {topic: {"insert": 0, "update": 0, "delete": 0} for topic in ("room", "filter")}
+
+        # Erääntyneet tapahtumat käsitellään säiejoukossa. Saman käyttäjän tapahtumat käsitellään järjestyksessä yksi kerrallaan,
+        # eri käyttäjien tapahtumat rinnakkain, jolloin yksittäinen hidas palomuuri- tai LDAP-kutsu ei viivästytä muita käyttäjiä.
+        inspectorConf = self.kuistiInstance.environmentConf.get("inspector", {})
+        self.handlerPool = KeyedWorkerPool(inspectorConf.get("handlerWorkers", 4), name="inspector")
+        self.expiryBatchSize = inspectorConf.get("expiryBatchSize", 500)
+        self.statsInterval = inspectorConf.get("statsInterval", 10) * 60 * 1000
+        self._nextStatsReport = datetime.now(timezone.utc).timestamp() * 1000 + self.statsInterval
+
 
     # Tarkasta ohjelman käynnistyessä, onko palomuurilla olemassa suodatussääntöjä käyttäjiä varten ja merkkaa ne tietokantaan.
     def checkFilters(self):
 
         hostnames = {}
+        kuistiFilters = loads(self.firewall.searchFilter("kuisti_").text)["rows"]
+        filterNames = set(kuistiFilter["description"] for kuistiFilter in kuistiFilters)
+
+        # Poista tietokannasta (esim. pysyvästä tietokannasta palautetut) säännöt, joita ei enää ole palomuurilla.
+        for filterInfo in self.kuistiInstance.db.getFilterInfo():
+            if (filterInfo["filterName"] not in filterNames):
+
+                self.kuistiInstance.db.removeFilter(filterInfo["filterName"])
+                self.logger.info(f'Poistettu tietokannasta sääntö "{filterInfo["filterName"]}", jota ei löydy palomuurilta.')
 
-        for kuistiFilter in loads(self.firewall.searchFilter("kuisti_").text)["rows"]:
+        for kuistiFilter in kuistiFilters:
 
             filterExists = False
             filterInfo = self.firewall.getInfoFromName(kuistiFilter["description"])
@@ -335,21 +502,16 @@ class Inspector():
             roomName = self.kuistiInstance.getRoomName(ipAddress).lower()
             routeToRoom = self.kuistiInstance.getRoute(roomName)
 
-            if (not newUser.isPresent()):
-                newUser.activate()
+            state = newUser.enterRoom(roomName)
+            if (state["added"]): self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{roomName}".')
 
-            if ((newUser.isPresent()) and (not newUser.isInRoom(roomName))):
-
-                newUser.addRoom(roomName)
-                self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{roomName}".')
-
-            if (routeToRoom and not newUser.isLogonAllowed(roomName)):
-                if (self.kuistiInstance.implicitTrustAtBoot or newUser.pathTaken(roomName)):
+            if (routeToRoom and not state["roomInfo"]["logonAllowed"]):
+                if (self.kuistiInstance.implicitTrustAtBoot or state["pathTaken"]):
 
                     for name in routeToRoom[:-1]:
 
-                        newUser.addRoom(name)
-                        self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{name}".')
+                        if (newUser.enterRoom(name)["added"]):
+                            self.logger.info(f'Lisätty käyttäjä "{newUser.identifier}" huoneeseen "{name}".')
 
                     newUser.allowLogon([roomName])
                     self.logger.info(f'Sallittu kirjautuminen käyttäjälle "{newUser.identifier}" huoneessa "{roomName}".')
@@ -357,7 +519,7 @@ class Inspector():
             if (newUser.getFilterInfo(kuistiFilter["description"])):
 
                 filterExists = True
-                break
+                continue
 
             if ((newUser.isPresent()) and (newUser.isInRoom(roomName)) and (not filterExists)):
                 
@@ -373,67 +535,112 @@ class Inspector():
                 newUser.updateFilterAutolock(dumps(filterInfo), ipAddress, autoLocked=True)
 
 
-    def worker(self) -> None:
+    def _nextTimeout(self) -> float | None:
 
-        pendingRoomEvent = None
-        pendingFilterEvent = None
-        roomEventQueue = []
-        filterEventQueue = []
+        # Palauttaa sekunteina ajan, jonka Inspector voi nukkua ennen seuraavan eräpäivän tai tilastojen raportointia.
+        nextDeadline = self.kuistiInstance.db.nextDeadline()
+        deadlines = [] if (nextDeadline is None) else [nextDeadline]
 
-        while (True):
+        if (self.statsInterval): deadlines.append(self._nextStatsReport)
+        if (not deadlines): return None
 
-            currentTime = datetime.now(timezone.utc).timestamp() * 1000
+        currentTime = datetime.now(timezone.utc).timestamp() * 1000
+        return max(0, (min(deadlines) - currentTime) / 1000)
 
-            # Huonetapahtumien käsittely.
-            try:
 
-                # Korvataan myöhemmin PriorityQueuella.
-                newEvent = self.kuistiInstance.roomEventQueue.get_nowait()
+    def _recordEvent(self, topic: str, change: dict) -> None:
 
-                if (self.kuistiInstance.roomTimeouts[newEvent["roomName"]] != 0):
+        # Muutossyötteen tapahtumat vain herättävät Inspectorin laskemaan seuraavan eräpäivän uudelleen. Tietokanta on jo
+        # päivittänyt merkinnän eräpäivän, joten tässä ainoastaan päivitetään laskurit ja varoitetaan puuttuvista aikakatkaisuista.
+        if (topic == RESYNC):
 
-                    newEvent["expiryTime"] = int(newEvent["timestamp"]) + int(self.kuistiInstance.roomTimeouts[newEvent["roomName"]]*60*1000)
-                    roomEventQueue.append(newEvent)
-                    roomEventQueue.sort(key=lambda event: event["expiryTime"])
+            # Eräpäivät ovat tietokannassa, joten hylätyt tapahtumat eivät vaadi tilan uudelleenlukua.
+            self.logger.warning(f'Tapahtumaväylä on hylännyt {change["dropped"]} muutostapahtumaa jonon täyttymisen takia.')
+            return
 
-            except:
-                pass
+        if (topic not in self.changeStats): return
+        self.changeStats[topic][change["op"]] += 1
 
-            #if (int(self.kuistiInstance.timeoutRoom) != 0):
+        if (change["op"] != "insert"): return
+        newEntry = change["entry"]
 
-            pendingRoomEvent = roomEventQueue[0] if (len(roomEventQueue) > 0) else None
+        if ((topic == "room") and (newEntry["roomName"] not in self.kuistiInstance.roomTimeouts)):
+            self.logger.warning(f'Huoneelle "{newEntry["roomName"]}" ei ole määritetty aikakatkaisua.')
 
-            if (pendingRoomEvent):
-                if (currentTime > pendingRoomEvent["expiryTime"]):
+        elif ((topic == "filter") and self.firewall and ("timeout" not in self.firewall.filtersets.get(newEntry["role"], {}))):
+            self.logger.warning(f'Roolille "{newEntry["role"]}" ei ole määritetty aikakatkaisua.')
 
-                    self._handleRoomEvent(pendingRoomEvent)
-                    pendingRoomEvent = None
-                    roomEventQueue.pop(0)
+
+    def getTimerStats(self) -> dict:
+
+        # Palauttaa ajastinlaskurit: muutossyötteen lisäykset, päivitykset ja poistot, erääntyneet (fired) sekä eräpäiväindeksissä
+        # odottavien (pending) ja korvattujen (coalesced) eräpäivien määrän.
+        stats = {timerType: {**self.changeStats[timerType], **counters} for timerType, counters in self.timerStats.items()}
+
+        for timerType, deadlineCounts in self.kuistiInstance.db.countDeadlines().items():
+            stats[timerType].update(deadlineCounts)
+
+        return stats
+
+
+    def worker(self) -> None:
+
+        while (True):
+
+            # Nuku, kunnes tietokannan muutossyöte herättää tai seuraava eräpäivä koittaa.
+            newEvents = self.kuistiInstance.eventBus.getBatch(self._nextTimeout())
+
+            for topic, change in newEvents:
+                self._recordEvent(topic, change)
+
+            currentTime = datetime.now(timezone.utc).timestamp() * 1000
+
+            # Huonetapahtumien käsittely. Erääntyneet merkinnät haetaan erissä; jos erä täyttyy, seuraava erä haetaan heti.
+            for pendingRoomEvent in self.kuistiInstance.db.popExpiredRooms(currentTime, self.expiryBatchSize):
+
+                self.timerStats["room"]["fired"] += 1
+                self.handlerPool.submit(pendingRoomEvent["userId"], self._runHandler, self._handleRoomEvent, pendingRoomEvent)
 
             # Suodatussääntöihin liittyvien tapahtumien käsittely.
-            if (not self.firewall): continue
+            if (self.firewall):
+                for pendingFilterEvent in self.kuistiInstance.db.popExpiredFilters(currentTime, self.expiryBatchSize):
+
+                    self.timerStats["filter"]["fired"] += 1
+                    self.handlerPool.submit(pendingFilterEvent["userId"], self._runHandler, self._handleFilterEvent, pendingFilterEvent)
 
-            try:
+            if (self.statsInterval and (currentTime >= self._nextStatsReport)):
 
-                newEvent = self.kuistiInstance.filterEventQueue.get_nowait()
+                self._reportStats()
+                self._nextStatsReport = currentTime + self.statsInterval
 
-                if (self.firewall.filtersets[newEvent["role"]]["timeout"] != 0):
-                    newEvent["expiryTime"] = int(newEvent["timestamp"]) + int(self.firewall.filtersets[newEvent["role"]]["timeout"]*60*1000)
-                    filterEventQueue.append(newEvent)
-                    filterEventQueue.sort(key=lambda event: event["expiryTime"])
 
-            except:
-                pass
+    def _runHandler(self, handler: Callable, event: dict) -> None:
 
-            pendingFilterEvent = filterEventQueue[0] if (len(filterEventQueue) > 0) else None
+        try:
+            handler(event)
 
-            if (pendingFilterEvent):
-                if (currentTime > pendingFilterEvent["expiryTime"]):
+        except Exception:
+            self.logger.exception(f'Tapahtuman käsittely epäonnistui: {event}')
+
+
+    def _reportStats(self) -> None:
+
+        self.logger.info(f'Ajastimet: {self.getTimerStats()}')
+        self.logger.info(f'Käyttäjävälimuisti: {self.kuistiInstance.identityCache.getStats()}')
+        self.logger.info(f'Ryhmäjäsenyyksien muutosjono: {self.kuistiInstance.groupModifyQueue.getStats()}')
+        self.logger.info(f'Roolien indeksi: {self.kuistiInstance.roleIndex.getStats()}')
+        self.logger.info(f'Kerberos-tunnisteet: {self.kuistiInstance.credentialManager.getStats()}')
+
+        latencies = self.handlerPool.getLatencyPercentiles()
+        if (not latencies): return
+
+        self.logger.info(
+            
+            f'Tapahtumakäsittelijöiden kesto ({latencies["count"]} kpl): p50 {latencies["p50"]:.1f} ms, '
+            f'p90 {latencies["p90"]:.1f} ms, p99 {latencies["p99"]:.1f} ms, max {latencies["max"]:.1f} ms.'
+            
+        )
 
-                    self._handleFilterEvent(pendingFilterEvent)
-                    pendingFilterEvent = None
-                    filterEventQueue.pop(0)
-                
 
     def _handleFilterEvent(self, event: dict) -> None:
 
@@ -462,7 +669,7 @@ class Inspector():
             for serviceAddr, servicePort in self.firewall.filtersets[event["role"]]["monitoredServices"].items():
 
                 sessionInProgress = False
-                states = self.firewall.getStates(deviceIp, loads(filterInfo["filterConf"]), returnValues=['dst_port', 'dst_addr'])
+                states = self.firewall.getStates(deviceIp, loadFilterConf(filterInfo["filterConf"]), returnValues=['dst_port', 'dst_addr'])
                 serviceAddr = gethostbyname(serviceAddr) if (not reMatch(r'^((25[0-5]|(2[0-4]|1\d|[1-9]|)\d)\.?\b){4}$', serviceAddr)) else serviceAddr
 
                 for state in states:
@@ -555,10 +762,8 @@ class Inspector():
             self.logger.info(f'Poistetaan käyttäjä "{userObj.identifier}" huoneesta "{roomName}" aikakatkaisun takia.')
             userObj.removeRoom(roomName)
 
-        if (userObj.isPresent() and not userObj.isInRoom("any")):
-
+        if (userObj.deactivateIfAbsent()):
             if (self.firewall): userObj.removeFilter()
-            userObj.deactivate()
 
 
     def updateTimeout(self, userObj: User, ipAddress: str, *, timeoutType: str = "room", roomName: str = "any", paused: bool = False) -> None:
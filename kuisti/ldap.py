@@ -1,21 +1,39 @@
 from __future__ import annotations
 from . import error
+from .credentials import RENEW_MIN_INTERVAL
 from .log import LOGGING_BASE_CONF
-from ldap3 import Connection, Server
-from ldap3.core.exceptions import LDAPSocketOpenError
+from ldap3 import BASE, MODIFY_ADD, MODIFY_DELETE, Connection, Server
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPSocketOpenError
+from ldap3.core.results import RESULT_ATTRIBUTE_OR_VALUE_EXISTS, RESULT_ENTRY_ALREADY_EXISTS, RESULT_NO_SUCH_ATTRIBUTE, RESULT_UNWILLING_TO_PERFORM
+from ldap3.utils.conv import escape_filter_chars
 from gssapi.raw.exceptions import ExpiredCredentialsError
 from gssapi.raw.misc import GSSError
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
 from re import sub as reSub
-from os import system
 from socket import gethostbyname_ex, gethostbyaddr, create_connection
 from json import load
-from typing import TYPE_CHECKING, Callable
+from threading import Condition, Thread
+from time import monotonic
+from typing import TYPE_CHECKING, Callable, Generator
 import logging.config
 
 
 
+# Simple paged results -kontrollin OID (RFC 2696).
+PAGED_RESULTS_CONTROL = "1.2.840.113556.1.4.319"
+
+# Modify-operaation tulokset, joilla jäsen on jo ryhmässä (lisäys) tai ei ole siinä (poisto). Active Directory palauttaa
+# näissä tilanteissa entryAlreadyExists (68) ja unwillingToPerform (53), muut palvelimet RFC 4511:n mukaiset 20 ja 16.
+ALREADY_MEMBER_RESULTS = (RESULT_ATTRIBUTE_OR_VALUE_EXISTS, RESULT_ENTRY_ALREADY_EXISTS)
+NOT_MEMBER_RESULTS = (RESULT_NO_SUCH_ATTRIBUTE, RESULT_UNWILLING_TO_PERFORM)
+
+
+
 # Estää rekursiivisen import-komennon suorituksen. Lisätietoja: https://adamj.eu/tech/2021/05/13/python-type-hiix-circular-imports/
 if (TYPE_CHECKING):
+    from .cache import GroupCache
     from .kuisti import Kuisti
 
 
@@ -42,14 +60,16 @@ logging.config.dictConfig(LOGGING_BASE_CONF)
 
 class LdapConnection(Connection):
 
-    def __init__(self, kuistiInstance: Kuisti, domain: str, secureConn: bool = True, *args, **kwargs):
+    def __init__(self, kuistiInstance: Kuisti, domain: str, secureConn: bool = True, *args, pageSize: int = 500, **kwargs):
 
         self.logger = kuistiInstance.logger
+        self.credentialManager = getattr(kuistiInstance, "credentialManager", None)
         self.server = None
         self.secureConn = secureConn
         self.domain = domain
+        self.pageSize = pageSize
         self._initArgs = [kuistiInstance, domain, secureConn, *args]
-        self._initKwargs = {**kwargs}
+        self._initKwargs = {"pageSize": pageSize, **kwargs}
         self._useActiveDcFqdn(domain)
 
         @error.handler((ExpiredCredentialsError, GSSError), self.logger, self._getTgt, loopUntilSuccessDefinedErr=True, raiseDefinedErr=False)
@@ -88,12 +108,23 @@ class LdapConnection(Connection):
                 continue
 
 
-    # TGT:n uusimiseen liittyvä prosessi eroteltu tulevaa varten, jos esim. TGT hankitaan vaihtoehtoisia reittejä pitkin.
+    # Lippu uusitaan normaalisti taustalla ennen vanhenemista (ks. CredentialManager). Tämä on varakeino, jos
+    # tunnistautuminen silti epäonnistuu (esim. KDC oli tavoittamattomissa koko uusintajakson ajan).
     def _getTgt(self):
 
+        if (self.credentialManager is None):
+
+            self.logger.error("TGT ei saatavilla, eikä tunnisteiden hallintaa ole määritetty.")
+            return
+
         self.logger.info("TGT ei saatavilla, uusitaan TGT...")
-        system(f"kinit {self.user} -k -t ./kuisti_krb5.keytab")
-        self.logger.info("TGT uusittu.")
+
+        # Epäonnistunut uusinta ei keskeytä operaatiota, vaan error.handler yrittää sitä uudelleen.
+        try:
+            self.credentialManager.renew(maxAge=RENEW_MIN_INTERVAL)
+
+        except GSSError as err:
+            self.logger.error(f"TGT:n uusiminen epäonnistui: {err}")
 
 
     def checkGroupMembership(self, searchBase: str, groupDn: str, userDn: str = None, getAllMembers = False) -> (list[str] | bool):
@@ -125,20 +156,13 @@ class LdapConnection(Connection):
     # Haettavat attribuutit syötetään samalla tavalla kuin search-metodille (attributes=["attr1", "attr2", ...]).
     def getObjectAttr(self, *args, returnAll=False, **kwargs):
 
+        # Kaikki tulokset haetaan sivuittain, jotta palvelimen kokorajoitus ei katkaise hakua.
+        if (returnAll): return dict(self.pagedSearch(*args, **kwargs)) or None
+
         self._ldapOperation(self, self.search, *args, **kwargs)
 
         if (len(self.entries) > 0):
 
-            if (returnAll):
-
-                attributes = {}
-
-                for entry in self.entries:
-
-                    attributes[entry.entry_dn] = entry.entry_attributes_as_dict
-
-                return attributes
-
             return self.entries[0].entry_attributes_as_dict
         
         return None
@@ -154,25 +178,564 @@ class LdapConnection(Connection):
 
         #_(self, *args, **kwargs)
 
+        if (returnAll): return list(self.iterObjectDn(*args, **kwargs)) or None
+
         self._ldapOperation(self, self.search, *args, attributes=["distinguishedName"], **kwargs)
 
         if (len(self.entries) > 0):
 
-            if (returnAll):
+            return self.entries[0]["distinguishedName"].value
+        
+        return None
+    
 
-                dnList = []
+    def pagedSearch(self, searchBase: str, searchFilter: str, attributes: list[str] | None = None, pageSize: int | None = None) -> Generator[tuple[str, dict]]:
 
-                for entry in self.entries:
+        # Hakee tulokset sivuittain (simple paged results -kontrolli) ja palauttaa ne generaattorina pareina (DN, attribuutit).
+        # Muistissa on kerrallaan vain yksi sivu, eikä palvelimen kokorajoitus (AD: MaxPageSize) katkaise hakua. Attribuuttien
+        # arvot palautetaan aina listoina. Sivutuksen eväste on sidottu yhteyteen, joten yhteyttä ei saa käyttää muihin
+        # hakuihin ennen kuin generaattori on käyty loppuun (ks. LdapConnectionPool.pagedSearch).
+        pageSize = pageSize or self.pageSize
+        cookie = None
 
-                    dnList.append(entry["distinguishedName"].value)
+        while True:
 
-                return dnList
+            self._ldapOperation(self, self.search, searchBase, searchFilter, attributes=attributes, paged_size=pageSize, paged_cookie=cookie)
+
+            page = [(e["dn"], dict((k, v if (isinstance(v, list)) else [v]) for k, v in e["attributes"].items())) for e in (self.response or []) if (e.get("type") == "searchResEntry")]
+            cookie = ((self.result or {}).get("controls") or {}).get(PAGED_RESULTS_CONTROL, {}).get("value", {}).get("cookie")
+
+            yield from page
+
+            if (not cookie): break
+
+
+    def iterObjectDn(self, searchBase: str, searchFilter: str, pageSize: int | None = None) -> Generator[str]:
+
+        for dn, _ in self.pagedSearch(searchBase, searchFilter, attributes=["distinguishedName"], pageSize=pageSize):
+            yield dn
+
+
+    def getGroupMembers(self, searchBase: str, groupDn: str) -> tuple[list[str], int | None] | None:
+
+        # Palauttaa ryhmän jäsenet ja uSNChanged-arvon (None, jos ryhmää ei löydy). AD palauttaa suuresta ryhmästä enintään
+        # MaxValRange (oletuksena 1500) jäsentä kerrallaan attribuutissa member;range=<alku>-<loppu>, joten loput jäsenet
+        # haetaan jatkopyynnöillä member;range=<loppu+1>-*, kunnes viimeinen osa (<alku>-*) on saatu.
+        groupFilter = f"(&(objectClass=group)(distinguishedName={escape_filter_chars(groupDn)}))"
+        attributes = ["member", "uSNChanged"]
+        members = []
+        usn = None
+
+        while True:
+
+            self._ldapOperation(self, self.search, searchBase, groupFilter, attributes=attributes)
+
+            entries = [e for e in (self.response or []) if (e.get("type") == "searchResEntry")]
+
+            # Ryhmää ei löydy (ensimmäinen pyyntö) tai se poistettiin kesken jatkopyyntöjen.
+            if (not entries):
+                return None if ("uSNChanged" in attributes) else (members, usn)
+
+            groupAttributes = entries[0]["attributes"]
+
+            if ("uSNChanged" in attributes):
+
+                usn = groupAttributes.get("uSNChanged")
+                usn = usn[0] if (isinstance(usn, list) and usn) else (usn or None)
+
+            rangeKey = next((k for k in groupAttributes if (k.lower().startswith("member;range="))), None)
+
+            if (rangeKey is None):
+
+                members.extend(groupAttributes.get("member", []))
+                return members, usn
+
+            members.extend(groupAttributes[rangeKey])
+            rangeEnd = rangeKey.rsplit("-", 1)[1]
+
+            if (rangeEnd == "*"): return members, usn
+            attributes = [f"member;range={int(rangeEnd) + 1}-*"]
+
+
+    def searchMembersOf(self, searchBase: str, groupDns: list[str], attributes: list[str], pageSize: int | None = None) -> Generator[tuple[str, dict]]:
+
+        # Hakee yhdellä sivutetulla haulla kaikki objektit, jotka ovat jonkin annetun ryhmän suoria jäseniä, ja palauttaa
+        # ne pareina (DN, attribuutit). Ryhmien kokoa ei rajoita MaxValRange, koska jäsenet luetaan objekteista.
+        if (not groupDns): return
+
+        memberFilter = "".join(f"(memberOf={escape_filter_chars(groupDn)})" for groupDn in groupDns)
+
+        yield from self.pagedSearch(searchBase, f"(|{memberFilter})", attributes=attributes, pageSize=pageSize)
 
-            return self.entries[0]["distinguishedName"].value
-        
-        return None
-    
 
     def formatToDitAttr(self, string: str, formattingOptions: dict):
 
-        return reSub(formattingOptions["pattern"], formattingOptions["repl"], string)
\ No newline at end of file
+        return reSub(formattingOptions["pattern"], formattingOptions["repl"], string)
+
+
+
+class LdapConnectionPool():
+
+    """
+    Säieturvallinen joukko sidottuja (bind) LDAP-yhteyksiä. Jokainen operaatio lainaa yhteyden käyttöönsä koko operaation
+    ajaksi, joten haun tulokset (entries) luetaan aina samasta yhteydestä, jolla haku tehtiin, eivätkä rinnakkaiset säikeet
+    jonota yhden soketin takana. Yhteyksiä luodaan tarpeen mukaan factory-funktiolla enintään maxSize kappaletta; kun
+    kaikki ovat lainassa, lainaaja odottaa enintään checkoutTimeout sekuntia. Yhteys, joka on palautettaessa suljettu
+    tai sitomaton, hylätään.
+
+    Yhteys, joka on ollut käyttämättä vähintään healthCheckInterval sekuntia, tarkastetaan ennen lainaamista kevyellä
+    juurihaulla (rootDSE). Rikkinäinen yhteys suljetaan ja korvataan uudella.
+
+    Pooli tarjoaa samat hakemisto-operaatiot kuin LdapConnection, joten sitä käytetään kuten yksittäistä yhteyttä.
+    """
+
+    def __init__(self, factory: Callable[[], LdapConnection], maxSize: int = 4, minSize: int = 1, healthCheckInterval: float = 60, checkoutTimeout: float | None = 30):
+
+        self.factory = factory
+        self.maxSize = maxSize
+        self.healthCheckInterval = healthCheckInterval
+        self.checkoutTimeout = checkoutTimeout
+        self.logger = logging.getLogger("kuisti")
+        self.stats = {"created": 0, "discarded": 0, "waited": 0}
+
+        self._idle = deque()
+        self._size = 0
+        self._condition = Condition()
+
+        # Ensimmäiset yhteydet luodaan heti, jotta virheelliset asetukset huomataan jo käynnistyksessä.
+        for _ in range(min(minSize, maxSize)):
+
+            self._size += 1
+            self._idle.append((self._create(), monotonic()))
+
+
+    def _create(self) -> LdapConnection:
+
+        connection = self.factory()
+        self.stats["created"] += 1
+
+        return connection
+
+
+    def _discard(self, connection: LdapConnection) -> None:
+
+        self.stats["discarded"] += 1
+
+        try:
+            connection.unbind()
+
+        except Exception:
+            pass
+
+
+    def _isHealthy(self, connection: LdapConnection) -> bool:
+
+        if (connection.closed or not connection.bound): return False
+
+        try:
+            return bool(connection.search("", "(objectClass=*)", search_scope=BASE, attributes=["1.1"]))
+
+        except Exception:
+            return False
+
+
+    def checkout(self) -> LdapConnection:
+
+        deadline = None if (self.checkoutTimeout is None) else monotonic() + self.checkoutTimeout
+
+        with self._condition:
+            while True:
+
+                # Viimeksi palautettu yhteys lainataan ensin, jolloin harvoin käytetyt yhteydet vanhenevat ja tarkastetaan.
+                if (self._idle):
+
+                    connection, lastUsed = self._idle.pop()
+                    break
+
+                if (self._size < self.maxSize):
+
+                    self._size += 1
+                    connection, lastUsed = None, None
+                    break
+
+                self.stats["waited"] += 1
+                remaining = None if (deadline is None) else deadline - monotonic()
+
+                if (((remaining is not None) and (remaining <= 0)) or not self._condition.wait(remaining)):
+                    raise error.KuistiLdapPoolTimeout(f"Vapaata LDAP-yhteyttä ei saatu {self.checkoutTimeout} sekunnissa (yhteyksiä {self.maxSize}).")
+
+        try:
+            if ((connection is not None) and (monotonic() - lastUsed >= self.healthCheckInterval) and not self._isHealthy(connection)):
+
+                self.logger.info("LDAP-yhteys ei vastaa, korvataan uudella yhteydellä.")
+                self._discard(connection)
+                connection = None
+
+            return connection if (connection is not None) else self._create()
+
+        # Yhteyden luonti epäonnistui: vapautetaan paikka muille lainaajille.
+        except BaseException:
+
+            with self._condition:
+
+                self._size -= 1
+                self._condition.notify()
+
+            raise
+
+
+    def checkin(self, connection: LdapConnection, broken: bool = False) -> None:
+
+        # Operaatioiden virheet käsitellään yleensä jo error.handler-koristeessa (ja kääritään RuntimeErroriksi), joten
+        # yhteyden kunto tarkastetaan myös sen tilasta: suljettu tai sitomaton yhteys hylätään.
+        broken = broken or connection.closed or not connection.bound
+        if (broken): self._discard(connection)
+
+        with self._condition:
+
+            if (broken): self._size -= 1
+            else: self._idle.append((connection, monotonic()))
+
+            self._condition.notify()
+
+
+    @contextmanager
+    def connection(self) -> Generator[LdapConnection]:
+
+        connection = self.checkout()
+
+        try:
+            yield connection
+
+        except LDAPCommunicationError:
+
+            self.checkin(connection, broken=True)
+            raise
+
+        except BaseException:
+
+            self.checkin(connection)
+            raise
+
+        self.checkin(connection)
+
+
+    def close(self) -> None:
+
+        with self._condition:
+
+            while (self._idle):
+
+                connection, _ = self._idle.pop()
+                self._size -= 1
+                self._discard(connection)
+
+
+    def checkGroupMembership(self, *args, **kwargs) -> (list[str] | bool):
+
+        with self.connection() as connection:
+            return connection.checkGroupMembership(*args, **kwargs)
+
+
+    def getObjectAttr(self, *args, **kwargs):
+
+        with self.connection() as connection:
+            return connection.getObjectAttr(*args, **kwargs)
+
+
+    def getObjectDn(self, *args, **kwargs) -> list[str] | str | None:
+
+        with self.connection() as connection:
+            return connection.getObjectDn(*args, **kwargs)
+
+
+    def getGroupMembers(self, *args, **kwargs) -> tuple[list[str], int | None] | None:
+
+        with self.connection() as connection:
+            return connection.getGroupMembers(*args, **kwargs)
+
+
+    # Sivutettu haku pitää yhteyden lainassa, kunnes generaattori on käyty loppuun tai suljettu.
+    def pagedSearch(self, *args, **kwargs) -> Generator[tuple[str, dict]]:
+
+        with self.connection() as connection:
+            yield from connection.pagedSearch(*args, **kwargs)
+
+
+    def iterObjectDn(self, *args, **kwargs) -> Generator[str]:
+
+        with self.connection() as connection:
+            yield from connection.iterObjectDn(*args, **kwargs)
+
+
+    def searchMembersOf(self, *args, **kwargs) -> Generator[tuple[str, dict]]:
+
+        with self.connection() as connection:
+            yield from connection.searchMembersOf(*args, **kwargs)
+
+
+    def modify(self, *args, **kwargs) -> bool:
+
+        with self.connection() as connection:
+            return connection.modify(*args, **kwargs)
+
+
+    def formatToDitAttr(self, string: str, formattingOptions: dict):
+
+        return reSub(formattingOptions["pattern"], formattingOptions["repl"], string)
+
+
+
+class GroupModifyQueue():
+
+    """
+    Ryhmäjäsenyyksien muutosjono (write-behind). addMember ja removeMember eivät muokkaa hakemistoa kutsujan säikeessä,
+    vaan kirjaavat muutoksen jonoon ja palauttavat Future-olion, joka valmistuu (True), kun jäsenyys on pyydetyssä tilassa,
+    tai päättyy KuistiLdapModificationError-virheeseen. Kutsuja voi odottaa tulosta tai liittää siihen takaisinkutsun
+    (add_done_callback).
+
+    Taustasäie kerää muutoksia window sekuntia ensimmäisestä odottavasta muutoksesta ja lähettää kunkin ryhmän
+    muutokset yhtenä modify-operaationa, jossa on kaikki lisättävät ja poistettavat jäsenet (enintään batchSize jäsentä
+    operaatiota kohden). Saman jäsenen odottavat vastakkaiset muutokset (lisäys ja poisto) kumoavat toisensa, eikä
+    hakemistoon lähetetä mitään. Jäsenyys, joka on jo pyydetyssä tilassa (GroupCache), kuitataan heti. Tätä varten
+    välimuistin ryhmä tarkastetaan hakemistosta, jos sen edellisestä tarkastuksesta on yli maxCacheAge sekuntia, jotta
+    hakemistoon muualla tehty muutos ei jätä pyydettyä muutosta tekemättä.
+
+    Hakemisto hylkää koko operaation, jos yksikin lisättävä jäsen on jo ryhmässä tai poistettava jäsen ei ole siinä.
+    Silloin ryhmän muutokset lähetetään uudelleen jäsen kerrallaan, ja nämä virheet tulkitaan onnistumisiksi, koska
+    jäsenyys on jo pyydetyssä tilassa.
+    """
+
+    def __init__(self, ldapConnection: LdapConnectionPool, groupCache: GroupCache, window: float = 0.25, batchSize: int = 500, maxCacheAge: float = 5) -> None:
+
+        self.ldapConnection = ldapConnection
+        self.groupCache = groupCache
+        self.window = window
+        self.batchSize = batchSize
+        self.maxCacheAge = maxCacheAge
+        self.logger = logging.getLogger("kuisti")
+        self.stats = {"requests": 0, "skipped": 0, "coalesced": 0, "cancelled": 0, "modifies": 0, "fallbacks": 0, "failed": 0}
+
+        # Ryhmän DN (pienillä kirjaimilla) -> {"dn": ryhmän DN, "members": {jäsenen DN pienillä kirjaimilla: [op, DN, [Future]]}}.
+        self._pending = {}
+        self._pendingCount = 0
+        self._pendingSince = None
+
+        # Lähetettävänä olevat muutokset (ryhmä -> {jäsen: op}). Välimuisti päivitetään vasta lähetyksen jälkeen, joten
+        # jäsenyyden tila luetaan ensin jonosta, sitten lähetettävistä muutoksista ja vasta sitten välimuistista.
+        self._inflight = {}
+        self._generation = 0
+
+        self._force = False
+        self._closed = False
+        self._condition = Condition()
+        self._thread = Thread(target=self._worker, name="group-modify", daemon=True)
+        self._thread.start()
+
+
+    def addMember(self, groupDn: str, memberDn: str) -> Future:
+
+        return self._submit(groupDn, memberDn, MODIFY_ADD)
+
+
+    def removeMember(self, groupDn: str, memberDn: str) -> Future:
+
+        return self._submit(groupDn, memberDn, MODIFY_DELETE)
+
+
+    def _submit(self, groupDn: str, memberDn: str, op: str) -> Future:
+
+        future = Future()
+        groupKey, memberKey = groupDn.lower(), memberDn.lower()
+
+        while (True):
+
+            # Välimuisti voi joutua noutamaan ryhmän hakemistosta, joten se luetaan lukon ulkopuolella. Jos lähetys
+            # valmistuu sillä välin (generation muuttuu), luettu tila voi olla vanhentunut, ja tarkastus tehdään uudelleen.
+            generation = self._generation
+            isMember = self.groupCache.isMember(groupDn, memberDn, maxAge=self.maxCacheAge)
+
+            with self._condition:
+
+                if (self._closed): raise RuntimeError("Ryhmäjäsenyyksien muutosjono on suljettu.")
+
+                group = self._pending.get(groupKey)
+                entry = group["members"].get(memberKey) if (group) else None
+
+                if (entry is not None):
+
+                    self.stats["requests"] += 1
+
+                    if (entry[0] == op):
+
+                        self.stats["coalesced"] += 1
+                        entry[2].append(future)
+                        return future
+
+                    # Vastakkainen muutos kumoaa odottavan muutoksen: jäsenyys on jo valmiiksi pyydetyssä tilassa.
+                    self.stats["cancelled"] += 1
+                    del group["members"][memberKey]
+                    self._pendingCount -= 1
+                    if (not group["members"]): del self._pending[groupKey]
+
+                    completed = entry[2] + [future]
+                    break
+
+                inflight = self._inflight.get(groupKey, {}).get(memberKey)
+                if ((inflight is None) and (generation != self._generation)): continue
+
+                self.stats["requests"] += 1
+
+                if (((inflight == MODIFY_ADD) if (inflight is not None) else isMember) == (op == MODIFY_ADD)):
+
+                    self.stats["skipped"] += 1
+                    completed = [future]
+                    break
+
+                if (not self._pending): self._pendingSince = monotonic()
+
+                self._pending.setdefault(groupKey, {"dn": groupDn, "members": {}})["members"][memberKey] = [op, memberDn, [future]]
+                self._pendingCount += 1
+                self._condition.notify_all()
+
+                return future
+
+        # Takaisinkutsut suoritetaan lukon ulkopuolella.
+        for f in completed: f.set_result(True)
+
+        return future
+
+
+    def _worker(self) -> None:
+
+        while (True):
+
+            with self._condition:
+
+                while (not self._pending and not self._closed):
+                    self._condition.wait()
+
+                if (not self._pending): return
+
+                # Odota muutosikkunan loppuun, ellei jono ole täynnä tai sitä tyhjennetä (flush/close).
+                while (self._pending and not (self._force or self._closed) and (self._pendingCount < self.batchSize)):
+
+                    remaining = self._pendingSince + self.window - monotonic()
+                    if (remaining <= 0): break
+
+                    self._condition.wait(remaining)
+
+                batch, self._pending = self._pending, {}
+                self._pendingCount = 0
+                self._force = False
+                self._inflight = dict((groupKey, dict((memberKey, e[0]) for memberKey, e in group["members"].items())) for groupKey, group in batch.items())
+
+            results = []
+
+            for group in batch.values():
+                results.extend(self._flushGroup(group["dn"], list(group["members"].values())))
+
+            with self._condition:
+
+                # Välimuisti päivitetään samassa lukossa, jossa lähetetyt muutokset poistetaan, jotta jäsenyyden tila
+                # luetaan aina joko lähetettävistä muutoksista tai päivitetystä välimuistista.
+                for groupDn, entry, err in results:
+
+                    if (err is not None): self.groupCache.invalidate(groupDn)
+                    elif (entry[0] == MODIFY_ADD): self.groupCache.addMember(groupDn, entry[1])
+                    else: self.groupCache.removeMember(groupDn, entry[1])
+
+                self._inflight = {}
+                self._generation += 1
+                self._condition.notify_all()
+
+            for groupDn, entry, err in results:
+                for future in entry[2]:
+
+                    if (err is None): future.set_result(True)
+                    else: future.set_exception(err)
+
+
+    def _modify(self, groupDn: str, changes: list[tuple[str, list[str]]]) -> tuple[bool, int | None, str]:
+
+        self.stats["modifies"] += 1
+
+        try:
+            with self.ldapConnection.connection() as connection:
+
+                success = connection.modify(groupDn, {"member": changes})
+                result = connection.result or {}
+
+                return success, result.get("result"), result.get("description", "")
+
+        except Exception as err:
+            return False, None, str(err)
+
+
+    def _flushGroup(self, groupDn: str, entries: list[list]) -> list[tuple[str, list, Exception | None]]:
+
+        results = []
+
+        for idx in range(0, len(entries), self.batchSize):
+
+            chunk = entries[idx:idx + self.batchSize]
+            changes = []
+
+            for op in (MODIFY_ADD, MODIFY_DELETE):
+
+                memberDns = [e[1] for e in chunk if (e[0] == op)]
+                if (memberDns): changes.append((op, memberDns))
+
+            success, resultCode, description = self._modify(groupDn, changes)
+
+            # Yksittäisen jäsenen lisäys, joka on jo ryhmässä, tai poisto, joka ei ole siinä, on jo pyydetyssä tilassa.
+            if ((not success) and (len(chunk) == 1)):
+                success = resultCode in (ALREADY_MEMBER_RESULTS if (chunk[0][0] == MODIFY_ADD) else NOT_MEMBER_RESULTS)
+
+            if (success):
+
+                results.extend((groupDn, e, None) for e in chunk)
+                continue
+
+            if ((len(chunk) > 1) and (resultCode in ALREADY_MEMBER_RESULTS + NOT_MEMBER_RESULTS)):
+
+                self.stats["fallbacks"] += 1
+                self.logger.debug(f'Ryhmän "{groupDn}" koottu muutos hylättiin ({description}), lähetetään muutokset jäsen kerrallaan.')
+
+                for e in chunk: results.extend(self._flushGroup(groupDn, [e]))
+                continue
+
+            self.stats["failed"] += len(chunk)
+            self.logger.error(f'Ryhmän "{groupDn}" jäsenyyksien muokkaus epäonnistui ({len(chunk)} muutosta): {description}')
+
+            err = error.KuistiLdapModificationError(f'Ryhmän "{groupDn}" jäsenyyksien muokkaus epäonnistui: {description}')
+            results.extend((groupDn, e, err) for e in chunk)
+
+        return results
+
+
+    def flush(self, timeout: float | None = None) -> bool:
+
+        # Lähettää odottavat muutokset heti ja odottaa niiden valmistumista. Palauttaa False, jos aika loppui.
+        with self._condition:
+
+            if (self._pending): self._force = True
+            self._condition.notify_all()
+
+            return self._condition.wait_for(lambda: not (self._pending or self._inflight), timeout)
+
+
+    def close(self, timeout: float | None = None) -> None:
+
+        with self._condition:
+
+            self._closed = True
+            self._condition.notify_all()
+
+        self._thread.join(timeout)
+
+
+    def getStats(self) -> dict:
+
+        with self._condition:
+            return {**self.stats, "pending": self._pendingCount}
@@ -67,22 +67,17 @@ class DefaultLogHandler(LogHandler):
 
                 self.logger.info(f'Käyttäjä "{user.identifier}" saapui huoneeseen "{roomName}" ({system}).')
 
-                if (not user.isPresent()):
-                    user.activate()
-
-                if (not user.isInRoom(roomName)):
-
-                    try:
-                        user.addRoom(roomName)
-
-                    except KuistiNoRoomsFound as err:
+                # Läsnäolo, huoneeseen lisäys ja reitin tarkastus tehdään yhdellä tietokantatransaktiolla.
+                try:
+                    state = user.enterRoom(roomName)
 
-                        self.logger.warning(err)
-                        continue
+                except KuistiNoRoomsFound as err:
 
+                    self.logger.warning(err)
+                    continue
 
-                if (routeToRoom and not user.isLogonAllowed(roomName)):
-                    if (user.pathTaken(roomName)):
+                if (routeToRoom and not state["roomInfo"]["logonAllowed"]):
+                    if (state["pathTaken"]):
 
                         user.allowLogon([roomName])
                         self.logger.info(f'Sallittu käyttäjän "{user.identifier}" kirjautuminen huoneen "{roomName}" työasemille.')
@@ -93,7 +88,9 @@ class DefaultLogHandler(LogHandler):
 
                     self.logger.info(f'Käyttäjä "{user.identifier}" poistui huoneesta "{roomName}" ({system}).')
 
-                    if ((user.isInRoom(roomName)) and (user.getRoomTimestamp(roomName) != "paused")):
+                    roomInfo = user.getRoomInfo(roomName)
+
+                    if (roomInfo and (roomInfo["timestamp"] != "paused")):
 
                         if (routeToRoom):
 
@@ -131,15 +128,13 @@ class DefaultLogHandler(LogHandler):
 
                         user.removeRoom(roomName)
 
-                    if (not user.isInRoom("any")):
+                    if (user.deactivateIfAbsent()):
 
                         if (self.kuistiInstance.firewall):
 
                             user.removeFilter()
                             self.logger.info(f'Poistettu kaikki käyttäjän "{user.identifier}" suodatussäännöt.')
 
-                        user.deactivate()
-
                 else:
                     self.logger.warning(f'Yritetty poistaa käyttäjä "{user.identifier}" aktiivisten käyttäjien listalta. Käyttäjä ei ole kulunvalvonnan lokin mukaan paikalla.')
 
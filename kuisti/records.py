@@ -0,0 +1,141 @@
+from __future__ import annotations
+from collections.abc import Mapping
+from json import loads
+from sys import intern
+from types import MappingProxyType
+from typing import Any, Iterator
+
+
+
+# Suodatusasetukset JSON-merkkijonona -> (jaettu merkkijono, jäsennetty asetus). Erilaisia asetuksia on vain yksi
+# jokaista roolin suodatussääntöä kohden, joten taulu pysyy pienenä käyttäjien ja sääntöjen määrästä riippumatta.
+_filterConfs = {}
+
+
+
+def internFilterConf(filterConf: str) -> str:
+
+    # Palauttaa jaetun kopion suodatusasetuksesta, jolloin jokainen sääntö viittaa samaan merkkijonoon.
+    entry = _filterConfs.get(filterConf)
+
+    if (entry is None):
+        entry = _filterConfs.setdefault(filterConf, (filterConf, MappingProxyType(loads(filterConf) if (filterConf) else {})))
+
+    return entry[0]
+
+
+def loadFilterConf(filterConf: str) -> Mapping:
+
+    # Palauttaa suodatusasetuksen jäsennettynä. Jäsennys tehdään vain kerran asetusta kohden, ja tulos on vain luku -muotoinen,
+    # koska sama olio jaetaan kaikkien samaa asetusta käyttävien sääntöjen kesken.
+    internFilterConf(filterConf)
+
+    return _filterConfs[filterConf][1]
+
+
+
+class Record(Mapping):
+
+    """
+    Tietokantamerkintöjen kantaluokka. Kentät tallennetaan __slots__-attribuutteihin sanakirjan sijaan, mikä pienentää
+    merkinnän muistinkäyttöä huomattavasti. Merkintää käytetään kuten sanakirjaa (entry["timestamp"], entry.get(...),
+    dict(entry), {**entry}), joten merkintöjä käsittelevään koodiin ei tarvita muutoksia.
+    """
+
+    __slots__ = ()
+
+
+    def __getitem__(self, key: str) -> Any:
+
+        if (key not in self.__slots__): raise KeyError(key)
+        return getattr(self, key)
+
+
+    def __setitem__(self, key: str, value: Any) -> None:
+
+        if (key not in self.__slots__): raise KeyError(key)
+        setattr(self, key, value)
+
+
+    def __iter__(self) -> Iterator[str]:
+
+        return iter(self.__slots__)
+
+
+    def __len__(self) -> int:
+
+        return len(self.__slots__)
+
+
+    def __repr__(self) -> str:
+
+        return f"{type(self).__name__}({dict(self)})"
+
+
+    def __reduce__(self) -> tuple:
+
+        # Serialisoidaan pelkät kenttien arvot (esim. prosessien välinen tapahtumaväylä).
+        return (type(self), tuple(getattr(self, k) for k in self.__slots__))
+
+
+    def copy(self) -> Record:
+
+        return type(self)(**self)
+
+
+    def replace(self, **changes) -> Record:
+
+        # Palauttaa uuden merkinnän, jossa annetut kentät on korvattu. Alkuperäistä merkintää ei muokata.
+        unknownKeys = set(changes) - set(self.__slots__)
+        if (unknownKeys): raise KeyError(f"Tuntemattomat kentät: {', '.join(sorted(unknownKeys))}")
+
+        return type(self)(**{**self, **changes})
+
+
+
+class UserRecord(Record):
+
+    __slots__ = ("userId", "dn", "roles")
+
+
+    def __init__(self, userId: str, dn: str, roles: list[str]) -> None:
+
+        self.userId = userId
+        self.dn = dn
+        self.roles = roles
+
+
+
+class RoomRecord(Record):
+
+    __slots__ = ("userId", "roomName", "roomDn", "timestamp", "logonAllowed")
+
+
+    def __init__(self, userId: str, roomName: str, roomDn: str, timestamp: str, logonAllowed: bool = False) -> None:
+
+        self.userId = userId
+        self.roomName = intern(roomName)
+        self.roomDn = intern(roomDn) if (roomDn) else roomDn
+        self.timestamp = timestamp
+        self.logonAllowed = logonAllowed
+
+
+
+class FilterRecord(Record):
+
+    __slots__ = ("userId", "role", "filterName", "roomName", "deviceName", "deviceIp", "timestamp", "autoLocked", "renewalAmount", "filterConf")
+
+
+    def __init__(self, userId: str, role: str, filterName: str, roomName: str, deviceName: str, deviceIp: str, timestamp: str, autoLocked: bool = False, renewalAmount: int = 0, filterConf: str = "") -> None:
+
+        # Roolit, huoneet ja suodatusasetukset toistuvat lukuisissa säännöissä, joten niistä tallennetaan vain viittaus jaettuun kopioon.
+        self.userId = userId
+        self.role = intern(role)
+        self.filterName = filterName
+        self.roomName = intern(roomName)
+        self.deviceName = deviceName
+        self.deviceIp = deviceIp
+        self.timestamp = timestamp
+        self.autoLocked = autoLocked
+        self.renewalAmount = renewalAmount
+        self.filterConf = internFilterConf(filterConf)
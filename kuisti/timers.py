@@ -0,0 +1,148 @@
+from __future__ import annotations
+from heapq import heapify, heappop, heappush
+from itertools import count
+from typing import Any, Hashable, Iterable
+
+
+
+# Merkinnän kenttien indeksit (lista on tuplea kevyempi muokata, kun merkintä mitätöidään).
+_DEADLINE, _SEQ, _KEY, _ITEM, _VALID = range(5)
+
+# Keko rakennetaan uudelleen, kun mitätöityjä merkintöjä on enemmän kuin voimassa olevia.
+_COMPACT_MIN_SIZE = 1024
+
+
+
+class TimerHeap():
+
+    """
+    Binäärikekoon perustuva ajastinrakenne. Jokaisella ajastimella on avain, jonka avulla ajastin voidaan
+    perua tai ajastaa uudelleen. Lisäys ja uudelleenajastus ovat O(log n), peruminen O(1) (merkintä mitätöidään
+    ja siivotaan keosta myöhemmin) ja erääntyneet ajastimet voidaan poimia kerralla popDue-metodilla.
+    """
+
+    def __init__(self) -> None:
+
+        self._heap = []
+        self._entries = {}
+        self._seq = count()
+        self._stale = 0
+
+
+    def __len__(self) -> int:
+
+        return len(self._entries)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+
+        return key in self._entries
+
+
+    def schedule(self, key: Hashable, deadline: float, item: Any = None) -> bool:
+
+        # Palauttaa True, jos samalla avaimella oli jo odottava ajastin, joka korvattiin.
+        replaced = self._invalidate(key)
+
+        entry = [deadline, next(self._seq), key, item, True]
+        self._entries[key] = entry
+        heappush(self._heap, entry)
+        self._compact()
+
+        return replaced
+
+
+    def cancel(self, key: Hashable) -> bool:
+
+        cancelled = self._invalidate(key)
+        self._compact()
+
+        return cancelled
+
+
+    def get(self, key: Hashable) -> tuple[float, Any] | None:
+
+        entry = self._entries.get(key)
+
+        if (entry is None): return None
+        return (entry[_DEADLINE], entry[_ITEM])
+
+
+    def nextDeadline(self) -> float | None:
+
+        self._prune()
+
+        if (not self._heap): return None
+        return self._heap[0][_DEADLINE]
+
+
+    def popDue(self, now: float, limit: int | None = None) -> list[tuple[Hashable, Any]]:
+
+        due = []
+
+        while (self._heap and (self._heap[0][_DEADLINE] <= now)):
+
+            entry = heappop(self._heap)
+
+            if (not entry[_VALID]):
+
+                self._stale -= 1
+                continue
+
+            del self._entries[entry[_KEY]]
+            due.append((entry[_KEY], entry[_ITEM]))
+
+            if (limit and (len(due) >= limit)): break
+
+        return due
+
+
+    def rebuild(self, timers: Iterable[tuple[Hashable, float, Any]]) -> None:
+
+        # Korvaa kaikki ajastimet kerralla (avain, eräpäivä, kohde) -kolmikoista. Keko muodostetaan yhdellä heapify-kutsulla,
+        # mikä on suurelle määrälle ajastimia nopeampaa kuin jokaisen ajastimen lisääminen erikseen.
+        self._entries = {}
+
+        for key, deadline, item in timers:
+            self._entries[key] = [deadline, next(self._seq), key, item, True]
+
+        self._heap = list(self._entries.values())
+        heapify(self._heap)
+        self._stale = 0
+
+
+    def clear(self) -> None:
+
+        self._heap.clear()
+        self._entries.clear()
+        self._stale = 0
+
+
+    def _invalidate(self, key: Hashable) -> bool:
+
+        entry = self._entries.pop(key, None)
+
+        if (entry is None): return False
+
+        entry[_VALID] = False
+        self._stale += 1
+
+        return True
+
+
+    def _prune(self) -> None:
+
+        # Poista keon päältä mitätöidyt merkinnät, jotta seuraava eräpäivä on aina voimassa olevan ajastimen.
+        while (self._heap and (not self._heap[0][_VALID])):
+
+            heappop(self._heap)
+            self._stale -= 1
+
+
+    def _compact(self) -> None:
+
+        if ((len(self._heap) < _COMPACT_MIN_SIZE) or (self._stale * 2 < len(self._heap))): return
+
+        self._heap = [entry for entry in self._heap if entry[_VALID]]
+        heapify(self._heap)
+        self._stale = 0
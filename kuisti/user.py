@@ -1,9 +1,9 @@
 from __future__ import annotations
 from . import error
+from concurrent.futures import Future
 from datetime import datetime, timezone
-from ldap3 import MODIFY_ADD, MODIFY_DELETE
+from functools import partial
 from typing import TYPE_CHECKING
-from re import sub as reSub
 from json import dumps, loads
 
 
@@ -39,9 +39,16 @@ class User():
 
         else:
 
-            self.dn = self._getDn()
+            # Poissa olevan käyttäjän DN haetaan välimuistista, jos käyttäjä on haettu hiljattain. Roolit luetaan aina
+            # RoleIndex-indeksistä, joten roolin ryhmästä poistettu käyttäjä menettää roolin indeksin seuraavassa päivityksessä.
+            self.dn = self.kuistiInstance.identityCache.get(self.identifier)
 
-            if ((len(self.roles) == 1) and (self.roles[0] == "default")):
+            if (self.dn is None):
+
+                self.dn = self._getDn()
+                if (self.dn): self.kuistiInstance.identityCache.put(self.identifier, self.dn)
+
+            if (self.dn and (len(self.roles) == 1) and (self.roles[0] == "default")):
                 self.roles = self._getRoles()
 
 
@@ -58,66 +65,82 @@ class User():
     def _getRoles(self) -> list[str]:
 
         roles = self.roles
+        roles.extend(self.kuistiInstance.roleIndex.getRoles(self.dn))
 
-        for roleDn in self.kuistiInstance.roleDnList:
+        return roles
 
-            roleName = reSub(fr'^CN={self.kuistiInstance.rolePrefix}(.+?),.+$', r'\1', roleDn).lower()
 
-            memberOfGroup = self.kuistiInstance.ldapConnection.checkGroupMembership(
+    def _getRoomDn(self, roomName: str) -> str:
 
-                self.kuistiInstance.environmentConf["ldap"]["ditSearchBase"],
-                roleDn,
-                self.dn
+        roomDn = self.kuistiInstance.getRoomDn(roomName)
 
-            )
-            
-            if (memberOfGroup):
-                roles.append(roleName.lower())
+        if (not roomDn): raise error.KuistiNoRoomsFound(f'Huonetta {roomName} ei löydy hakemistopalvelimelta.')
 
-        return roles
+        return roomDn
 
 
     def addRoom(self, roomName: str) -> None:
 
-        formattedRoomName = f'{self.kuistiInstance.roomPrefix}{roomName}'
+        roomDn = self._getRoomDn(roomName)
 
-        roomDn = self.kuistiInstance.ldapConnection.getObjectDn(
+        timestamp = datetime.now(timezone.utc).timestamp() * 1000
+        self.kuistiInstance.db.addUserToRoom(self.identifier, roomName, roomDn, timestamp)
 
-            self.kuistiInstance.environmentConf["ldap"]["ditSearchBase"],
-            f'(&(objectClass=group)({self.kuistiInstance.environmentConf["ldap"]["roomDitAttr"]}={formattedRoomName}))'
 
-        )
+    def enterRoom(self, roomName: str) -> dict:
 
-        if (not roomDn): raise error.KuistiNoRoomsFound(f'Huonetta {roomName} ei löydy hakemistopalvelimelta.')
+        """
+        Merkitsee käyttäjän läsnäolevaksi ja lisää käyttäjän huoneeseen yhdellä tietokantatransaktiolla. Palauttaa
+        sanakirjan, jossa ovat huoneen tiedot (roomInfo), tieto siitä, lisättiinkö käyttäjä huoneeseen (added), ja
+        tieto siitä, onko käyttäjä kulkenut koko huoneeseen johtavan reitin (pathTaken).
+        """
 
-        timestamp = datetime.now(timezone.utc).timestamp() * 1000
-        roomInfo = self.kuistiInstance.db.addUserToRoom(self.identifier, roomName, roomDn, timestamp)
-        self.kuistiInstance.roomEventQueue.put(roomInfo)
+        routeToRoom = self.kuistiInstance.getRoute(roomName)
+        roomDn = None if (self.isInRoom(roomName)) else self._getRoomDn(roomName)
+
+        def _(db, roomDn: str | None) -> dict | None:
+
+            if (not db.getUserInfo(self.identifier)):
+                db.addUser(self.identifier, self.dn, self.roles)
+
+            rooms = {e["roomName"]: e for e in db.getUserAttendance(self.identifier)}
+            added = roomName not in rooms
+
+            if (added):
+
+                # Käyttäjä poistettiin huoneesta tarkastuksen jälkeen, joten huoneen DN on haettava ennen uutta yritystä.
+                if (roomDn is None): return None
+
+                rooms[roomName] = db.addUserToRoom(self.identifier, roomName, roomDn, datetime.now(timezone.utc).timestamp() * 1000)
+
+            return {"roomInfo": rooms[roomName], "added": added, "pathTaken": all(rn in rooms for rn in routeToRoom)}
+
+        state = self.kuistiInstance.db.transaction(_, roomDn, userId=self.identifier)
+
+        if (state is None):
+            state = self.kuistiInstance.db.transaction(_, self._getRoomDn(roomName), userId=self.identifier)
+
+        return state
 
     
-    def allowLogon(self, rooms: list[str]) -> None:
+    def allowLogon(self, rooms: list[str]) -> list[Future]:
         
+        futures = []
+
         for room in rooms:
 
             roomInfo = self.getRoomInfo(room)
             if (not roomInfo): raise error.KuistiUserNotInRoom
 
-            # Lisää käyttäjä ryhmään, jos käyttäjä ei siellä vielä ole.
-            alreadyInGroup = self.kuistiInstance.ldapConnection.checkGroupMembership(
-
-                self.kuistiInstance.environmentConf["ldap"]["ditSearchBase"],
-                roomInfo["roomDn"],
-                self.dn
-
-            )
-
-            if (not(alreadyInGroup)):
-
-                modificationSuccess = self.kuistiInstance.ldapConnection.modify(roomInfo["roomDn"], {"member": [(MODIFY_ADD, [self.dn])]})
-                if (not(modificationSuccess)): raise error.KuistiLdapModificationError("Ryhmäjäsenyyksien muokkaus epäonnistui."); exit(1)
+            # Käyttäjä lisätään huoneen ryhmään taustalla (ks. GroupModifyQueue), ja kirjautuminen merkitään sallituksi heti.
+            future = self.kuistiInstance.groupModifyQueue.addMember(roomInfo["roomDn"], self.dn)
+            future.add_done_callback(partial(self._groupModified, room, roomInfo["roomDn"], True))
+            futures.append(future)
 
             self.kuistiInstance.db.updateRoomLogon(self.identifier, room, logonAllowed=True)
 
+        return futures
+
 
     def addFilter(self, roomName: str, timestamp: str, deviceName: str, deviceIp: str) -> None:
 
@@ -140,10 +163,8 @@ class User():
                     # Luo uusi sääntö, jos sitä ei ole olemassa palomuurilla. Muutoin päivitä olemassa olevan säännön aikaleima.
                     if (len(searchResultParsed["rows"]) == 0):
 
-                        newFilterInfo = self.kuistiInstance.db.addFilter(self.identifier, role, filterName, roomName, timestamp, deviceName, deviceIp, renewalAmount=renewalAmount, filterConf=dumps(filterConf))
-
+                        self.kuistiInstance.db.addFilter(self.identifier, role, filterName, roomName, timestamp, deviceName, deviceIp, renewalAmount=renewalAmount, filterConf=dumps(filterConf))
                         self.kuistiInstance.firewall.createFilter(filterName, deviceIp, filterConf)
-                        self.kuistiInstance.filterEventQueue.put(newFilterInfo)
 
                     else:
 
@@ -159,10 +180,7 @@ class User():
 
     def updateFilterTimestamp(self, filterName: str, timestamp: str) -> None:
 
-        updatedEntry = self.kuistiInstance.db.updateFilterTs(filterName, timestamp)
-
-        if (timestamp == "paused"): return
-        self.kuistiInstance.filterEventQueue.put(updatedEntry)
+        self.kuistiInstance.db.updateFilterTs(filterName, timestamp)
 
 
     def updateFilterInfo(self, filterName: str, updatedInfo: dict) -> dict:
@@ -181,10 +199,7 @@ class User():
 
     def updateRoomTimestamp(self, roomName: str, timestamp: str) -> None:
 
-        updatedEntry = self.kuistiInstance.db.updateRoomTs(self.identifier, roomName, timestamp)
-
-        if (timestamp == "paused"): return
-        self.kuistiInstance.roomEventQueue.put(updatedEntry)
+        self.kuistiInstance.db.updateRoomTs(self.identifier, roomName, timestamp)
 
 
     def isFilterAutolocked(self, filterName: str) -> bool:
@@ -299,52 +314,60 @@ class User():
 
     def removeRoom(self, roomName: str) -> None:
 
-        formattedRoomName = f'{self.kuistiInstance.roomPrefix}{roomName}'
-
-        roomDn = self.kuistiInstance.ldapConnection.getObjectDn(
-
-            self.kuistiInstance.environmentConf["ldap"]["ditSearchBase"],
-            f'(&(objectClass=group)({self.kuistiInstance.environmentConf["ldap"]["roomDitAttr"]}={formattedRoomName}))'
-
-        )
-
-        if (not roomDn): raise error.KuistiNoRoomsFound
+        self._getRoomDn(roomName)
 
         # Poista käyttäjän läsnäolomerkintä.
         self.kuistiInstance.db.removeUserFromRoom(self.identifier, roomName)
 
 
-    def denyLogon(self, rooms: list[str]) -> None:
+    def denyLogon(self, rooms: list[str]) -> list[Future]:
+
+        futures = []
 
         for room in rooms:
 
             roomInfo = self.getRoomInfo(room)
             if (not roomInfo): raise error.KuistiUserNotInRoom
 
-            userInGroup = self.kuistiInstance.ldapConnection.checkGroupMembership(
+            future = self.kuistiInstance.groupModifyQueue.removeMember(roomInfo["roomDn"], self.dn)
+            future.add_done_callback(partial(self._groupModified, room, roomInfo["roomDn"], False))
+            futures.append(future)
 
-                self.kuistiInstance.environmentConf["ldap"]["ditSearchBase"],
-                roomInfo["roomDn"],
-                self.dn
+        return futures
 
-            )
 
-            if (userInGroup):
-                modificationSuccess = self.kuistiInstance.ldapConnection.modify(roomInfo["roomDn"], {"member": [(MODIFY_DELETE, [self.dn])]})
+    def _groupModified(self, room: str, roomDn: str, allowed: bool, future: Future) -> None:
 
-                if (not(modificationSuccess)): raise ValueError("Ryhmäjäsenyyksien muokkaus epäonnistui."); exit(1)
+        err = future.exception()
+        if (err is None): return
 
+        self.logger.error(f'Käyttäjän "{self.identifier}" kirjautumisen {"salliminen" if (allowed) else "estäminen"} huoneen "{room}" työasemille epäonnistui: {err}')
+        if (not allowed): return
 
-    def pathTaken(self, forRoom: str) -> bool:
+        # Epäonnistunut lisäys perutaan tietokannasta, jolloin seuraava tapahtuma yrittää sitä uudelleen. Takaisinkutsu
+        # suoritetaan muutosjonon säikeessä, joten virheet kirjataan tässä (Future ei välitä niitä eteenpäin).
+        try:
+            # Myöhempi lisäys on voinut jo onnistua. Välimuisti mitätöitiin virheen takia, joten jäsenyys luetaan hakemistosta.
+            if (self.kuistiInstance.groupCache.isMember(roomDn, self.dn)): return
 
-        count = 0
-        routeToRoom = self.kuistiInstance.getRoute(forRoom)
-        routeLen = len(routeToRoom)
+            def _(db) -> None:
 
-        for rn in routeToRoom:
-            if (self.isInRoom(rn)): count += 1
+                # Huone tarkastetaan samassa transaktiossa: käyttäjä on voinut jo poistua huoneesta.
+                for e in db.getUserAttendance(self.identifier, room):
+                    if (e["logonAllowed"]): db.updateRoomLogon(self.identifier, room, logonAllowed=False)
 
-        return (count == routeLen)
+            self.kuistiInstance.db.transaction(_, userId=self.identifier)
+
+        except Exception:
+            self.logger.exception(f'Käyttäjän "{self.identifier}" kirjautumisen perumista huoneessa "{room}" ei voitu tallentaa.')
+
+
+    def pathTaken(self, forRoom: str) -> bool:
+
+        # Reitin huoneet tarkastetaan yhdellä tietokantahaulla (ei erillistä hakua jokaista reitin huonetta kohden).
+        rooms = set(e["roomName"] for e in self.kuistiInstance.db.getUserAttendance(self.identifier))
+
+        return all(rn in rooms for rn in self.kuistiInstance.getRoute(forRoom))
 
     
     def activate(self):
@@ -354,4 +377,18 @@ class User():
     
     def deactivate(self):
 
-        self.kuistiInstance.db.removeUser(self.identifier)
\ No newline at end of file
+        self.kuistiInstance.db.removeUser(self.identifier)
+
+
+    def deactivateIfAbsent(self) -> bool:
+
+        # Poistaa käyttäjän aktiivisista käyttäjistä, jos käyttäjä ei ole enää yhdessäkään huoneessa (tarkastus ja poisto
+        # samassa transaktiossa). Palauttaa True, jos käyttäjä oli aktiivinen ja poistettiin.
+        def _(db) -> bool:
+
+            if ((not db.getUserInfo(self.identifier)) or db.getUserAttendance(self.identifier)): return False
+
+            db.removeUser(self.identifier)
+            return True
+
+        return self.kuistiInstance.db.transaction(_, userId=self.identifier)
\ No newline at end of file
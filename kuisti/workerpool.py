@@ -0,0 +1,105 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from statistics import quantiles
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Hashable
+
+
+
+# Kuinka monen viimeisimmän tehtävän suoritusaika säilytetään persentiilien laskemista varten.
+LATENCY_SAMPLES = 10000
+
+
+
+class KeyedWorkerPool():
+
+    """
+    Säiejoukko, joka suorittaa eri avainten (esim. käyttäjätunnusten) tehtäviä rinnakkain, mutta saman avaimen
+    tehtäviä aina yksi kerrallaan ja siinä järjestyksessä, jossa ne on annettu.
+    """
+
+    def __init__(self, workerCount: int, name: str = "worker") -> None:
+
+        self.workerCount = workerCount
+        self._executor = ThreadPoolExecutor(max_workers=workerCount, thread_name_prefix=name)
+        self._lock = Lock()
+
+        # Avain on varattu niin kauan kuin sillä on merkintä tässä sanakirjassa (myös tyhjä jono).
+        self._pending = {}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+
+    def submit(self, key: Hashable, func: Callable, *args, **kwargs) -> Future:
+
+        future = Future()
+        task = (func, args, kwargs, future)
+
+        with self._lock:
+
+            pendingTasks = self._pending.get(key)
+
+            if (pendingTasks is not None):
+
+                pendingTasks.append(task)
+                return future
+
+            self._pending[key] = deque([task])
+
+        self._executor.submit(self._drain, key)
+
+        return future
+
+
+    def _drain(self, key: Hashable) -> None:
+
+        while (True):
+
+            with self._lock:
+
+                pendingTasks = self._pending[key]
+
+                if (not pendingTasks):
+
+                    del self._pending[key]
+                    return
+
+                func, args, kwargs, future = pendingTasks.popleft()
+
+            if (not future.set_running_or_notify_cancel()): continue
+
+            start = perf_counter()
+
+            try:
+                future.set_result(func(*args, **kwargs))
+
+            except BaseException as err:
+                future.set_exception(err)
+
+            self._latencies.append(perf_counter() - start)
+
+
+    def getLatencyPercentiles(self) -> dict | None:
+
+        # Palauttaa tehtävien suoritusaikojen persentiilit millisekunteina.
+        latencies = list(self._latencies)
+
+        if (len(latencies) < 2): return None
+
+        percentiles = quantiles(latencies, n=100)
+
+        return {
+
+            "count": len(latencies),
+            "p50": percentiles[49] * 1000,
+            "p90": percentiles[89] * 1000,
+            "p99": percentiles[98] * 1000,
+            "max": max(latencies) * 1000
+
+        }
+
+
+    def shutdown(self, wait: bool = True) -> None:
+
+        self._executor.shutdown(wait=wait)
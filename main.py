@@ -14,6 +14,16 @@ if (__name__ == "__main__"):
     # Disable warnings for self-signed certificates.
     urllib3.disable_warnings()
 
+    # Database changes are passed to the inspector through a bounded in-process event bus by default
+    # (LocalEventBus(maxSize=10000)). Use eventBus=ManagerEventBus() (kuisti.eventbuses.manager) if
+    # events must cross process boundaries.
+    # State is kept in memory by default. Use db=Sqlite(database="kuisti.db") (kuisti.databases.sqlite)
+    # to keep presence, timestamps and filters on disk across restarts. Wrap several databases in
+    # db=Sharded(database=[...]) (kuisti.databases.sharded) to give each group of users its own writer thread.
+    # To share one state between several processes, serve it with DatabaseServer(db, "/run/kuisti/db.sock").start()
+    # and pass db=Remote(database="/run/kuisti/db.sock") (kuisti.databases.remote) to the other processes.
+    # With the "journal" section in environment.json, the in-memory state is journaled to disk and restored
+    # on restart; a fresh enough journal skips the full directory and firewall check at boot.
     kuisti = Kuisti("log_detection.json", "environment.json")
     logHandler = DefaultLogHandler(kuisti)
 
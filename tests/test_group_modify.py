@@ -0,0 +1,224 @@
+from contextlib import contextmanager
+from ldap3 import MODIFY_ADD, MODIFY_DELETE
+from pathlib import Path
+from threading import Lock
+from time import sleep
+import sys, unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kuisti.cache import GroupCache
+from kuisti.error import KuistiLdapModificationError
+from kuisti.ldap import GroupModifyQueue
+
+
+
+GROUP_DN = "CN=KuistiRoom_halli,DC=demo,DC=internal"
+
+
+
+class AdConnection():
+
+    # Jäljittelee Active Directoryn modify-operaatiota: koko operaatio hylätään, jos lisättävä jäsen on jo ryhmässä (68)
+    # tai poistettava jäsen ei ole siinä (53). Ryhmä "denied" hylkää kaikki muutokset (insufficientAccessRights).
+    def __init__(self, groups: dict) -> None:
+
+        self.groups = groups
+        self.calls = []
+        self.result = None
+        self.usn = 1
+
+
+    def modify(self, groupDn: str, changes: dict) -> bool:
+
+        self.calls.append(changes["member"])
+
+        if (groupDn.startswith("CN=denied")):
+
+            self.result = {"result": 50, "description": "insufficientAccessRights"}
+            return False
+
+        members = self.groups.setdefault(groupDn, set())
+
+        for op, values in changes["member"]:
+            for value in values:
+
+                if ((op == MODIFY_ADD) and (value in members)):
+
+                    self.result = {"result": 68, "description": "entryAlreadyExists"}
+                    return False
+
+                if ((op == MODIFY_DELETE) and (value not in members)):
+
+                    self.result = {"result": 53, "description": "unwillingToPerform"}
+                    return False
+
+        for op, values in changes["member"]:
+
+            if (op == MODIFY_ADD): members.update(values)
+            else: members.difference_update(values)
+
+        self.usn += 1
+        self.result = {"result": 0, "description": "success"}
+        return True
+
+
+    def getGroupMembers(self, searchBase: str, groupDn: str) -> tuple[list[str], int]:
+
+        return list(self.groups.get(groupDn, ())), self.usn
+
+
+    def getObjectAttr(self, searchBase: str, searchFilter: str, attributes: list[str]) -> dict:
+
+        return {"uSNChanged": [self.usn]}
+
+
+
+class Pool():
+
+    def __init__(self, connection: AdConnection) -> None:
+
+        self._connection = connection
+        self._lock = Lock()
+
+
+    @contextmanager
+    def connection(self):
+
+        with self._lock:
+            yield self._connection
+
+
+
+class StaleCache():
+
+    # Välimuisti, jonka mukaan ryhmä on tyhjä (hakemistoa on muutettu välimuistin ohi).
+    def __init__(self) -> None:
+
+        self.added = []
+        self.removed = []
+
+
+    def isMember(self, groupDn: str, userDn: str, maxAge: float | None = None) -> bool:
+
+        return False
+
+
+    def addMember(self, groupDn: str, userDn: str) -> None:
+
+        self.added.append(userDn)
+
+
+    def removeMember(self, groupDn: str, userDn: str) -> None:
+
+        self.removed.append(userDn)
+
+
+    def invalidate(self, groupDn: str | None = None) -> None:
+
+        pass
+
+
+
+class GroupModifyQueueTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+
+        self.groups = {GROUP_DN: {"CN=stale,DC=demo,DC=internal"}}
+        self.connection = AdConnection(self.groups)
+        self.cache = StaleCache()
+        self.queue = GroupModifyQueue(Pool(self.connection), self.cache, window=0.05)
+
+
+    def tearDown(self) -> None:
+
+        self.queue.close()
+
+
+    def test_mixed_batch_is_resent_per_member(self) -> None:
+
+        members = ["CN=stale,DC=demo,DC=internal", "CN=user1,DC=demo,DC=internal", "CN=user2,DC=demo,DC=internal"]
+        futures = [self.queue.addMember(GROUP_DN, member) for member in members]
+
+        self.assertTrue(self.queue.flush(5))
+
+        # Koottu muutos hylätään (68), ja jäsenet lähetetään uudelleen yksitellen.
+        self.assertEqual(len(self.connection.calls), 1 + len(members))
+        self.assertEqual([future.result(0) for future in futures], [True, True, True])
+        self.assertEqual(self.groups[GROUP_DN], set(members))
+        self.assertEqual(self.queue.getStats()["fallbacks"], 1)
+        self.assertEqual(self.queue.getStats()["failed"], 0)
+
+
+    def test_remove_of_non_member_succeeds(self) -> None:
+
+        # Välimuistin mukaan jäsen on ryhmässä, mutta hakemistossa ei (53).
+        self.cache.isMember = lambda groupDn, userDn, maxAge=None: True
+        futures = [self.queue.removeMember(GROUP_DN, member) for member in ("CN=stale,DC=demo,DC=internal", "CN=gone,DC=demo,DC=internal")]
+
+        self.assertTrue(self.queue.flush(5))
+        self.assertEqual([future.result(0) for future in futures], [True, True])
+        self.assertEqual(self.groups[GROUP_DN], set())
+
+
+    def test_add_then_remove_cancels(self) -> None:
+
+        added = self.queue.addMember(GROUP_DN, "CN=user1,DC=demo,DC=internal")
+        removed = self.queue.removeMember(GROUP_DN, "CN=user1,DC=demo,DC=internal")
+
+        self.assertTrue(added.done() and removed.done())
+        self.assertTrue(added.result(0) and removed.result(0))
+
+        self.assertTrue(self.queue.flush(5))
+        self.assertEqual(self.connection.calls, [])
+        self.assertEqual(self.queue.getStats()["cancelled"], 1)
+
+
+    def test_duplicate_requests_share_one_change(self) -> None:
+
+        futures = [self.queue.addMember(GROUP_DN, "CN=user1,DC=demo,DC=internal") for _ in range(3)]
+
+        self.assertTrue(self.queue.flush(5))
+        self.assertEqual(len(self.connection.calls), 1)
+        self.assertEqual([future.result(0) for future in futures], [True, True, True])
+        self.assertEqual(self.cache.added, ["CN=user1,DC=demo,DC=internal"])
+
+
+    def test_stale_cache_entry_is_revalidated_before_skip(self) -> None:
+
+        cache = GroupCache(self.connection, "DC=demo,DC=internal")
+        queue = GroupModifyQueue(Pool(self.connection), cache, window=0.05, maxCacheAge=0.1)
+        self.addCleanup(queue.close)
+
+        self.assertTrue(cache.isMember(GROUP_DN, "CN=stale,DC=demo,DC=internal"))
+
+        # Jäsen poistetaan hakemistosta välimuistin ohi. Tuoreen välimuistin perusteella lisäys kuitataan heti, mutta
+        # maxCacheAge-ajan jälkeen ryhmä tarkastetaan hakemistosta, ja jäsen lisätään uudelleen.
+        self.groups[GROUP_DN].clear()
+        self.connection.usn += 1
+
+        self.assertTrue(queue.addMember(GROUP_DN, "CN=stale,DC=demo,DC=internal").result(0))
+        self.assertEqual(queue.getStats()["skipped"], 1)
+
+        sleep(0.2)
+        future = queue.addMember(GROUP_DN, "CN=stale,DC=demo,DC=internal")
+
+        self.assertTrue(queue.flush(5))
+        self.assertTrue(future.result(0))
+        self.assertEqual(self.groups[GROUP_DN], {"CN=stale,DC=demo,DC=internal"})
+        self.assertEqual(queue.getStats()["skipped"], 1)
+
+
+    def test_failure_is_reported_to_every_caller(self) -> None:
+
+        futures = [self.queue.addMember("CN=denied,DC=demo,DC=internal", f"CN=user{n},DC=demo,DC=internal") for n in range(2)]
+
+        self.assertTrue(self.queue.flush(5))
+
+        for future in futures:
+            self.assertIsInstance(future.exception(0), KuistiLdapModificationError)
+
+
+
+if (__name__ == "__main__"):
+    unittest.main()